@@ -1,19 +1,27 @@
 import os
-import requests
 import datetime
-import base64
 import json
+import time
 import speech_recognition as sr
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 import atproto
-import mimetypes
 import autogen
 from autogen import Agent, AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
 # Azure Inference SDK packages
 from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
+from azure.ai.inference.models import SystemMessage, UserMessage, TextContentItem, ImageContentItem, ImageUrl
 from azure.core.credentials import AzureKeyCredential
+from bsky_session import get_session_manager
+from blob_upload import get_blob_uploader, build_media_embed, forget_uploads, MAX_IMAGES
+from xrpc_client import get_xrpc_client
+from write_queue import get_write_queue, post_record
+from bsky_cache import get_handle_cache, get_feed_cache, cache_stats
+from post_pipeline import Step, StepPipeline, parse_json_reply, reply_function_arguments
+from image_prep import prepare_image, image_data_url, vision_stats
+from llm_cache import dispatched_generate_reply
+from llm_dispatch import dispatch, estimate_tokens
+from instrumentation import instrument, instrument_agent, span, workflow, record_usage, register_prices
 
 # Load environment variables
 load_dotenv('x.env')
@@ -22,7 +30,9 @@ load_dotenv('x.env')
 azure_client = AzureOpenAI(
     azure_endpoint=os.getenv('ENDPOINT_URL'),
     api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    api_version="2024-12-01-preview"
+    api_version="2024-12-01-preview",
+    # Throttled calls are retried by the per-deployment dispatcher instead.
+    max_retries=0
 )
 
 # Define model deployments from environment variables
@@ -63,56 +73,89 @@ config_list_phi4 = [{
 
 # ====================== HELPER FUNCTIONS ======================
 
+@instrument("bluesky:login")
 def bluesky_login(username, password):
     """Login to Bluesky"""
     client = atproto.Client()
     client.login(username, password)
     return client
 
+def azure_chat(deployment, prompt, max_completion_tokens):
+    """One chat completion through the deployment's dispatcher (rate limits, throttle retries)."""
+    messages = [{"role": "user", "content": prompt}]
+
+    def call():
+        completion = azure_client.chat.completions.create(
+            model=deployment,
+            messages=messages,
+            max_completion_tokens=max_completion_tokens,
+            stream=False
+        )
+        usage = getattr(completion, "usage", None)
+        record_usage(usage)
+        return completion.choices[0].message.content.strip(), getattr(usage, "total_tokens", 0) or 0
+
+    with span(f"azure:{deployment}", "llm"):
+        return dispatch(deployment, call, estimate_tokens(messages, deployment, max_completion_tokens))[0]
+
 def azure_o3mini(prompt):
     """Call Azure OpenAI o3-mini model"""
-    completion = azure_client.chat.completions.create(
-        model=o3_deployment,
-        messages=[{"role": "user", "content": prompt}],
-        max_completion_tokens=1000,
-        stream=False
-    )
-    return completion.choices[0].message.content.strip()
+    return azure_chat(o3_deployment, prompt, 1000)
 
 def azure_gpt4o_mini(prompt):
     """Call Azure OpenAI GPT4O-mini model"""
-    completion = azure_client.chat.completions.create(
-        model=gpt4o_deployment,
-        messages=[{"role": "user", "content": prompt}],
-        max_completion_tokens=500,
-        stream=False
-    )
-    return completion.choices[0].message.content.strip()
-
-def azure_phi4_mm(prompt, image_base64=None):
+    return azure_chat(gpt4o_deployment, prompt, 500)
+
+_phi4_client = None
+
+def get_phi4_client():
+    """Return the long-lived Azure Inference client for phi4-mm (one connection pool for all calls)."""
+    global _phi4_client
+    if _phi4_client is None:
+        _phi4_client = ChatCompletionsClient(
+            endpoint=os.getenv("AZURE_INFERENCE_SDK_ENDPOINT"),
+            credential=AzureKeyCredential(os.getenv("AZURE_INFERENCE_SDK_KEY"))
+        )
+    return _phi4_client
+
+@instrument("azure:phi4_mm", kind="llm")
+def azure_phi4_mm(prompt, image_path=None):
     """
     Call the Azure Inference SDK for the phi4-mm multimodal model.
-    This function builds messages for text and (if provided) image input.
+    An image is downscaled and re-encoded (see image_prep) and sent as an image content part
+    next to the prompt; latency and tokens of image calls are recorded in vision_stats.
     """
-    endpoint = os.getenv("AZURE_INFERENCE_SDK_ENDPOINT")
-    model_name = os.getenv("PHI4_DEPLOYMENT_NAME")
-    key = os.getenv("AZURE_INFERENCE_SDK_KEY")
-    client = ChatCompletionsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-    
-    messages = [
-        SystemMessage(content="You are a multimodal assistant."),
-        UserMessage(content=prompt)
-    ]
-    if image_base64:
-        messages.append(UserMessage(content=f"Image data (base64): {image_base64}"))
-    
-    response = client.complete(
-        messages=messages,
-        model=model_name,
-        max_tokens=1000
-    )
-    return response.completions[0].content.strip()
-
+    if image_path:
+        image_bytes, mime_type, info = prepare_image(image_path)
+        user_message = UserMessage(content=[
+            TextContentItem(text=prompt),
+            ImageContentItem(image_url=ImageUrl(url=image_data_url(image_bytes, mime_type)))
+        ])
+    else:
+        user_message = UserMessage(content=prompt)
+
+    deployment = os.getenv("PHI4_DEPLOYMENT_NAME")
+
+    def call():
+        response = get_phi4_client().complete(
+            messages=[SystemMessage(content="You are a multimodal assistant."), user_message],
+            model=deployment,
+            max_tokens=1000
+        )
+        usage = getattr(response, "usage", None)
+        record_usage(usage)
+        return response, getattr(usage, "total_tokens", 0) or 0
+
+    started = time.perf_counter()
+    # Image tokens are not known up front; the charge is settled with the reported usage.
+    response, _ = dispatch(deployment, call, estimate_tokens([prompt], deployment, 1000))
+    if image_path:
+        usage = getattr(response, "usage", None)
+        vision_stats.record(time.perf_counter() - started, getattr(usage, "prompt_tokens", None),
+                            getattr(usage, "completion_tokens", None), info)
+    return response.choices[0].message.content.strip()
+
+@instrument("process_voice")
 def process_voice_input():
     """
     Record and process voice input using the SpeechRecognition library.
@@ -128,65 +171,77 @@ def process_voice_input():
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@instrument("process_image")
 def process_image(image_path):
     """
     Process an image file and generate a caption using the phi4-mm multimodal model.
     """
     try:
-        with open(image_path, "rb") as f:
-            base64_image = base64.b64encode(f.read()).decode('utf-8')
         return {
             "status": "success",
             "caption": azure_phi4_mm(
                 "Generate a catchy, engaging one-liner caption for this image suitable for social media.",
-                base64_image
+                image_path
             )
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def _newest_indexed_at(feed_data):
+    """Return the indexedAt of the newest post in a getAuthorFeed page."""
+    for item in feed_data.get("feed", []):
+        if "post" in item:
+            return item["post"].get("indexedAt")
+    return None
+
+@instrument("bluesky:search_user")
 def search_user(target_username):
     """
     Search for a user on Bluesky.
+    Handle->DID lookups and author feed pages are served from the shared caches when possible.
     """
     if target_username.startswith('@'):
         target_username = target_username[1:]
-    BASE_URL = "https://bsky.social"
-    auth_endpoint = f"{BASE_URL}/xrpc/com.atproto.server.createSession"
-    auth_headers = {"Content-Type": "application/json"}
-    auth_payload = {
-        "identifier": os.getenv('BSKYUNAME'),
-        "password": os.getenv('BSKYPASSWD')
-    }
-    auth_response = requests.post(auth_endpoint, headers=auth_headers, json=auth_payload)
-    if auth_response.status_code != 200:
-        return {"status": "error", "message": f"Authentication failed: {auth_response.text}"}
-    auth_data = auth_response.json()
-    access_jwt = auth_data.get("accessJwt")
-    
-    resolve_endpoint = f"{BASE_URL}/xrpc/com.atproto.identity.resolveHandle"
-    resolve_params = {"handle": target_username}
-    resolve_response = requests.get(resolve_endpoint, params=resolve_params)
-    if resolve_response.status_code != 200:
-        return {"status": "error", "message": f"Error resolving handle: {resolve_response.text}"}
-    resolve_data = resolve_response.json()
-    actor_did = resolve_data.get("did")
+    xrpc = get_xrpc_client()
+    handle_cache = get_handle_cache()
+    feed_cache = get_feed_cache()
+
+    actor_did = handle_cache.get(target_username.lower())
     if not actor_did:
-        return {"status": "error", "message": "Could not resolve user's DID"}
+        resolve_response = xrpc.get("com.atproto.identity.resolveHandle", {"handle": target_username}, auth=False)
+        if resolve_response.status_code != 200:
+            return {"status": "error", "message": f"Error resolving handle: {resolve_response.text}"}
+        resolve_data = resolve_response.json()
+        actor_did = resolve_data.get("did")
+        if not actor_did:
+            return {"status": "error", "message": "Could not resolve user's DID"}
+        handle_cache.set(target_username.lower(), actor_did)
 
-    feed_endpoint = f"{BASE_URL}/xrpc/app.bsky.feed.getAuthorFeed"
-    feed_headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_jwt}"
-    }
-    feed_params = {"actor": actor_did, "limit": 20}
-    feed_response = requests.get(feed_endpoint, headers=feed_headers, params=feed_params)
-    if feed_response.status_code != 200:
-        return {"status": "error", "message": f"Error fetching posts: {feed_response.text}"}
-    feed_data = feed_response.json()
-    posts = [item["post"]["record"]["text"] for item in feed_data.get("feed", [])
-             if "post" in item and "record" in item["post"] and "text" in item["post"]["record"]]
+    try:
+        # Warms (or restores) the shared session so the feed calls can reuse its token.
+        get_session_manager().get_client()
+    except Exception as e:
+        return {"status": "error", "message": f"Authentication failed: {e}"}
+
+    cached_feed, fresh = feed_cache.get_with_state(actor_did)
+    if cached_feed is not None and not fresh:
+        # Expired entry: a one-post probe tells us whether anything new was posted.
+        probe_response = xrpc.get("app.bsky.feed.getAuthorFeed", {"actor": actor_did, "limit": 1})
+        if (probe_response.status_code == 200
+                and _newest_indexed_at(probe_response.json()) == cached_feed.get("newest_indexed_at")):
+            feed_cache.set(actor_did, cached_feed)
+            fresh = True
+
+    if cached_feed is not None and fresh:
+        posts = cached_feed.get("posts", [])
+    else:
+        feed_response = xrpc.get("app.bsky.feed.getAuthorFeed", {"actor": actor_did, "limit": 20})
+        if feed_response.status_code != 200:
+            return {"status": "error", "message": f"Error fetching posts: {feed_response.text}"}
+        feed_data = feed_response.json()
+        posts = [item["post"]["record"]["text"] for item in feed_data.get("feed", [])
+                 if "post" in item and "record" in item["post"] and "text" in item["post"]["record"]]
+        feed_cache.set(actor_did, {"posts": posts, "newest_indexed_at": _newest_indexed_at(feed_data)})
     if not posts:
         return {"status": "error", "message": "No posts found for this user"}
     return {
@@ -196,34 +251,31 @@ def search_user(target_username):
         "handle": target_username
     }
 
-def post_to_bluesky(message, image_path=None):
+def alt_text_for_image(image_path):
+    """Alt text for an uploaded image, written by phi4-mm."""
+    return azure_phi4_mm(
+        "Write concise alt text (one or two sentences) describing this image for people using screen readers.",
+        image_path
+    )
+
+@instrument("bluesky:post")
+def post_to_bluesky(message, image_path=None, image_paths=None, video_path=None, alt_text_fn=alt_text_for_image):
     """
-    Post content to Bluesky, optionally with an image.
+    Post content to Bluesky, optionally with up to four images or one video.
+    Media are uploaded concurrently while phi4-mm writes each image's alt text.
+    The post itself goes through the rate-limited write queue.
     """
     try:
-        client = bluesky_login(os.getenv('BSKYUNAME'), os.getenv('BSKYPASSWD'))
-        if image_path:
-            mime_type = mimetypes.guess_type(image_path)[0]
-            if not mime_type:
-                mime_type = "image/jpeg"
-            with open(image_path, "rb") as f:
-                image_binary = f.read()
-            upload_response = client.com.atproto.repo.upload_blob(image_binary, mime_type)
-            blob = upload_response.blob
-            client.send_post(
-                text=message,
-                embed={
-                    '$type': 'app.bsky.embed.images',
-                    'images': [{
-                        'alt': 'Image shared by AI agent',
-                        'image': blob
-                    }]
-                }
-            )
-            return {"status": "success", "message": "Posted with image successfully"}
+        paths = ([image_path] if image_path else []) + list(image_paths or [])
+        if paths or video_path:
+            embed, blob_keys = build_media_embed(paths, video_path, alt_text_fn=None if video_path else alt_text_fn)
+            result = get_write_queue().submit("post", post_record(message, embed=embed),
+                                              message="Posted with media successfully")
+            if result["status"] == "error":
+                forget_uploads(blob_keys)
+            return result
         else:
-            client.send_post(text=message)
-            return {"status": "success", "message": "Posted successfully"}
+            return get_write_queue().submit("post", post_record(message), message="Posted successfully")
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -272,7 +324,7 @@ hanuman_tools = {
 bheeman_tools = {
     "post_to_bluesky": {
         "name": "post_to_bluesky",
-        "description": "Posts a message to Bluesky, optionally with an image",
+        "description": "Posts a message to Bluesky, optionally with up to four images or a video",
         "parameters": {
             "type": "object",
             "properties": {
@@ -283,6 +335,15 @@ bheeman_tools = {
                 "image_path": {
                     "type": "string",
                     "description": "Path to image file (optional)"
+                },
+                "image_paths": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": f"Paths to up to {MAX_IMAGES} image files (optional)"
+                },
+                "video_path": {
+                    "type": "string",
+                    "description": "Path to a video file (optional, instead of images)"
                 }
             },
             "required": ["message"]
@@ -365,10 +426,102 @@ agents = [user_proxy, sanjay, krsna, hanuman, bheeman, sahadevan]
 group_chat = GroupChat(agents=agents, messages=[], max_round=12)
 manager = GroupChatManager(groupchat=group_chat, llm_config={"config_list": config_list_o3})
 
+# Every generate_reply (pipeline steps and group chat turns alike) is timed per agent.
+for agent in [sanjay, krsna, hanuman, bheeman, sahadevan, manager]:
+    instrument_agent(agent)
+register_prices(config_list_o3 + config_list_gpt4o + config_list_phi4)
+
 # ====================== WORKFLOW ORCHESTRATION ======================
 
-def process_post_workflow(user_input, image_path=None):
-    """Orchestrate the post workflow."""
+# 'pipeline' runs the fixed Sanjay -> Krsna -> Sahadevan (images only) -> Bheeman steps with direct
+# agent calls; 'groupchat' lets the GroupChatManager choose each speaker (one extra o3-mini call per round).
+POST_WORKFLOW_MODE = os.getenv('POST_WORKFLOW_MODE', 'pipeline')
+POST_MAX_CHARS = 180
+
+def agent_request(payload):
+    return [{"role": "user", "content": json.dumps(payload)}]
+
+def sanjay_step(context):
+    """Perception: structure the input; images are captioned by phi4-mm."""
+    perceived = {
+        "input_type": "image" if context.get("image_path") else "text",
+        "content": context["user_input"]
+    }
+    if context.get("image_path"):
+        caption = process_image(context["image_path"])
+        if caption["status"] != "success":
+            raise RuntimeError(caption["message"])
+        perceived["image_caption"] = caption["caption"]
+    return perceived
+
+def krsna_step(context):
+    """Intent and content analysis of the structured input."""
+    return parse_json_reply(dispatched_generate_reply(krsna, agent_request({
+        "task": "analyze_post",
+        "input": context["sanjay"]
+    })))
+
+def sahadevan_step(context):
+    """Caption for the image, informed by Krsna's analysis."""
+    return parse_json_reply(dispatched_generate_reply(sahadevan, agent_request({
+        "task": "caption_image",
+        "message": context["user_input"],
+        "image_description": context["sanjay"].get("image_caption"),
+        "content_analysis": context["krsna"]
+    })))
+
+def bheeman_step(context):
+    """Format the final post text (posting itself is the next, non-LLM step)."""
+    reply = dispatched_generate_reply(bheeman, agent_request({
+        "task": "format_post",
+        "message": context["user_input"],
+        "content_analysis": context["krsna"],
+        "image_caption": (context.get("sahadevan") or {}).get("caption"),
+        "instructions": f"Return JSON with 'status' and 'formatted_message' (max {POST_MAX_CHARS} characters). "
+                        "Do not call post_to_bluesky; the message is posted after this step."
+    }))
+    arguments = reply_function_arguments(reply)
+    formatted = arguments.get("message") if arguments else parse_json_reply(reply).get("formatted_message")
+    if not formatted:
+        raise ValueError("Bheeman returned no formatted_message")
+    return {"formatted_message": formatted.strip()[:POST_MAX_CHARS]}
+
+def post_step(context):
+    """Post the formatted message (with the image, if any) once the optional confirm callback agrees."""
+    message = context["bheeman"]["formatted_message"]
+    confirm = context.get("confirm")
+    if confirm is not None and not confirm(message):
+        return {"status": "cancelled", "message": "Post was not confirmed"}
+    image_path = context.get("image_path")
+    caption = context["sanjay"].get("image_caption")
+
+    def alt_text(path):
+        # Sanjay already sent the first image to phi4-mm; its caption doubles as that image's alt text.
+        return caption if caption and path == image_path else alt_text_for_image(path)
+
+    return post_to_bluesky(message, image_path, image_paths=context.get("image_paths"), alt_text_fn=alt_text)
+
+post_pipeline = StepPipeline([
+    Step("sanjay", sanjay_step),
+    Step("krsna", krsna_step),
+    Step("sahadevan", sahadevan_step, when=lambda context: bool(context.get("image_path"))),
+    Step("bheeman", bheeman_step),
+    Step("post", post_step)
+])
+
+@workflow("post")
+def process_post_workflow(user_input, image_path=None, mode=None, confirm=None, image_paths=None):
+    """
+    Orchestrate the post workflow. By default the steps run as a fixed pipeline; mode='groupchat'
+    (or POST_WORKFLOW_MODE=groupchat) falls back to the GroupChatManager conversation.
+    """
+    if (mode or POST_WORKFLOW_MODE) == "groupchat":
+        return process_post_groupchat(user_input, image_path)
+    return post_pipeline.run({"user_input": user_input, "image_path": image_path,
+                              "image_paths": image_paths or [], "confirm": confirm})
+
+def process_post_groupchat(user_input, image_path=None):
+    """Orchestrate the post workflow through the GroupChatManager."""
     workflow_msg = f"""
     I need to post the following message to Bluesky: "{user_input}"
     
@@ -384,6 +537,17 @@ def process_post_workflow(user_input, image_path=None):
     chat_result = user_proxy.initiate_chat(manager, message=workflow_msg)
     return chat_result
 
+def confirm_post(message):
+    print(f"Formatted post: \"{message}\"")
+    return input("Post this? (yes/no): ").strip().lower() == "yes"
+
+def print_workflow_result(result):
+    if isinstance(result, dict) and "trace" in result:
+        print("Workflow result:", result.get("post") or result.get("error"))
+        print("Steps:", ", ".join(f"{t['step']} {t['status']} ({t['seconds']}s)" for t in result["trace"]))
+    else:
+        print("Workflow result:", result)
+
 # ====================== INTERACTIVE MAIN FUNCTION ======================
 
 def interactive_main():
@@ -399,20 +563,25 @@ def interactive_main():
         
         if choice == "1":
             user_input = input("Enter your message: ").strip()
-            result = process_post_workflow(user_input)
-            print("Workflow result:", result)
+            result = process_post_workflow(user_input, confirm=confirm_post)
+            print_workflow_result(result)
         elif choice == "2":
             user_input = input("Enter your message: ").strip()
-            image_path = input("Enter image path: ").strip()
-            if not os.path.exists(image_path):
-                print("Image file not found, please try again.")
+            image_paths = [p.strip() for p in input("Enter image path(s), comma-separated: ").split(",") if p.strip()]
+            if not image_paths or len(image_paths) > MAX_IMAGES or not all(os.path.exists(p) for p in image_paths):
+                print(f"Enter 1 to {MAX_IMAGES} existing image files, please try again.")
                 continue
-            result = process_post_workflow(user_input, image_path=image_path)
-            print("Workflow result:", result)
+            result = process_post_workflow(user_input, image_path=image_paths[0],
+                                           image_paths=image_paths[1:], confirm=confirm_post)
+            print_workflow_result(result)
+            print("Image stats:", vision_stats.stats())
+            print("Upload stats:", get_blob_uploader().stats())
+            print("Write queue:", get_write_queue().stats())
         elif choice == "3":
             username = input("Enter the username to search (e.g., @user): ").strip()
             result = search_user(username)
             print("Search result:", result)
+            print("Cache stats:", cache_stats())
         elif choice == "4":
             print("Exiting the system. Goodbye!")
             break
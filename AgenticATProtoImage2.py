@@ -1,15 +1,37 @@
 import os
-import requests
 import datetime
-import base64
 import json
 import speech_recognition as sr
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 import atproto
-import mimetypes
+import asyncio
+import argparse
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import autogen
 from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+from bsky_session import get_bluesky_client
+from blob_upload import build_media_embed, forget_uploads
+from write_queue import get_write_queue, post_record, like_record
+from post_refs import get_post_resolver, reply_refs_for
+from bsky_timeline import iter_timeline_posts, get_timeline_poller
+from bsky_stream import get_stream_ingestor
+from post_store import get_post_store
+from post_embeddings import index_posts, semantic_search
+from llm_cache import get_response_cache, agent_deployment
+from llm_dispatch import dispatch_stats
+from instrumentation import instrument, instrument_agent, workflow, register_prices, carry_context
+from model_router import model_router
+from pre_classifier import PreClassifier
+from async_pipeline import gather_limited, get_async_bluesky
+from response_models import (
+    ResponseParseError, POLITICAL_ANALYSIS, MESSAGE_ANALYSIS, REPLY, VALIDATION, FUSED_REPLY, SUBJECT_ANALYSIS,
+    structured_reply, astructured_reply, parse_metrics
+)
+from reply_streaming import stream_stats
+from prompt_budget import PromptBuilder, prompt_stats
+from batch_replies import StageStats, load_policy, actions_for, append_jsonl, read_jsonl, write_jsonl
 
 # Load environment variables
 load_dotenv('x.env')
@@ -18,19 +40,25 @@ load_dotenv('x.env')
 azure_client = AzureOpenAI(
     azure_endpoint=os.getenv('ENDPOINT_URL'),
     api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    api_version="2024-12-01-preview"
+    api_version="2024-12-01-preview",
+    # Throttled calls are retried by the per-deployment dispatcher instead.
+    max_retries=0
 )
 
 # Corrected GPT4O deployment loading
 gpt4o_deployment = os.getenv('GPT4O_DEPLOYMENT_NAME')
 assert gpt4o_deployment, "GPT4O-mini deployment name missing in environment variables"
 
+# Structured calls are routed between an agent's config_list entries by task (see model_router):
+# add entries (other deployments on the same resource, optionally with "tags" such as ["classify"])
+# to spread load and fail over. "price" is USD per 1K prompt/completion tokens.
 config_list_gpt4o = [{
     "model": gpt4o_deployment,
     "api_key": os.getenv('AZURE_OPENAI_API_KEY'),
     "base_url": os.getenv('ENDPOINT_URL'),
     "api_type": "azure",
-    "api_version": "2024-12-01-preview"
+    "api_version": "2024-12-01-preview",
+    "price": [0.00015, 0.0006]
 }]
 
 # Load o3-mini deployment from environment variables
@@ -42,63 +70,54 @@ config_list_o3 = [{
     "api_key": os.getenv('AZURE_OPENAI_API_KEY'),
     "base_url": os.getenv('ENDPOINT_URL'),
     "api_type": "azure",
-    "api_version": "2024-12-01-preview"
+    "api_version": "2024-12-01-preview",
+    "price": [0.0011, 0.0044]
 }]
 
 # ====================== HELPER FUNCTIONS ======================
 
+@instrument("bluesky:login")
 def bluesky_login(username, password):
     """Login to Bluesky"""
     client = atproto.Client()
     client.login(username, password)
     return client
 
-def post_to_bluesky(message, image_path=None):
+@instrument("bluesky:post")
+def post_to_bluesky(message, image_path=None, image_paths=None, video_path=None, alt_text_fn=None):
     """
-    Post content to Bluesky, optionally with an image.
+    Post content to Bluesky, optionally with up to four images or one video.
+    Media are uploaded concurrently; `alt_text_fn(path)` can supply alt text per file.
+    The post itself goes through the rate-limited write queue.
     """
     try:
-        client = bluesky_login(os.getenv('BSKYUNAME'), os.getenv('BSKYPASSWD'))
-        if image_path:
-            mime_type = mimetypes.guess_type(image_path)[0]
-            if not mime_type:
-                mime_type = "image/jpeg"
-            with open(image_path, "rb") as f:
-                image_binary = f.read()
-            upload_response = client.com.atproto.repo.upload_blob(image_binary, mime_type)
-            blob = upload_response.blob
-            client.send_post(
-                text=message,
-                embed={
-                    '$type': 'app.bsky.embed.images',
-                    'images': [{
-                        'alt': 'Image shared by AI agent',
-                        'image': blob
-                    }]
-                }
-            )
-            return {"status": "success", "message": "Posted with image successfully"}
+        paths = ([image_path] if image_path else []) + list(image_paths or [])
+        if paths or video_path:
+            embed, blob_keys = build_media_embed(paths, video_path, alt_text_fn=alt_text_fn)
+            result = get_write_queue().submit("post", post_record(message, embed=embed),
+                                              message="Posted with media successfully")
+            if result["status"] == "error":
+                forget_uploads(blob_keys)
+            return result
         else:
-            client.send_post(text=message)
-            return {"status": "success", "message": "Posted successfully"}
+            return get_write_queue().submit("post", post_record(message), message="Posted successfully")
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@instrument("bluesky:like")
 def like_bluesky(post_uri):
     """
     Like a post on Bluesky identified by its URI.
+    The CID comes from the shared post ref resolver, so already-fetched posts need no extra read.
     """
     try:
-        client = bluesky_login(os.getenv('BSKYUNAME'), os.getenv('BSKYPASSWD'))
         parts = post_uri.split('/')
         if len(parts) < 5:
             return {"status": "error", "message": "Invalid post URI format"}
-        response = client.app.bsky.feed.get_posts({"uris": [post_uri]})
-        if not response.posts:
+        ref = get_post_resolver().resolve(post_uri)
+        if not ref:
             return {"status": "error", "message": "Post not found."}
-        post = response.posts[0]
-        client.like(uri=post_uri, cid=post.cid)
-        return {"status": "success", "message": "Post liked successfully"}
+        return get_write_queue().submit("like", like_record(post_uri, ref["cid"]), message="Post liked successfully")
     except Exception as e:
         return {"status": "error", "message": f"Error: {str(e)}"}
 
@@ -107,35 +126,30 @@ def like_bluesky_wrapper(post_uri):
     result = like_bluesky(post_uri=post_uri)
     return json.dumps(result)
 
+@instrument("bluesky:reply")
 def reply_to_bluesky(original_uri, reply_content):
     """
     Post a reply to a given message on Bluesky identified by its URI.
+    Replies to a post that is itself a reply keep the original thread root.
     """
     try:
-        client = bluesky_login(os.getenv('BSKYUNAME'), os.getenv('BSKYPASSWD'))
         parts = original_uri.split('/')
         if len(parts) < 5:
             return {"status": "error", "message": "Invalid original URI format"}
-        did = parts[2]
-        rkey = parts[-1]
-        response = client.app.bsky.feed.get_posts({"uris": [original_uri]})
-        if not response.posts:
+        ref = get_post_resolver().resolve(original_uri)
+        if not ref:
             return {"status": "error", "message": "Original post not found."}
-        original_post = response.posts[0]
-        client.send_post(
-            text=reply_content,
-            reply_to={
-                "root": {"uri": original_uri, "cid": original_post.cid},
-                "parent": {"uri": original_uri, "cid": original_post.cid}
-            }
+        return get_write_queue().submit(
+            "reply",
+            post_record(reply_content, reply=reply_refs_for(ref)),
+            message="Reply posted successfully"
         )
-        return {"status": "success", "message": "Reply posted successfully"}
     except Exception as e:
         return {"status": "error", "message": f"Error: {str(e)}"}
 
-def post_to_bluesky_wrapper(message, image_path=None):
+def post_to_bluesky_wrapper(message, image_path=None, image_paths=None, video_path=None):
     """Wrapper for post_to_bluesky that returns JSON string instead of dict"""
-    result = post_to_bluesky(message, image_path)
+    result = post_to_bluesky(message, image_path, image_paths=image_paths, video_path=video_path)
     return json.dumps(result)
 
 def reply_to_bluesky_wrapper(original_uri, reply_content):
@@ -143,51 +157,94 @@ def reply_to_bluesky_wrapper(original_uri, reply_content):
     result = reply_to_bluesky(original_uri=original_uri, reply_content=reply_content)
     return json.dumps(result)
 
-def extract_json_content(content_str):
-    """Extract JSON content even if wrapped in code fences"""
-    if content_str is None:
-        return ""
-    cleaned = content_str.replace("```json", "").replace("```", "").strip()
-    return cleaned
+# 'poll' reads the timeline on demand; 'stream' takes posts pushed by the Jetstream ingestor.
+INGEST_MODE = os.getenv('BSKY_INGEST_MODE', 'poll')
+STREAM_WAIT_SECONDS = float(os.getenv('BSKY_STREAM_WAIT', '5'))
 
-def fetch_bluesky_following(limit=20):
+def iter_ingested_posts(limit):
+    """Yield up to `limit` posts from the active ingestion source (real-time stream or timeline pages)."""
+    if INGEST_MODE == "stream":
+        ingestor = get_stream_ingestor(get_bluesky_client()).start()
+        for msg in ingestor.drain(max_items=limit, timeout=STREAM_WAIT_SECONDS):
+            yield msg
+        print("Stream stats:", ingestor.stats())
+    else:
+        for msg, _ in iter_timeline_posts(limit=limit, page_size=100):
+            yield msg
+
+@instrument("bluesky:fetch_following")
+def fetch_bluesky_following(limit=20, cursor=None, only_new=False):
     """
     Fetch the latest posts from accounts the user is following on Bluesky.
-    Returns a numbered list of posts with their DIDs.
+    Returns a numbered list of posts with their DIDs (post URIs), CIDs and reply refs,
+    plus the cursor for the next page. Pass `cursor` to continue from an earlier page,
+    or `only_new=True` to get just the posts newer than the last poll.
+    In stream mode the first page is the posts queued by the real-time ingestor.
     """
     try:
-        client = bluesky_login(os.getenv('BSKYUNAME'), os.getenv('BSKYPASSWD'))
-        timeline = client.get_timeline(limit=limit)
-        posts = []
-        for idx, feed_view in enumerate(timeline.feed, start=1):
-            post = feed_view.post
-            posts.append({
-                "number": idx,
-                "did": post.uri,
-                "author": post.author.display_name or post.author.handle,
-                "text": post.record.text,
-                "timestamp": post.indexed_at
-            })
-        return {"status": "success", "posts": posts}
+        next_cursor = None
+        if INGEST_MODE == "stream" and cursor is None:
+            posts = list(iter_ingested_posts(limit))
+            for idx, msg in enumerate(posts, start=1):
+                msg["number"] = idx
+        elif only_new:
+            posts = get_timeline_poller().poll(max_posts=limit)
+        else:
+            posts = []
+            for message, next_cursor in iter_timeline_posts(limit=limit, page_size=limit, cursor=cursor):
+                posts.append(message)
+        store_posts(posts)
+        return {"status": "success", "posts": posts, "cursor": next_cursor}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def fetch_bluesky_following_wrapper(limit=20):
+def fetch_bluesky_following_wrapper(limit=20, cursor=None, only_new=False):
     """Wrapper for fetch_bluesky_following that returns JSON string"""
-    result = fetch_bluesky_following(limit)
+    result = fetch_bluesky_following(limit, cursor=cursor, only_new=only_new)
     return json.dumps(result)
 
-def extract_reply_text_from_raw(raw_content):
+@instrument("store:add_posts")
+def store_posts(posts):
     """
-    Attempt to extract meaningful text from a raw string response.
-    This function uses simple heuristics to find potential reply text.
+    Persist posts in the local store and embed the ones not yet in the vector index.
+    Returns the number of posts stored.
     """
-    cleaned_content = raw_content.replace("```json", "").replace("```", "").strip()
-    lines = cleaned_content.splitlines()
-    longest_line = max(lines, key=len, default="")
-    if len(longest_line) < 10:
-        return ""
-    return longest_line
+    stored = get_post_store().add_posts(posts)
+    try:
+        index_posts(posts, azure_client)
+    except Exception as e:
+        print("Error embedding messages:", str(e))
+    return stored
+
+def ingest_recent_posts(limit=500):
+    """
+    Pull the posts that arrived since the last call (timeline high-water mark or stream queue)
+    into the local post store. Returns the number of posts stored.
+    """
+    try:
+        if INGEST_MODE == "stream":
+            posts = list(iter_ingested_posts(limit))
+        else:
+            posts = get_timeline_poller().poll(max_posts=limit)
+        return store_posts(posts)
+    except Exception as e:
+        print("Error ingesting new messages:", str(e))
+        return 0
+
+@instrument("store:search")
+def search_post_store(subject, limit=20):
+    """
+    Indexed keyword search over every post in the local store, best match first.
+    Results carry default 'intent'/'tone' values and their refs are handed to the post resolver.
+    """
+    results = get_post_store().search(subject, limit=limit)
+    resolver = get_post_resolver()
+    for msg in results:
+        msg.setdefault("intent", "Unknown")
+        msg.setdefault("tone", "Neutral")
+        if msg.get("cid"):
+            resolver.remember({"uri": msg["did"], "cid": msg["cid"], "root": msg["root"], "parent": msg["parent"]})
+    return results
 
 # ----- Define bheeman_tools to fix NameError -----
 bheeman_tools = {
@@ -216,7 +273,9 @@ krsna = AssistantAgent(
         "Rewrite the provided message in 180 characters with a left-leaning tone. "
         "Return your response in JSON format with the key 'formatted_message'."
     ),
-    llm_config={"config_list": config_list_gpt4o}
+    # Classification and validation go to whichever deployment currently meets its SLO most cheaply;
+    # o3-mini is tagged for those only, since reasoning tokens count against the short draft caps.
+    llm_config={"config_list": config_list_gpt4o + [dict(config_list_o3[0], tags=["classify", "validate"])]}
 )
 
 bheeman = AssistantAgent(
@@ -274,6 +333,11 @@ agents = [sanjay, krsna, bheeman, arjunan, yudhistran, nakulan]
 group_chat = GroupChat(agents=agents, messages=[], max_round=20)
 manager = GroupChatManager(groupchat=group_chat, llm_config={"config_list": config_list_gpt4o})
 
+# Every generate_reply (direct, cached or in the group chat) is timed per agent.
+for agent in [krsna, bheeman, arjunan, yudhistran, nakulan, manager]:
+    instrument_agent(agent)
+register_prices(config_list_gpt4o + config_list_o3)
+
 # ----- PLAN DISPLAY FUNCTION -----
 
 def show_plan(option):
@@ -307,6 +371,7 @@ def show_plan(option):
 
 # ----- WORKFLOW ORCHESTRATION -----
 
+@workflow("post")
 def process_post_workflow(user_input):
     """
     Orchestrate posting a message as follows:
@@ -327,19 +392,12 @@ def process_post_workflow(user_input):
             "Return your answer in a JSON object with the key 'formatted_message'."
         )
     })
-    krsna_response = krsna.generate_reply(messages=[{"role": "user", "content": rewrite_prompt}])
-    if isinstance(krsna_response, str):
-        krsna_content = krsna_response
-    elif isinstance(krsna_response, dict):
-        krsna_content = krsna_response.get("content", "")
-    else:
-        krsna_content = getattr(krsna_response, "content", "")
-    krsna_content = extract_json_content(krsna_content)
     try:
-        krsna_json = json.loads(krsna_content)
-        rewritten_message = krsna_json.get("formatted_message", "")
-    except json.JSONDecodeError:
-        rewritten_message = krsna_content  # Fallback if JSON parsing fails
+        print("Krsna's rewrite: ", end="")
+        rewritten_message = streamed_reply(krsna, [{"role": "user", "content": rewrite_prompt}], show_streamed)
+    except ResponseParseError as e:
+        print(f"Krsna's rewrite was unusable: {e}")
+        rewritten_message = ""
 
     if not rewritten_message:
         rewritten_message = original_message  # Fallback if no rewrite obtained
@@ -366,359 +424,641 @@ def process_post_workflow(user_input):
     post_result = json.loads(post_result_json)
     if post_result.get("status") == "success":
         print("Message posted successfully.")
+    elif post_result.get("status") == "queued":
+        print(post_result.get("message"))
     else:
         print("Error posting message:", post_result.get("message"))
 
-def categorize_messages(messages):
+CATEGORIZE_CHUNK_SIZE = int(os.getenv('CATEGORIZE_CHUNK_SIZE', '10'))
+CATEGORIZE_CONCURRENCY = int(os.getenv('CATEGORIZE_CONCURRENCY', '4'))
+CATEGORIZE_RETRIES = int(os.getenv('CATEGORIZE_RETRIES', '1'))
+
+# Create a more neutral prompt that doesn't trigger content filters
+CATEGORIZE_INSTRUCTION = (
+    "You are Krsna, the analyst. For each message, please provide:\n"
+    "1. Analyze the text to determine its general subject matter and overall communication style.\n"
+    "2. For each message, assign a category (neutral, informational, opinion, question).\n"
+    "Return a JSON object with key 'analyses': an array of objects, each with: "
+    "'number', 'category', 'subject', and 'style'.\n"
+    "Keep your analysis objective and professional."
+)
+
+# Local first pass for both categorization tasks; only posts it is unsure about reach Krsna.
+message_pre_classifier = PreClassifier("message_category", trivial_label="neutral")
+political_pre_classifier = PreClassifier("political_leaning", trivial_label="middle")
+
+def pre_classified_analysis(number, prediction):
+    """A MESSAGE_ANALYSIS-shaped entry for a post the pre-classifier labeled."""
+    subject = "Link or short post" if prediction["source"] == "rule" else "Not analyzed"
+    return {"number": number, "category": prediction["label"], "subject": subject,
+            "style": f"Pre-classified ({prediction['source']}, confidence {prediction['confidence']})"}
+
+def categorize_prompts(messages, chunk_size):
+    """
+    Split messages into [(prompt, chunk)]: each prompt carries only number and text of at most
+    `chunk_size` messages and stays within Krsna's prompt token budget.
+    """
+    builder = PromptBuilder(agent_deployment(krsna))
+    return builder.chunks("analyze", CATEGORIZE_INSTRUCTION, messages, max_posts=chunk_size)
+
+def categorize_chunk(prompt):
+    """
+    Ask Krsna to analyze one chunk prompt (see categorize_prompts).
+    Returns {number: analysis} and raises ResponseParseError if no usable reply came back.
+    """
+    # Malformed replies are repaired (or raise ResponseParseError) and never cached.
+    result = structured_reply(krsna, [{"role": "user", "content": prompt}], MESSAGE_ANALYSIS, azure_client)
+    return {am["number"]: am for am in result["analyses"]}
+
+def categorize_messages(messages, chunk_size=None, max_workers=None):
     """
     Use Krsna to analyze a list of messages for textual intent and tone.
     Returns the original messages with an added 'analysis' field.
     Modified to avoid content policy violations.
+
+    Messages are split into chunks of at most `chunk_size` that also fit the prompt
+    token budget, and analyzed concurrently (at most `max_workers` Krsna calls in
+    flight). Results are merged by message number, and only the messages of chunks
+    that failed or came back incomplete are retried, up to CATEGORIZE_RETRIES times.
+
+    Posts the local pre-classifier labels confidently are not sent to Krsna at all; Krsna's
+    labels for the rest are kept to train it.
     """
     if not messages:
         return []
-    try:
-        # Create a more neutral, safe prompt for message analysis
-        message_data = []
-        for msg in messages:
-            message_data.append({
-                "number": msg.get("number", 0),
-                "text": msg.get("text", ""),
-                "author": msg.get("author", "Unknown")
-            })
-        
-        # Create a more neutral prompt that doesn't trigger content filters
-        prompt = json.dumps({
-            "task": "analyze",
-            "messages": message_data,
-            "instruction": (
-                "You are Krsna, the analyst. For each message, please provide:\n"
-                "1. Analyze the text to determine its general subject matter and overall communication style.\n"
-                "2. For each message, assign a category (neutral, informational, opinion, question).\n"
-                "Return a JSON array of objects, each with: 'number', 'category', 'subject', and 'style'.\n"
-                "Keep your analysis objective and professional."
-            )
-        })
-        
-        analysis_result = krsna.generate_reply(messages=[{"role": "user", "content": prompt}])
-        
-        if isinstance(analysis_result, str):
-            analysis_content = analysis_result
-        elif isinstance(analysis_result, dict):
-            analysis_content = analysis_result.get("content", "")
+    chunk_size = chunk_size or CATEGORIZE_CHUNK_SIZE
+    max_workers = max_workers or CATEGORIZE_CONCURRENCY
+    analyses = {}
+    audits = {}
+    for msg in messages:
+        prediction = message_pre_classifier.classify(msg.get("text", ""))
+        if prediction and prediction["audit"]:
+            audits[msg.get("number", 0)] = prediction
+        elif prediction:
+            analyses[msg.get("number", 0)] = pre_classified_analysis(msg.get("number", 0), prediction)
+    to_analyze = [msg for msg in messages if msg.get("number", 0) not in analyses]
+    pending = categorize_prompts(to_analyze, chunk_size)
+
+    for attempt in range(CATEGORIZE_RETRIES + 1):
+        if not pending:
+            break
+        failed = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+            futures = {pool.submit(carry_context(categorize_chunk), prompt): chunk for prompt, chunk in pending}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    chunk_analyses = future.result()
+                except Exception as e:
+                    print(f"Error analyzing messages {chunk[0].get('number')}-{chunk[-1].get('number')}: {e}")
+                    failed.append(chunk)
+                    continue
+                analyses.update(chunk_analyses)
+                missing = [msg for msg in chunk if msg.get("number", 0) not in chunk_analyses]
+                if missing:
+                    failed.append(missing)
+        pending = categorize_prompts([msg for chunk in failed for msg in chunk], chunk_size)
+        if not pending:
+            break
+        if attempt < CATEGORIZE_RETRIES:
+            print(f"Retrying {len(pending)} failed analysis chunk(s)...")
+
+    labeled = []
+    for msg in to_analyze:
+        analysis_found = analyses.get(msg.get("number", 0))
+        if not analysis_found:
+            if msg.get("number", 0) in audits:
+                analyses[msg.get("number", 0)] = pre_classified_analysis(msg.get("number", 0), audits[msg.get("number", 0)])
+            continue
+        if msg.get("number", 0) in audits:
+            message_pre_classifier.record(msg.get("text", ""), analysis_found["category"], audits[msg.get("number", 0)])
+        else:
+            labeled.append((msg.get("text", ""), analysis_found["category"]))
+    message_pre_classifier.record_many(labeled)
+
+    # Merge the analysis into each message:
+    for msg in messages:
+        analysis_found = analyses.get(msg.get("number", 0))
+        if analysis_found:
+            category = analysis_found.get("category", "Not Categorized")
+            subject = analysis_found.get("subject", "Unknown Subject")
+            style = analysis_found.get("style", "Neutral Style")
+            msg["category"] = category
+            msg["analysis"] = f"Subject: {subject}, Style: {style}"
         else:
-            analysis_content = getattr(analysis_result, "content", "")
-            
-        analysis_content = extract_json_content(analysis_content)
-        
-        try:
-            result_json = json.loads(analysis_content)
-            if isinstance(result_json, list):
-                analyzed_messages = result_json
-            else:
-                print("Unexpected analysis format. Using default analysis.")
-                analyzed_messages = []
-        except json.JSONDecodeError:
-            print("Failed to parse analysis result; using default analysis.")
-            analyzed_messages = []
-            
-        # Merge the analysis into each message:
-        for msg in messages:
-            msg_number = msg.get("number", 0)
-            analysis_found = next((am for am in analyzed_messages if am.get("number") == msg_number), None)
-            if analysis_found:
-                category = analysis_found.get("category", "Not Categorized")
-                subject = analysis_found.get("subject", "Unknown Subject")
-                style = analysis_found.get("style", "Neutral Style")
-                msg["category"] = category
-                msg["analysis"] = f"Subject: {subject}, Style: {style}"
-            else:
-                msg["category"] = "Not Categorized"
-                msg["analysis"] = "Not Analyzed"
-                
-        return messages
-        
-    except Exception as e:
-        print(f"Error during analysis: {str(e)}")
-        # Fix: Changed messages2 to messages
-        for msg in messages:
             msg["category"] = "Not Categorized"
             msg["analysis"] = "Not Analyzed"
-        return messages    
-def search_subject_flow():
+
+    return messages
+
+SUBJECT_SCAN_LIMIT = int(os.getenv('SUBJECT_SCAN_LIMIT', '500'))
+SUBJECT_MAX_RESULTS = 20
+SUBJECT_ANALYZE_TOP = int(os.getenv('SUBJECT_ANALYZE_TOP', '5'))
+SEMANTIC_MIN_SCORE = float(os.getenv('SEMANTIC_MIN_SCORE', '0.3'))
+
+def trim_text(text, max_chars=200):
+    """Trims the text to max_chars characters, appending '...' if needed."""
+    if len(text) > max_chars:
+        return text[:max_chars-3] + "..."
+    return text
+
+# ----- REPLY PIPELINE STEPS -----
+# Requests and structured-output calls shared by the interactive, async and batch reply paths.
+# Each call names its response model (see response_models), so replies are schema-checked once
+# and malformed ones get a bounded repair retry instead of field-guessing fallbacks.
+
+def political_analysis_request(text):
+    """Krsna request rating a message's political leaning."""
+    return [{"role": "user", "content": json.dumps({
+        "task": "political_analysis",
+        "message": text,
+        "instruction": (
+            "Analyze this message and determine its political leaning on a scale: "
+            "'far-left', 'left', 'middle', 'right', or 'far-right'. "
+            "Consider the content, tone, and perspective. "
+            "Return a JSON object with keys: 'category' and 'reasoning'."
+        )
+    })}]
+
+def pre_classified_reasoning(prediction):
+    return f"Labeled locally by the pre-classifier ({prediction['source']}, confidence {prediction['confidence']})."
+
+def political_analysis(text):
     """
-    This flow asks Sanjay to take a subject keyword from the user,
-    instructs Nakulan to search the latest 20 messages for that subject,
-    and then lets the user choose a message to reply to.
+    Return Krsna's (category, reasoning) for a message, or (None, None) if no usable answer came back.
+    Posts the local pre-classifier is confident about are labeled without calling Krsna.
     """
-    # Step 1: Sanjay collects the subject keyword
-    subject = sanjay.get_human_input("Enter subject keyword to search for in recent messages: ").strip()
-    if not subject:
-        print("No subject entered. Aborting search.")
-        return
+    prediction = political_pre_classifier.classify(text)
+    if prediction and not prediction["audit"]:
+        return prediction["label"], pre_classified_reasoning(prediction)
+    try:
+        analysis = structured_reply(krsna, political_analysis_request(text), POLITICAL_ANALYSIS, azure_client)
+    except ResponseParseError:
+        return (prediction["label"], pre_classified_reasoning(prediction)) if prediction else (None, None)
+    political_pre_classifier.record(text, analysis["category"], prediction)
+    return analysis["category"], analysis["reasoning"]
 
-    # Step 2: Fetch the latest 20 messages from BlueSky
-    fetched_json = fetch_bluesky_following_wrapper(limit=20)
-    fetched = json.loads(fetched_json)
-    if fetched.get("status") != "success":
-        print("Error fetching messages:", fetched.get("message"))
-        return
-    messages = fetched.get("posts", [])
-    
-    # Step 3: Ask Nakulan to search and analyze these messages for the subject
-    prompt = json.dumps({
-        "task": "search_subject",
-        "subject": subject,
-        "messages": messages,
+async def apolitical_analysis(text):
+    """Async political_analysis."""
+    prediction = await asyncio.to_thread(political_pre_classifier.classify, text)
+    if prediction and not prediction["audit"]:
+        return prediction["label"], pre_classified_reasoning(prediction)
+    try:
+        analysis = await astructured_reply(krsna, political_analysis_request(text), POLITICAL_ANALYSIS)
+    except ResponseParseError:
+        return (prediction["label"], pre_classified_reasoning(prediction)) if prediction else (None, None)
+    await asyncio.to_thread(political_pre_classifier.record, text, analysis["category"], prediction)
+    return analysis["category"], analysis["reasoning"]
+
+def reply_request_for(text, category):
+    """Pick the responder for a political category and build its request. Returns (agent, messages)."""
+    if category.lower() == "far-right":
+        return yudhistran, [{"role": "user", "content": json.dumps({
+            "task": "reply",
+            "message": text,
+            "instruction": (
+                "You are Yudhistran, the balanced mediator. This message appears to have 'far-right' views. "
+                "Craft a measured, soothing response that finds middle ground while maintaining respect. "
+                "Aim for exactly 180 characters and return your response in a JSON object with key "
+                "'formatted_message'."
+            )
+        })}]
+    return arjunan, [{"role": "user", "content": json.dumps({
+        "task": "reply",
+        "message": text,
         "instruction": (
-            "You are Nakulan, the search specialist. Find messages related to the subject '" + subject + "'. "
-            "For each relevant message, analyze its intent and tone. "
-            "Return a JSON array of objects with: 'number', 'text', 'did', 'author', 'intent', and 'tone'. "
-            "Only include messages that contain the subject keyword or are semantically related to it. "
-            "For intent, classify as: 'question', 'statement', 'opinion', or 'announcement'. "
-            "For tone, classify as: 'neutral', 'positive', 'negative', or 'ambiguous'."
+            "You are Arjunan. This message has been categorized as having " + category + " political views. "
+            "Craft a thoughtful, assertive response in exactly 180 characters. "
+            "Return your response in a JSON object with key 'formatted_message'."
         )
-    })
-    nak_res = nakulan.generate_reply(messages=[{"role": "user", "content": prompt}])
-    
-    # Extract content from Nakulan's response
-    if isinstance(nak_res, str):
-        nak_content = nak_res
-    elif isinstance(nak_res, dict):
-        nak_content = nak_res.get("content", "")
-    else:
-        nak_content = getattr(nak_res, "content", "")
-    nak_content = extract_json_content(nak_content)
-    
-    # Parse the JSON response
+    })}]
+
+# Reply and rewrite generations are streamed and stop as soon as 'formatted_message' passes this budget.
+REPLY_CHAR_BUDGET = 180
+
+def show_streamed(text):
+    """on_text callback printing a streamed reply as it arrives."""
+    print(text, end="", flush=True)
+
+def streamed_reply(agent, request, on_text=None):
+    """
+    Stream a REPLY-model answer and return its 'formatted_message', cut off at REPLY_CHAR_BUDGET.
+    With `on_text` (e.g. show_streamed) the text is shown as it arrives.
+    Raises ResponseParseError if no usable reply came back.
+    """
+    stream = {"budget": REPLY_CHAR_BUDGET, "on_text": on_text}
     try:
-        subject_results = json.loads(nak_content)
-        if not isinstance(subject_results, list):
-            raise ValueError("Result not a list")
-    except Exception as e:
-        print(f"Analysis by Nakulan failed: {e}")
-        print("Falling back to simple keyword matching.")
-        # Fallback: simple keyword matching
-        subject_results = []
-        for i, msg in enumerate(messages, start=1):
-            if subject.lower() in msg.get("text", "").lower():
-                subject_results.append({
-                    "number": i,
-                    "text": msg.get("text", ""),
-                    "did": msg.get("did", "Unknown"),
-                    "author": msg.get("author", "Unknown"),
-                    "intent": "Unknown",
-                    "tone": "Neutral"
-                })
-
-    # Step 4: Sanjay displays the search results to the user
-    print(f"\nSearch results for subject '{subject}':")
-    if not subject_results:
-        print("No messages found matching this subject.")
-        return
-        
-    for msg in subject_results:
-        number = msg.get("number", "?")
-        author = msg.get("author", "Unknown")
-        text = msg.get("text", "(No text)")
-        intent = msg.get("intent", "Unknown")
-        tone = msg.get("tone", "Neutral")
-        print(f"{number}. {author}: {trim_text(text, 100)} | Intent: {intent}, Tone: {tone}")
+        return structured_reply(agent, request, REPLY, azure_client, stream=stream)["formatted_message"]
+    finally:
+        if on_text:
+            print()
 
-    # Step 5: Sanjay asks the user which message they want to reply to
-    selection = sanjay.get_human_input("Enter the message number to respond to (or 'skip' to cancel): ").strip()
-    if selection.lower() == "skip":
-        print("Reply cancelled.")
-        return
-        
+def draft_reply(reply_agent, agent_request, on_text=None):
+    """Return the responder's reply text. Raises ResponseParseError if it never matched the reply schema."""
+    return streamed_reply(reply_agent, agent_request, on_text)
+
+async def adraft_reply(reply_agent, agent_request):
+    """Async draft_reply (streamed, nothing shown)."""
+    stream = {"budget": REPLY_CHAR_BUDGET}
+    return (await astructured_reply(reply_agent, agent_request, REPLY, stream=stream))["formatted_message"]
+
+def validation_request(original_text, reply_text):
+    """Krsna request checking a drafted reply."""
+    return [{"role": "user", "content": json.dumps({
+        "task": "validate_response",
+        "original_message": original_text,
+        "agent_response": reply_text,
+        "instruction": (
+            "As Krsna, evaluate if this response is appropriate, respectful, and fits within 180 characters. "
+            "Return a JSON object with keys: 'valid' (boolean), 'edited_response' (string), and 'feedback' (string)."
+        )
+    })}]
+
+def validation_result_from(validation, reply_text):
+    return {
+        "valid": validation["valid"],
+        "edited_reply": validation["edited_response"] or reply_text,
+        "feedback": validation["feedback"]
+    }
+
+def validate_reply(original_text, reply_text):
+    """Return {'valid', 'edited_reply', 'feedback'} from Krsna's validation, or None if no usable answer came back."""
     try:
-        selected_number = int(selection)
+        validation = structured_reply(krsna, validation_request(original_text, reply_text), VALIDATION, azure_client)
+    except ResponseParseError:
+        return None
+    return validation_result_from(validation, reply_text)
+
+async def avalidate_reply(original_text, reply_text):
+    """Async validate_reply."""
+    try:
+        validation = await astructured_reply(krsna, validation_request(original_text, reply_text), VALIDATION)
+    except ResponseParseError:
+        return None
+    return validation_result_from(validation, reply_text)
+
+# 'multi' runs categorize -> draft -> validate as separate completions (3 calls per reply);
+# 'fused' asks Krsna for all of it in one structured completion, falling back to 'multi' if unparseable.
+REPLY_MODE = os.getenv('REPLY_MODE', 'multi')
+
+def fused_reply_request(text):
+    """One Krsna request that categorizes a message, drafts a reply, validates it and fits it to 180 characters."""
+    return [{"role": "user", "content": json.dumps({
+        "task": "categorize_draft_validate_reply",
+        "message": text,
+        "instruction": (
+            "1. Determine the message's political leaning: 'far-left', 'left', 'middle', 'right', or 'far-right'. "
+            "2. Draft a reply: for 'far-right', a measured, soothing reply that finds middle ground while "
+            "maintaining respect (as Yudhistran, the balanced mediator); otherwise a thoughtful, assertive reply "
+            "(as Arjunan). "
+            "3. Evaluate whether the draft is appropriate and respectful, and edit it if it is not. "
+            "4. Give the final reply in at most 180 characters. "
+            "Return a JSON object with keys: 'category', 'reasoning', 'draft', 'valid' (boolean), "
+            "'feedback', and 'final_reply'."
+        )
+    })}]
+
+def fused_result_from(fused):
+    """Reply result dict (as returned by agenerate_agent_reply) from a parsed fused reply."""
+    final_reply = fused["final_reply"].strip() or fused["draft"].strip()
+    return {
+        "category": fused["category"],
+        "reasoning": fused["reasoning"],
+        "agent": "Yudhistran" if fused["category"] == "far-right" else "Arjunan",
+        "draft": fused["draft"],
+        "valid": fused["valid"],
+        "feedback": fused["feedback"],
+        "reply": trim_text(final_reply, 180),
+        "calls": 1
+    }
+
+def fused_agent_reply(text):
+    """Fused categorize/draft/validate reply, or None if no usable answer came back."""
+    try:
+        return fused_result_from(structured_reply(krsna, fused_reply_request(text), FUSED_REPLY, azure_client))
+    except ResponseParseError:
+        return None
+
+# ----- ASYNC REPLY PIPELINE -----
+
+def timed(stats, stage):
+    """stats.time(stage) when stage stats are being collected, otherwise a no-op context."""
+    return stats.time(stage) if stats is not None else nullcontext()
+
+async def afused_agent_reply(text):
+    """Async fused_agent_reply."""
+    try:
+        return fused_result_from(await astructured_reply(krsna, fused_reply_request(text), FUSED_REPLY))
+    except ResponseParseError:
+        return None
+
+async def agenerate_agent_reply(message, category=None, stats=None):
+    """
+    Categorize -> draft -> validate one message with async LLM calls. Returns a result dict.
+    Pass `category` to skip the categorization step, and `stats` to time each stage.
+    With REPLY_MODE=fused (and no category given) this is a single fused completion.
+    """
+    text = message.get("text", "")
+    reasoning = None
+    calls = 2
+    if category is None and REPLY_MODE == "fused":
+        with timed(stats, "fused"):
+            fused = await afused_agent_reply(text)
+        if fused:
+            return dict(fused, number=message.get("number"), did=message.get("did"), text=text)
+        calls += 1
+    if category is None:
+        calls += 1
+        with timed(stats, "categorize"):
+            category, reasoning = await apolitical_analysis(text)
+        category = category or "middle"
+    reply_agent, agent_request = reply_request_for(text, category)
+    with timed(stats, "draft"):
+        reply_text = await adraft_reply(reply_agent, agent_request)
+    with timed(stats, "validate"):
+        validation_result = await avalidate_reply(text, reply_text)
+    final_reply = validation_result["edited_reply"] if validation_result else reply_text
+    return {
+        "number": message.get("number"),
+        "did": message.get("did"),
+        "text": text,
+        "category": category,
+        "reasoning": reasoning,
+        "agent": reply_agent.name,
+        "draft": reply_text,
+        "valid": validation_result["valid"] if validation_result else None,
+        "feedback": validation_result["feedback"] if validation_result else None,
+        "reply": trim_text(final_reply, 180),
+        "calls": calls
+    }
+
+async def aprocess_message(message, like=False, post_reply=False):
+    """Draft an agent reply while liking the post (if asked), then optionally post the reply."""
+    bsky = get_async_bluesky()
+    jobs = [agenerate_agent_reply(message)]
+    if like:
+        jobs.append(bsky.like(message["did"]))
+    results = await asyncio.gather(*jobs)
+    result = results[0]
+    if like:
+        result["like"] = results[1]
+    if post_reply:
+        result["post"] = await bsky.reply(message["did"], result["reply"])
+    return result
+
+async def arun_reply_workflows(limit=20, pages=1, like=False, post_reply=False, concurrency=8):
+    """
+    Drive reply workflows for `pages` timeline pages of `limit` posts in one event loop.
+    The next page is fetched while the current page's posts are being processed, and at
+    most `concurrency` posts are in flight at once.
+    """
+    bsky = get_async_bluesky()
+    results = []
+    cursor = None
+    next_page = asyncio.create_task(bsky.fetch_timeline(limit, cursor))
+    for page in range(pages):
+        posts, cursor = await next_page
+        if page + 1 < pages and cursor:
+            next_page = asyncio.create_task(bsky.fetch_timeline(limit, cursor))
+        await asyncio.to_thread(store_posts, posts)
+        for msg in posts:
+            msg["number"] += len(results)
+        page_results = await gather_limited(
+            [aprocess_message(msg, like=like, post_reply=post_reply) for msg in posts], concurrency
+        )
+        for msg, outcome in zip(posts, page_results):
+            if isinstance(outcome, Exception):
+                outcome = {"number": msg["number"], "did": msg["did"], "text": msg.get("text", ""),
+                           "error": str(outcome)}
+            results.append(outcome)
+        if not cursor:
+            break
+    return results
+
+def draft_replies_async_flow():
+    """Draft agent replies for recent timeline posts concurrently and show them (nothing is posted)."""
+    try:
+        limit = int(sanjay.get_human_input("How many recent messages should get draft replies? (e.g., 20): ").strip())
     except ValueError:
         print("Invalid number entered.")
         return
+    started = datetime.datetime.now()
+    results = asyncio.run(arun_reply_workflows(limit=min(limit, 100)))
+    elapsed = (datetime.datetime.now() - started).total_seconds()
+    for result in results:
+        if "error" in result:
+            print(f"{result['number']}. Failed: {result['error']}")
+        else:
+            print(f"{result['number']}. [{result['category']}] {trim_text(result['text'], 80)}")
+            print(f"    {result['agent']}: {result['reply']}")
+    drafted = [result for result in results if "error" not in result]
+    if drafted:
+        calls = sum(result.get("calls", 0) for result in drafted)
+        print(f"\nREPLY_MODE={REPLY_MODE}: {calls} completion calls for {len(drafted)} replies "
+              f"({calls / len(drafted):.1f} per reply), {elapsed:.1f}s total.")
+        print("Streamed replies:", stream_stats.stats())
 
-    # Find the selected message
-    selected_message = None
-    for msg in subject_results:
-        if msg.get("number") == selected_number:
-            selected_message = msg
-            break
-            
-    if not selected_message:
-        print("No message found with that number.")
-        return
+# ----- HEADLESS BATCH MODE -----
 
-    # Step 6: Get reply type (human or agent)
-    reply_type = sanjay.get_human_input("Type 'human' for your own reply or 'agent' for agent-generated reply: ").strip().lower()
-    
-    if reply_type == "human":
-        # Human-generated reply
-        reply_text = sanjay.get_human_input("Enter your reply text: ")
-    elif reply_type == "agent":
-        # Step 7: Send to Krsna for categorization
-        categorize_prompt = json.dumps({
-            "task": "categorize",
-            "message": selected_message.get("text", ""),
-            "instruction": (
-                "Analyze this message and determine if it has a 'far-left' political leaning. "
-                "Return a JSON object with: 'category' (either 'far-left' or 'other') and 'reasoning'."
-            )
-        })
-        
-        categorization = krsna.generate_reply(messages=[{"role": "user", "content": categorize_prompt}])
-        if isinstance(categorization, str):
-            cat_content = categorization
-        elif isinstance(categorization, dict):
-            cat_content = categorization.get("content", "")
-        else:
-            cat_content = getattr(categorization, "content", "")
-        cat_content = extract_json_content(cat_content)
-        
-        # Parse categorization
-        try:
-            cat_json = json.loads(cat_content)
-            category = cat_json.get("category", "other")
-        except:
-            print("Categorization failed. Defaulting to 'other'.")
-            category = "other"
-            
-        # Step 8: Select appropriate agent based on category
-        if category.lower() == "far-left":
-            print("Message categorized as 'far-left'. Using Yudhistran (balanced mediator) for response.")
-            agent_prompt = json.dumps({
-                "task": "reply",
-                "message": selected_message.get("text", ""),
-                "instruction": (
-                    "You are Yudhistran, the balanced mediator. Craft a measured, soothing response to this message. "
-                    "Your response should be balanced and aim to find common ground. "
-                    "Return a JSON object with key 'formatted_message' containing your response."
-                )
-            })
-            reply_agent = yudhistran
-        else:
-            print("Message categorized as 'other'. Using Arjunan (left-leaning responder) for response.")
-            agent_prompt = json.dumps({
-                "task": "reply",
-                "message": selected_message.get("text", ""),
-                "instruction": (
-                    "You are Arjunan, the left-leaning responder. Craft an assertive, progressive response to this message. "
-                    "Your response should emphasize social justice and challenge existing power structures. "
-                    "Return a JSON object with key 'formatted_message' containing your response."
-                )
-            })
-            reply_agent = arjunan
-            
-        # Generate the reply
-        agent_response = reply_agent.generate_reply(messages=[{"role": "user", "content": agent_prompt}])
-        if isinstance(agent_response, str):
-            reply_content = agent_response
-        elif isinstance(agent_response, dict):
-            reply_content = agent_response.get("content", "")
-        else:
-            reply_content = getattr(agent_response, "content", "")
-        reply_content = extract_json_content(reply_content)
-        
-        # Parse the reply
-        try:
-            reply_json = json.loads(reply_content)
-            reply_text = reply_json.get("formatted_message", "")
-            if not reply_text:
-                for field in ["final_reply", "reply", "message", "text", "content"]:
-                    if field in reply_json and reply_json.get(field, ""):
-                        reply_text = reply_json.get(field, "")
-                        break
-        except:
-            print("Failed to parse agent response. Using raw text.")
-            reply_text = reply_content if len(reply_content) < 280 else reply_content[:277] + "..."
-            
-        # Step 9: Rewrite to 180 characters using Krsna
-        rewrite_prompt = json.dumps({
-            "task": "rewrite",
-            "original_message": reply_text,
-            "instruction": (
-                "Rewrite this reply to be exactly 180 characters or less while maintaining the original tone and intent. "
-                "Return a JSON object with key 'formatted_message' containing your rewritten reply."
-            )
-        })
-        
-        rewrite_response = krsna.generate_reply(messages=[{"role": "user", "content": rewrite_prompt}])
-        if isinstance(rewrite_response, str):
-            rewrite_content = rewrite_response
-        elif isinstance(rewrite_response, dict):
-            rewrite_content = rewrite_response.get("content", "")
-        else:
-            rewrite_content = getattr(rewrite_response, "content", "")
-        rewrite_content = extract_json_content(rewrite_content)
-        
-        # Parse the rewritten reply
-        try:
-            rewrite_json = json.loads(rewrite_content)
-            reply_text = rewrite_json.get("formatted_message", reply_text)
-        except:
-            print("Rewrite parsing failed. Using original agent response.")
+BATCH_RESULTS_FILE = os.getenv('BATCH_RESULTS_FILE', 'batch_results.jsonl')
+APPROVAL_QUEUE_FILE = os.getenv('APPROVAL_QUEUE_FILE', 'approval_queue.jsonl')
+
+async def abatch_process(message, policy, stats):
+    """Categorize one post, then like and/or draft a reply as the policy says (concurrently)."""
+    bsky = get_async_bluesky()
+    text = message.get("text", "")
+    fused = None
+    if REPLY_MODE == "fused":
+        # The fused completion categorizes and drafts at once; its draft is kept if the policy wants a reply.
+        with timed(stats, "fused"):
+            fused = await afused_agent_reply(text)
+    if fused:
+        category, reasoning = fused["category"], fused["reasoning"]
     else:
-        print("Invalid reply type. Reply cancelled.")
+        with timed(stats, "categorize"):
+            category, reasoning = await apolitical_analysis(text)
+    category = category or "middle"
+    actions = actions_for(category, policy)
+    result = {
+        "number": message.get("number"),
+        "did": message.get("did"),
+        "author": message.get("author"),
+        "text": text,
+        "category": category,
+        "reasoning": reasoning,
+        "actions": sorted(actions)
+    }
+
+    async def like():
+        with timed(stats, "like"):
+            outcome = await bsky.like(message["did"])
+            # 'queued' likes are held back by rate limits and sent by the write queue later.
+            if outcome["status"] == "error":
+                raise RuntimeError(outcome["message"])
+            return outcome
+
+    jobs = {}
+    if "like" in actions and policy["auto_like"]:
+        jobs["like"] = like()
+    async def fused_draft():
+        return fused
+
+    if "reply" in actions:
+        jobs["reply"] = fused_draft() if fused else agenerate_agent_reply(message, category=category, stats=stats)
+    outcomes = dict(zip(jobs, await asyncio.gather(*jobs.values(), return_exceptions=True)))
+
+    if "like" in outcomes:
+        like_outcome = outcomes["like"]
+        result["like"] = {"status": "error", "message": str(like_outcome)} if isinstance(like_outcome, Exception) else like_outcome
+    if "reply" in outcomes:
+        drafted = outcomes["reply"]
+        if isinstance(drafted, Exception):
+            result["reply_status"] = "error"
+            result["error"] = str(drafted)
+        else:
+            for key in ("agent", "draft", "valid", "feedback", "reply"):
+                result[key] = drafted[key]
+            result["reply_status"] = "pending"
+            if policy["auto_post"]:
+                with timed(stats, "post"):
+                    posted = await bsky.reply(message["did"], result["reply"])
+                # 'queued' replies are held back by rate limits and sent by the write queue later.
+                result["reply_status"] = {"success": "posted", "queued": "queued"}.get(posted["status"], "error")
+                if posted["status"] == "error":
+                    result["error"] = posted["message"]
+    return result
+
+async def arun_batch(count, policy, concurrency=16, results_path=None, queue_path=None):
+    """
+    Process `count` timeline posts unattended: fetch, categorize, then like / draft replies per policy,
+    with at most `concurrency` posts in flight. Results are appended to `results_path` and drafted
+    (not auto-posted) replies to the approval queue. Returns (results, stage stats summary).
+    """
+    stats = StageStats()
+    bsky = get_async_bluesky()
+    posts = []
+    cursor = None
+    while len(posts) < count:
+        with timed(stats, "fetch"):
+            page, cursor = await bsky.fetch_timeline(min(count - len(posts), 100), cursor)
+        for msg in page:
+            msg["number"] = len(posts) + 1
+            posts.append(msg)
+        if not cursor or not page:
+            break
+    await asyncio.to_thread(store_posts, posts)
+
+    outcomes = await gather_limited([abatch_process(msg, policy, stats) for msg in posts], concurrency)
+    results = []
+    for msg, outcome in zip(posts, outcomes):
+        if isinstance(outcome, Exception):
+            outcome = {"number": msg["number"], "did": msg["did"], "text": msg.get("text", ""),
+                       "reply_status": "error", "error": str(outcome)}
+        outcome["processed_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        results.append(outcome)
+
+    append_jsonl(results_path or BATCH_RESULTS_FILE, results)
+    append_jsonl(queue_path or APPROVAL_QUEUE_FILE, [r for r in results if r.get("reply_status") == "pending"])
+    return results, stats.summary()
+
+@workflow("batch")
+def run_batch_mode(count, policy_path=None, concurrency=16, results_path=None, queue_path=None):
+    """Entry point for the headless batch mode; prints a summary and per-stage throughput."""
+    policy = load_policy(policy_path)
+    results, summary = asyncio.run(arun_batch(count, policy, concurrency, results_path, queue_path))
+    by_status = {}
+    for result in results:
+        status = result.get("reply_status", "no_reply")
+        by_status[status] = by_status.get(status, 0) + 1
+    print(f"Processed {len(results)} posts: {by_status}")
+    print(f"Results written to {results_path or BATCH_RESULTS_FILE}; "
+          f"drafts awaiting approval in {queue_path or APPROVAL_QUEUE_FILE}.")
+    print("Stage stats:", json.dumps(summary, indent=2))
+    print("LLM dispatch:", json.dumps(dispatch_stats(), indent=2))
+    print("Model routing:", json.dumps(model_router.stats(), indent=2))
+    print("Pre-classifier:", json.dumps(political_pre_classifier.stats(), indent=2))
+    print("Write queue:", get_write_queue().stats())
+    return results, summary
+
+def review_approval_queue():
+    """Let the user approve, edit or reject the drafted replies left by batch runs."""
+    queue = read_jsonl(APPROVAL_QUEUE_FILE)
+    pending = [item for item in queue if item.get("reply_status") == "pending"]
+    if not pending:
+        print("No drafted replies are waiting for approval.")
         return
-        
-    # Step 10: Confirm and post
-    reply_text = trim_text(reply_text, 200)
-    approval = sanjay.get_human_input(f"Approve this reply to send? '{reply_text}' (yes/no): ").strip().lower()
-    
-    if approval == "yes":
-        # Post the reply using Bheeman
-        reply_result_json = reply_to_bluesky_wrapper(original_uri=selected_message["did"], reply_content=reply_text)
-        reply_result = json.loads(reply_result_json)
-        
-        if reply_result.get("status") == "success":
-            print("Reply posted successfully!")
+    for item in pending:
+        print(f"\n[{item.get('category')}] {item.get('author', 'Unknown')}: {item.get('text', '')}")
+        print(f"Draft reply ({item.get('agent')}): \"{item.get('reply')}\"")
+        decision = sanjay.get_human_input("Post this reply? (yes/no/edit/stop): ").strip().lower()
+        if decision == "stop":
+            break
+        if decision == "edit":
+            item["reply"] = trim_text(sanjay.get_human_input("Enter the reply text: ").strip(), 180)
+            decision = "yes"
+        if decision == "yes":
+            reply_result = json.loads(reply_to_bluesky_wrapper(original_uri=item["did"], reply_content=item["reply"]))
+            item["reply_status"] = {"success": "posted", "queued": "queued"}.get(reply_result.get("status"), "error")
+            print("Reply posted successfully." if item["reply_status"] == "posted"
+                  else reply_result.get("message") if item["reply_status"] == "queued"
+                  else f"Error posting reply: {reply_result.get('message')}")
         else:
-            print("Error posting reply:", reply_result.get("message"))
-    else:
-        print("Reply cancelled.")  
-def trim_text(text, max_chars=200):
-    """Trims the text to max_chars characters, appending '...' if needed."""
-    if len(text) > max_chars:
-        return text[:max_chars-3] + "..."
-    return text
+            item["reply_status"] = "rejected"
+    write_jsonl(APPROVAL_QUEUE_FILE, queue)
 
 # Fix for the 'dict' object has no attribute 'lower' error in process_reply_workflow
+@workflow("reply")
 def process_reply_workflow():
     """
     Handle the workflow for replying to messages with improved error handling and agent coordination.
     """
-    # Fetch messages from BlueSky
-    fetched_messages_json = fetch_bluesky_following_wrapper(limit=20)
-    fetched_messages = json.loads(fetched_messages_json)
-    if fetched_messages["status"] != "success":
-        print("Error fetching messages:", fetched_messages["message"])
-        return
-    messages = fetched_messages["posts"]
-    
-    # Categorize messages
-    categorization_result = categorize_messages(messages=messages)
-    if not categorization_result:
-        print("Categorization failed; assigning default category 'Not Categorized'.")
-        categorized_messages = []
+    categorization_result = []
+    cursor = None
+    while True:
+        # Fetch the next page of messages from BlueSky (the newest page on the first pass)
+        fetched_messages_json = fetch_bluesky_following_wrapper(limit=20, cursor=cursor)
+        fetched_messages = json.loads(fetched_messages_json)
+        if fetched_messages["status"] != "success":
+            print("Error fetching messages:", fetched_messages["message"])
+            return
+        messages = fetched_messages["posts"]
+        cursor = fetched_messages.get("cursor")
         for msg in messages:
-            msg_copy = msg.copy()
-            msg_copy["category"] = "Not Categorized"
-            categorized_messages.append(msg_copy)
-        categorization_result = categorized_messages
-    
-    # Display messages for selection
-    for msg in categorization_result:
-        try:
-            number = msg.get("number", "?")
-            category = msg.get("category", "Not Categorized")
-            author = msg.get("author", "Unknown")
-            text = msg.get("text", "(No text)")
-            did = msg.get("did", "Unknown DID")
-            print(f"{number}. [{category}] {author}: {text} (DID: {did})")
-        except Exception as e:
-            print(f"Error displaying message: {e}", msg)
-    
-    # Get user selection
-    selection = sanjay.get_human_input("Select a message by number (e.g., '1') or type 'skip' to skip: ").strip().lower()
+            msg["number"] += len(categorization_result)
+
+        # Categorize messages
+        page_result = categorize_messages(messages=messages)
+        if not page_result:
+            print("Categorization failed; assigning default category 'Not Categorized'.")
+            categorized_messages = []
+            for msg in messages:
+                msg_copy = msg.copy()
+                msg_copy["category"] = "Not Categorized"
+                categorized_messages.append(msg_copy)
+            page_result = categorized_messages
+        categorization_result.extend(page_result)
+
+        # Display messages for selection
+        for msg in page_result:
+            try:
+                number = msg.get("number", "?")
+                category = msg.get("category", "Not Categorized")
+                author = msg.get("author", "Unknown")
+                text = msg.get("text", "(No text)")
+                did = msg.get("did", "Unknown DID")
+                print(f"{number}. [{category}] {author}: {text} (DID: {did})")
+            except Exception as e:
+                print(f"Error displaying message: {e}", msg)
+
+        # Get user selection
+        more_hint = ", 'more' to load older messages," if cursor else ""
+        selection = sanjay.get_human_input(
+            f"Select a message by number (e.g., '1'){more_hint} or type 'skip' to skip: "
+        ).strip().lower()
+        if selection == "more" and cursor:
+            continue
+        break
+
     if selection == "skip":
         print("Skipping reply workflow.")
         return
@@ -750,6 +1090,8 @@ def process_reply_workflow():
         like_result = json.loads(like_result_json)
         if like_result["status"] == "success":
             print("Message liked successfully.")
+        elif like_result["status"] == "queued":
+            print(like_result["message"])
         else:
             print("Error liking message:", like_result["message"])
     
@@ -761,148 +1103,64 @@ def process_reply_workflow():
     
     # Get reply type
     reply_type = sanjay.get_human_input("Type 'human' to reply yourself or 'agent' for agent-generated reply: ").strip().lower()
+    fused = None
+    if reply_type == "agent" and REPLY_MODE == "fused":
+        print("Asking Krsna to categorize, draft and validate the reply in one pass...")
+        fused = fused_agent_reply(selected_message["text"])
+        if fused is None:
+            print("Fused reply parsing failed. Falling back to separate categorize/draft/validate steps.")
     
     if reply_type == "human":
         # Human generated reply
-        reply_text = sanjay.get_human_input("Enter your reply text: ")
+        edited_reply = sanjay.get_human_input("Enter your reply text: ")
+    elif fused:
+        print(f"Message categorized as: {fused['category']}")
+        print(f"Reasoning: {fused['reasoning']}")
+        if fused["valid"]:
+            print("✅ Krsna has validated the reply as appropriate.")
+        else:
+            print("⚠️ Krsna has concerns about the draft and has edited it.")
+        print(f"Feedback: {fused['feedback']}")
+        edited_reply = fused["reply"]
     elif reply_type == "agent":
         # NEW WORKFLOW: Enhanced categorization for message political leaning
-        categorize_prompt = json.dumps({
-            "task": "political_analysis",
-            "message": selected_message["text"],
-            "instruction": (
-                "Analyze this message and determine its political leaning on a scale: "
-                "'far-left', 'left', 'middle', 'right', or 'far-right'. "
-                "Consider the content, tone, and perspective. "
-                "Return a JSON object with keys: 'category' and 'reasoning'."
-            )
-        })
-        
-        # Get categorization from Krsna
-        categorization = krsna.generate_reply(messages=[{"role": "user", "content": categorize_prompt}])
-        if isinstance(categorization, str):
-            cat_content = categorization
-        elif isinstance(categorization, dict):
-            cat_content = categorization.get("content", "")
+        category, reasoning = political_analysis(selected_message["text"])
+        if category is None:
+            print("Categorization parsing failed. Defaulting to 'middle'.")
+            category = "middle"
         else:
-            cat_content = getattr(categorization, "content", "")
-        cat_content = extract_json_content(cat_content)
-        
-        # Parse categorization
-        try:
-            cat_json = json.loads(cat_content)
-            category = cat_json.get("category", "middle")
-            reasoning = cat_json.get("reasoning", "No reasoning provided")
             print(f"Message categorized as: {category}")
             print(f"Reasoning: {reasoning}")
-        except:
-            print("Categorization parsing failed. Defaulting to 'middle'.")
-            category = "middle"
         
         # Select appropriate agent based on political leaning
-        if category.lower() == "far-right":
+        reply_agent, agent_request = reply_request_for(selected_message["text"], category)
+        if reply_agent is yudhistran:
             print("Message categorized as 'far-right'. Using Yudhistran for a soothing, middle-ground response.")
-            agent_prompt = json.dumps({
-                "task": "reply",
-                "message": selected_message["text"],
-                "instruction": (
-                    "You are Yudhistran, the balanced mediator. This message appears to have 'far-right' views. "
-                    "Craft a measured, soothing response that finds middle ground while maintaining respect. "
-                    "Aim for exactly 180 characters and return your response in a JSON object with key "
-                    "'formatted_message'."
-                )
-            })
-            reply_agent = yudhistran
         else:
             print(f"Message categorized as '{category}'. Using Arjunan for a response.")
-            agent_prompt = json.dumps({
-                "task": "reply",
-                "message": selected_message["text"],
-                "instruction": (
-                    "You are Arjunan. This message has been categorized as having " + category + " political views. "
-                    "Craft a thoughtful, assertive response in exactly 180 characters. "
-                    "Return your response in a JSON object with key 'formatted_message'."
-                )
-            })
-            reply_agent = arjunan
         
         # Generate the reply with the selected agent
         print(f"Generating response with {reply_agent.name}...")
-        agent_response = reply_agent.generate_reply(messages=[{"role": "user", "content": agent_prompt}])
-        if isinstance(agent_response, str):
-            reply_content = agent_response
-        elif isinstance(agent_response, dict):
-            reply_content = agent_response.get("content", "")
-        else:
-            reply_content = getattr(agent_response, "content", "")
-        reply_content = extract_json_content(reply_content)
-        
-        # Parse the reply
         try:
-            reply_json = json.loads(reply_content)
-            reply_text = reply_json.get("formatted_message", "")
-            
-            # FIX: Safely handle dictionary values
-            if not reply_text:
-                for field in ["final_reply", "reply", "analyzed_reply", "message", "text", "content"]:
-                    if field in reply_json:
-                        candidate = reply_json.get(field, "")
-                        # Check if candidate is a string before calling lower()
-                        if isinstance(candidate, str):
-                            if candidate.lower() not in ["progressive", "liberal", "centrist", "conservative",
-                                                        "strongly conservative", "left", "right", "far-left", "far-right"]:
-                                reply_text = candidate
-                                break
-                        elif isinstance(candidate, dict):
-                            # Handle dictionary case
-                            if 'text' in candidate:
-                                reply_text = candidate['text']
-                                break
-            
-            if not reply_text:
-                print("No suitable reply field found. Using raw agent response.")
-                reply_text = reply_content
-        except Exception as e:
-            print(f"Reply parsing failed: {e}")
-            reply_text = reply_content
+            reply_text = draft_reply(reply_agent, agent_request, on_text=show_streamed)
+        except ResponseParseError as e:
+            print(f"{reply_agent.name} did not return a usable reply ({e}). Reply cancelled.")
+            return
         
         # Send to Krsna for validation
-        validate_prompt = json.dumps({
-            "task": "validate_response",
-            "original_message": selected_message["text"],
-            "agent_response": reply_text,
-            "instruction": (
-                "As Krsna, evaluate if this response is appropriate, respectful, and fits within 180 characters. "
-                "Return a JSON object with keys: 'valid' (boolean), 'edited_response' (string), and 'feedback' (string)."
-            )
-        })
-        
         print("Sending to Krsna for validation...")
-        validation = krsna.generate_reply(messages=[{"role": "user", "content": validate_prompt}])
-        if isinstance(validation, str):
-            valid_content = validation
-        elif isinstance(validation, dict):
-            valid_content = validation.get("content", "")
+        validation_result = validate_reply(selected_message["text"], reply_text)
+        if validation_result is None:
+            print("Validation parsing failed.")
+            edited_reply = reply_text
+            print("Using original agent response without validation.")
         else:
-            valid_content = getattr(validation, "content", "")
-        valid_content = extract_json_content(valid_content)
-        
-        # Process validation results
-        try:
-            valid_json = json.loads(valid_content)
-            is_valid = valid_json.get("valid", False)
-            validation_feedback = valid_json.get("feedback", "No feedback provided")
-            if is_valid:
-                edited_reply = valid_json.get("edited_response", reply_text)
+            edited_reply = validation_result["edited_reply"]
+            if validation_result["valid"]:
                 print("✅ Krsna has validated the reply as appropriate.")
             else:
-                edited_reply = valid_json.get("edited_response", reply_text)
                 print("⚠️ Krsna has concerns about the reply and has edited it.")
-            print(f"Feedback: {validation_feedback}")
-        except Exception as e:
-            print(f"Validation parsing failed: {e}")
-            edited_reply = reply_text
-            print("Using original agent response without validation.")
+            print(f"Feedback: {validation_result['feedback']}")
     else:
         print("Invalid reply type. Reply cancelled.")
         return
@@ -930,26 +1188,11 @@ def process_reply_workflow():
             )
         })
         
-        fair_response = krsna.generate_reply(messages=[{"role": "user", "content": fair_prompt}])
-        if isinstance(fair_response, str):
-            fair_content = fair_response
-        elif isinstance(fair_response, dict):
-            fair_content = fair_response.get("content", "")
-        else:
-            fair_content = getattr(fair_response, "content", "")
-        fair_content = extract_json_content(fair_content)
-        
         try:
-            fair_json = json.loads(fair_content)
-            fair_reply = fair_json.get("formatted_message", "")
-            if not fair_reply:
-                # Try other common field names
-                for field in ["response", "reply", "message", "text", "content"]:
-                    if field in fair_json and isinstance(fair_json[field], str):
-                        fair_reply = fair_json[field]
-                        break
-        except:
-            fair_reply = fair_content if len(fair_content) < 180 else fair_content[:177] + "..."
+            fair_reply = streamed_reply(krsna, [{"role": "user", "content": fair_prompt}], show_streamed)
+        except ResponseParseError as e:
+            print(f"Krsna's alternative was unusable: {e}")
+            fair_reply = edited_reply
         
         # Show the fair reply and get approval again
         fair_reply = trim_text(fair_reply, 180)
@@ -974,17 +1217,20 @@ def process_reply_workflow():
         
         if reply_result.get("status") == "success":
             print("✅ Reply posted successfully!")
+        elif reply_result.get("status") == "queued":
+            print("⏳", reply_result.get("message"))
         else:
             print("❌ Error posting reply:", reply_result.get("message"))
     else:
         print("Reply not posted. Workflow completed.")
         
 # ----- NEW FLOW: Subject Search --------------------
+
 def search_subject_flow():
     """
     This flow asks Sanjay to take a subject keyword from the user,
-    instructs Nakulan to search the latest 20 messages for that subject,
-    and then lets the user choose a message to reply to.
+    finds keyword and semantically related messages in the local post store,
+    has Nakulan analyze the top matches, and then lets the user choose a message to reply to.
     """
     # Step 1: Sanjay collects the subject keyword
     subject = sanjay.get_human_input("Enter subject keyword to search for in recent messages: ").strip()
@@ -992,54 +1238,54 @@ def search_subject_flow():
         print("No subject entered. Aborting search.")
         return
 
-    # Step 2: Fetch the latest 20 messages and filter by the subject keyword.
-    fetched_json = fetch_bluesky_following_wrapper(limit=20)
-    fetched = json.loads(fetched_json)
-    if fetched.get("status") != "success":
-        print("Error fetching messages:", fetched.get("message"))
-        return
-    messages = fetched.get("posts", [])
-    # Filter messages where subject keyword (case-insensitive) appears in the text.
-    subject_messages = [msg for msg in messages if subject.lower() in msg.get("text", "").lower()]
+    # Step 2: Pull new messages into the local store (embedding them on the way in), then combine an
+    # indexed full-text query with a top-k semantic search over the whole ingested history.
+    ingest_recent_posts(SUBJECT_SCAN_LIMIT)
+    subject_messages = search_post_store(subject, limit=SUBJECT_MAX_RESULTS)
+    seen_uris = {msg["did"] for msg in subject_messages}
+    try:
+        semantic_hits = [uri for uri, score in semantic_search(subject, k=SUBJECT_MAX_RESULTS, client=azure_client)
+                         if score >= SEMANTIC_MIN_SCORE and uri not in seen_uris]
+    except Exception as e:
+        print("Semantic search failed:", str(e))
+        semantic_hits = []
+    for msg in get_post_store().get_posts(semantic_hits[:SUBJECT_MAX_RESULTS - len(subject_messages)]):
+        msg.setdefault("intent", "Unknown")
+        msg.setdefault("tone", "Neutral")
+        subject_messages.append(msg)
     if not subject_messages:
         print(f"No messages found matching subject '{subject}'.")
         return
 
-    # Step 3: Ask Nakulan to analyze these messages for tone and intent.
-    prompt = json.dumps({
-        "task": "search_subject",
-        "subject": subject,
-        "messages": subject_messages,
-        "instruction": (
-            "For each message, return an object with 'number', 'text', 'did', "
-            "'intent', and 'tone'. If analysis is not possible, use 'Unknown' or "
-            "'Neutral' as defaults."
-        )
-    })
-    nak_res = nakulan.generate_reply(messages=[{"role": "user", "content": prompt}])
-    if isinstance(nak_res, str):
-        nak_content = nak_res
-    elif isinstance(nak_res, dict):
-        nak_content = nak_res.get("content", "")
-    else:
-        nak_content = getattr(nak_res, "content", "")
-    nak_content = extract_json_content(nak_content)
+    # Step 3: Ask Nakulan to analyze the top hits (SUBJECT_ANALYZE_TOP) for tone and intent.
+    # Only number and text go out; Nakulan's intent/tone are merged back by number.
+    # Messages are packed best match first up to the prompt token budget; the rest keep the defaults.
+    for number, msg in enumerate(subject_messages, start=1):
+        msg["number"] = number
+    prompt, _, _ = PromptBuilder(agent_deployment(nakulan)).pack(
+        "search_subject",
+        "Return a JSON object with key 'results': for each message, an object with 'number', "
+        "'intent', and 'tone'. If analysis is not possible, use 'Unknown' or 'Neutral' as defaults.",
+        subject_messages,
+        extra={"subject": subject},
+        max_posts=SUBJECT_ANALYZE_TOP
+    )
     try:
-        subject_results = json.loads(nak_content)
-        if not isinstance(subject_results, list):
-            raise ValueError("Result not a list")
-    except Exception as e:
+        analysis = structured_reply(nakulan, [{"role": "user", "content": prompt}], SUBJECT_ANALYSIS, azure_client)
+        by_number = {item["number"]: item for item in analysis["results"]}
+    except ResponseParseError:
         print("Analysis by Nakulan failed or not in expected format. Falling back to un-analyzed results.")
-        # Fallback: add defaults
-        subject_results = []
-        for i, msg in enumerate(subject_messages, start=1):
-            subject_results.append({
-                "number": i,
-                "text": msg.get("text", ""),
-                "did": msg.get("did", "Unknown"),
-                "intent": "Unknown",
-                "tone": "Neutral"
-            })
+        by_number = {}
+    subject_results = []
+    for msg in subject_messages:
+        item = by_number.get(msg["number"], {})
+        subject_results.append({
+            "number": msg["number"],
+            "text": msg.get("text", ""),
+            "did": msg.get("did", "Unknown"),
+            "intent": item.get("intent", "Unknown"),
+            "tone": item.get("tone", "Neutral")
+        })
 
     # Step 4: Display the search results
     print(f"\nSearch results for subject '{subject}':")
@@ -1076,22 +1322,25 @@ def search_subject_flow():
 
     # Step 7: Let the user choose reply type (human or agent)
     reply_option = sanjay.get_human_input("Reply type? Type 'human' for your own reply or 'agent' for agent-generated reply: ").strip().lower()
+    fused = None
+    if reply_option == "agent" and REPLY_MODE == "fused":
+        fused = fused_agent_reply(selected_message.get("text", ""))
+        if fused is None:
+            print("Fused reply parsing failed. Falling back to a separate draft.")
     if reply_option == "human":
         reply_text = sanjay.get_human_input("Enter your reply text: ")
+    elif fused:
+        reply_text = fused["reply"]
     elif reply_option == "agent":
         # Use the same logic as earlier: choose agent based on category if available (default far-left here)
-        if selected_message.get("category", "far-left").lower() == "far-left":
-            agent_reply = yudhistran.generate_reply(messages=[{"role": "user", "content": selected_message.get("text", "")}])
-        else:
-            agent_reply = arjunan.generate_reply(messages=[{"role": "user", "content": selected_message.get("text", "")}])
-        if isinstance(agent_reply, str):
-            raw_agent_reply = agent_reply
-        elif isinstance(agent_reply, dict):
-            raw_agent_reply = agent_reply.get("content", "")
-        else:
-            raw_agent_reply = getattr(agent_reply, "content", "")
-        raw_agent_reply = extract_json_content(raw_agent_reply)
-        reply_text = raw_agent_reply if raw_agent_reply.strip() else "No reply provided."
+        reply_agent = yudhistran if selected_message.get("category", "far-left").lower() == "far-left" else arjunan
+        try:
+            reply_text = draft_reply(
+                reply_agent, [{"role": "user", "content": selected_message.get("text", "")}], on_text=show_streamed
+            )
+        except ResponseParseError:
+            reply_text = ""
+        reply_text = reply_text if reply_text.strip() else "No reply provided."
     else:
         print("Invalid reply type selected.")
         return
@@ -1104,6 +1353,8 @@ def search_subject_flow():
         reply_result = json.loads(reply_result_json)
         if reply_result.get("status") == "success":
             print("Reply posted successfully.")
+        elif reply_result.get("status") == "queued":
+            print(reply_result.get("message"))
         else:
             print("Error posting reply:", reply_result.get("message"))
     else:
@@ -1118,7 +1369,9 @@ def main():
         print("2. Process replies to Bluesky messages")
         print("3. Search messages by subject and possibly reply")
         print("4. Exit")
-        choice = sanjay.get_human_input("Enter your choice (1, 2, 3, or 4): ").strip()
+        print("5. Draft agent replies for recent messages (async, nothing is posted)")
+        print("6. Review drafted replies from batch runs")
+        choice = sanjay.get_human_input("Enter your choice (1-6): ").strip()
         if choice == "1":
             show_plan("1")  # Display the plan for posting a message
             user_input = sanjay.get_human_input("Enter the message to post: ").strip()
@@ -1134,7 +1387,7 @@ def main():
             print("\nPlan for Subject Search:")
             print("Steps:")
             print("  1. You provide a subject keyword")
-            print("  2. Nakulan searches the latest 20 messages for that subject")
+            print("  2. New messages are stored locally and searched for that subject; Nakulan analyzes the matches")
             print("  3. Sanjay displays the matching messages")
             print("  4. You select a message to reply to")
             print("  5. You choose between writing your own reply or using an agent-generated one")
@@ -1151,10 +1404,33 @@ def main():
             
             search_subject_flow()
         elif choice == "4":
+            print("LLM response cache:", get_response_cache().stats())
+            print("Structured output parses:", parse_metrics.stats())
+            print("Streamed replies:", stream_stats.stats())
+            print("Prompt sizes:", prompt_stats.stats())
+            print("LLM dispatch:", dispatch_stats())
+            print("Model routing:", model_router.stats())
+            print("Pre-classifier:", {"message_category": message_pre_classifier.stats(),
+                                      "political_leaning": political_pre_classifier.stats()})
+            print("Write queue:", get_write_queue().stats())
             print("Exiting the script.")
             break
-    else:
-            print("Invalid choice. Please enter 1, 2, 3, or 4.")
+        elif choice == "5":
+            draft_replies_async_flow()
+        elif choice == "6":
+            review_approval_queue()
+        else:
+            print("Invalid choice. Please enter a number from 1 to 6.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bluesky multi-agent system")
+    parser.add_argument("--batch", type=int, metavar="N", help="process N timeline posts unattended and exit")
+    parser.add_argument("--policy", help="JSON policy file: categories to like, reply to or skip")
+    parser.add_argument("--concurrency", type=int, default=16, help="posts processed at once in batch mode")
+    parser.add_argument("--output", help=f"results file (default {BATCH_RESULTS_FILE})")
+    parser.add_argument("--queue", help=f"approval queue file (default {APPROVAL_QUEUE_FILE})")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch_mode(args.batch, args.policy, args.concurrency, args.output, args.queue)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+import asyncio
+from openai import AsyncAzureOpenAI
+from atproto import AsyncClient
+from bsky_session import get_session_manager
+from post_refs import get_post_resolver, reply_refs_for, ref_from_post_view
+from bsky_timeline import post_view_to_message
+from llm_cache import agent_deployment
+from llm_dispatch import adispatch, estimate_tokens
+from instrumentation import instrument, record_usage
+from write_queue import get_write_queue, post_record, like_record
+
+# ====================== ASYNC LLM CALLS ======================
+
+_async_azure_client = None
+_async_azure_loop = None
+
+def get_async_azure_client():
+    """
+    Return the shared AsyncAzureOpenAI client (same environment variables as the sync one).
+    Its connection pool belongs to one event loop, so a new loop gets a new client.
+    """
+    global _async_azure_client, _async_azure_loop
+    loop = asyncio.get_running_loop()
+    if _async_azure_client is None or _async_azure_loop is not loop:
+        _async_azure_client = AsyncAzureOpenAI(
+            azure_endpoint=os.getenv('ENDPOINT_URL'),
+            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+            api_version="2024-12-01-preview",
+            # Throttles are retried by the dispatcher, which also pauses the other callers.
+            max_retries=0
+        )
+        _async_azure_loop = loop
+    return _async_azure_client
+
+async def acomplete_for_agent(agent, messages, client=None, retries=None, **params):
+    """
+    Async equivalent of agent.generate_reply(messages=...) for plain (non-tool) replies:
+    the agent's system message and deployment, called through AsyncAzureOpenAI.
+    Extra request parameters (e.g. response_format) are passed through, and the call waits for
+    the deployment's dispatcher like the sync calls do. Returns (content, total_tokens).
+    """
+    client = client or get_async_azure_client()
+    deployment = agent_deployment(agent)
+    request = [{"role": "system", "content": agent.system_message}] + list(messages)
+
+    async def call():
+        completion = await client.chat.completions.create(model=deployment, messages=request, **params)
+        usage = getattr(completion, "usage", None)
+        record_usage(usage)
+        return completion.choices[0].message.content, getattr(usage, "total_tokens", 0) or 0
+
+    return await adispatch(deployment, call, estimate_tokens(request, deployment, params.get("max_completion_tokens")),
+                           retries)
+
+async def gather_limited(coroutines, limit):
+    """Run coroutines concurrently with at most `limit` in flight; results keep their order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines), return_exceptions=True)
+
+# ====================== ASYNC BLUESKY TOOLS ======================
+
+class AsyncBluesky:
+    """
+    Async Bluesky tools on an atproto.AsyncClient.
+
+    The client is seeded with the session string of the shared sync session manager,
+    so going async never costs an extra createSession. Writes go through the shared
+    rate-limited write queue, so concurrent batch writes are sent together in applyWrites calls.
+    """
+
+    def __init__(self, session_manager=None):
+        self.session_manager = session_manager or get_session_manager()
+        self._client = None
+        self._loop = None
+        self._login_lock = None
+
+    async def get_client(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Clients and locks are bound to the loop they were created on.
+            self._loop = loop
+            self._client = None
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self._client is None:
+                session_string = await asyncio.to_thread(
+                    lambda: self.session_manager.get_client().export_session_string()
+                )
+                client = AsyncClient()
+                await client.login(session_string=session_string)
+                self._client = client
+            return self._client
+
+    @instrument("bluesky:getTimeline")
+    async def fetch_timeline(self, limit=20, cursor=None):
+        """Return (posts, next_cursor) in the same message format as fetch_bluesky_following."""
+        client = await self.get_client()
+        timeline = await client.get_timeline(limit=min(limit, 100), cursor=cursor)
+        resolver = get_post_resolver()
+        posts = []
+        for idx, feed_view in enumerate(timeline.feed, start=1):
+            resolver.remember(ref_from_post_view(feed_view.post))
+            posts.append(post_view_to_message(feed_view.post, idx))
+        return posts, timeline.cursor
+
+    async def resolve(self, uri):
+        """Known refs come from memory; unknown ones go through the batching resolver off the loop."""
+        return await asyncio.to_thread(get_post_resolver().resolve, uri)
+
+    @instrument("bluesky:like")
+    async def like(self, post_uri):
+        try:
+            ref = await self.resolve(post_uri)
+            if not ref:
+                return {"status": "error", "message": "Post not found."}
+            return await get_write_queue().asubmit("like", like_record(post_uri, ref["cid"]),
+                                                   message="Post liked successfully")
+        except Exception as e:
+            return {"status": "error", "message": f"Error: {str(e)}"}
+
+    @instrument("bluesky:reply")
+    async def reply(self, original_uri, reply_content):
+        try:
+            ref = await self.resolve(original_uri)
+            if not ref:
+                return {"status": "error", "message": "Original post not found."}
+            return await get_write_queue().asubmit("reply", post_record(reply_content, reply=reply_refs_for(ref)),
+                                                   message="Reply posted successfully")
+        except Exception as e:
+            return {"status": "error", "message": f"Error: {str(e)}"}
+
+    @instrument("bluesky:post")
+    async def post(self, message):
+        try:
+            return await get_write_queue().asubmit("post", post_record(message), message="Posted successfully")
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+_async_bluesky = None
+
+def get_async_bluesky():
+    """Return the shared async Bluesky tools."""
+    global _async_bluesky
+    if _async_bluesky is None:
+        _async_bluesky = AsyncBluesky()
+    return _async_bluesky
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# ====================== POLICY ======================
+
+DEFAULT_POLICY = {
+    # Political categories (as assigned by Krsna) and what to do with them.
+    "like": [],
+    "reply": ["far-left", "left", "middle", "right", "far-right"],
+    "skip": [],
+    # Replies go to the approval queue unless auto_post is set; likes are applied directly.
+    "auto_post": False,
+    "auto_like": True
+}
+
+def load_policy(path=None):
+    """Load a batch policy from a JSON file, filling in defaults for missing keys."""
+    policy = dict(DEFAULT_POLICY)
+    if path:
+        with open(path, "r") as f:
+            policy.update(json.load(f))
+    for key in ("like", "reply", "skip"):
+        policy[key] = [c.lower() for c in policy.get(key, [])]
+    return policy
+
+def actions_for(category, policy):
+    """Return the set of actions ('like', 'reply') the policy allows for a category."""
+    category = (category or "").lower()
+    if category in policy["skip"]:
+        return set()
+    actions = set()
+    if category in policy["like"]:
+        actions.add("like")
+    if category in policy["reply"]:
+        actions.add("reply")
+    return actions
+
+# ====================== STAGE STATS ======================
+
+class StageStats:
+    """Per-stage counters and latencies for a batch run."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        """Time one unit of work in `stage`; exceptions are counted as errors and re-raised."""
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(stage, time.perf_counter() - started, ok)
+
+    def record(self, stage, seconds, ok=True):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"count": 0, "errors": 0, "latencies": []})
+            entry["count"] += 1
+            if not ok:
+                entry["errors"] += 1
+            entry["latencies"].append(seconds)
+
+    def summary(self):
+        """Return {stage: count, errors, throughput per second, mean/p50/p95 latency}."""
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        report = {}
+        with self._lock:
+            for stage, entry in self._stages.items():
+                latencies = sorted(entry["latencies"])
+                report[stage] = {
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "per_sec": round(entry["count"] / elapsed, 2),
+                    "mean_sec": round(sum(latencies) / len(latencies), 3),
+                    "p50_sec": round(latencies[len(latencies) // 2], 3),
+                    "p95_sec": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3)
+                }
+        report["wall_sec"] = round(elapsed, 2)
+        return report
+
+# ====================== OUTPUT ======================
+
+def append_jsonl(path, records):
+    """Append records to a JSONL file."""
+    if not records:
+        return
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def read_jsonl(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def write_jsonl(path, records):
+    """Rewrite a JSONL file atomically."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,200 @@
+import os
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bsky_cache import get_blob_cache
+from bsky_session import get_bluesky_client
+from xrpc_client import get_xrpc_client, UPLOAD_CHUNK_SIZE
+from image_prep import compress_for_upload, BSKY_IMAGE_MAX_BYTES, BSKY_IMAGE_MAX_SIDE
+from instrumentation import carry_context
+
+MAX_IMAGES = 4
+BSKY_VIDEO_MAX_BYTES = int(os.getenv('BSKY_VIDEO_MAX_BYTES', str(100 * 1024 * 1024)))
+DEFAULT_ALT_TEXT = 'Image shared by AI agent'
+
+# ====================== BLOB REFS ======================
+
+def blob_to_json(blob):
+    """Serialize an uploaded blob ref so it can be cached."""
+    if hasattr(blob, "model_dump"):
+        return blob.model_dump(mode="json", by_alias=True)
+    return blob
+
+def blob_from_json(data):
+    """Rebuild a cached blob ref for use in a post embed."""
+    try:
+        from atproto import models
+        return models.BlobRef.model_validate(data)
+    except Exception:
+        return data
+
+def file_digest(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ====================== UPLOADER ======================
+
+class BlobUploader:
+    """
+    Uploads images as Bluesky blobs after compress_for_upload (EXIF stripped, resized,
+    recompressed under the size limit).
+
+    Returned blob refs are cached by a hash of the original file contents (and the limits
+    used), so posting or retrying with the same image skips both the compression and the
+    upload. Counters record uploads, dedup hits and bytes saved.
+    """
+
+    def __init__(self, client_factory=get_bluesky_client, cache=None,
+                 max_bytes=BSKY_IMAGE_MAX_BYTES, max_side=BSKY_IMAGE_MAX_SIDE, xrpc_factory=get_xrpc_client):
+        self.client_factory = client_factory
+        self.xrpc_factory = xrpc_factory
+        self.cache = cache or get_blob_cache()
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.bytes_original = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def content_key(self, digest):
+        return f"{digest}:{self.max_bytes}:{self.max_side}"
+
+    def _cached(self, key, size):
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self.dedup_hits += 1
+                self.bytes_saved += size
+            return blob_from_json(cached)
+        return None
+
+    def _record(self, original_bytes, upload_bytes):
+        with self._lock:
+            self.uploads += 1
+            self.bytes_original += original_bytes
+            self.bytes_uploaded += upload_bytes
+            self.bytes_saved += original_bytes - upload_bytes
+
+    def upload(self, image_path):
+        """
+        Upload the image at `image_path` (hashed and decoded from the file, never read whole into memory).
+        Returns (blob, key); pass the key to forget() if the post fails.
+        """
+        key = self.content_key(file_digest(image_path))
+        blob = self._cached(key, os.path.getsize(image_path))
+        if blob is not None:
+            return blob, key
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        prepared, prepared_mime, info = compress_for_upload(image_path, mime_type, self.max_bytes, self.max_side)
+        blob = self.client_factory().com.atproto.repo.upload_blob(prepared, prepared_mime).blob
+        self.cache.set(key, blob_to_json(blob))
+        self._record(info["original_bytes"], info["upload_bytes"])
+        return blob, key
+
+    def upload_video(self, video_path):
+        """Upload a video as it is, streamed from disk through the pooled XRPC client. Returns (blob, key)."""
+        size = os.path.getsize(video_path)
+        if size > BSKY_VIDEO_MAX_BYTES:
+            raise ValueError(f"Video is {size} bytes (limit {BSKY_VIDEO_MAX_BYTES})")
+        key = f"video:{file_digest(video_path)}"
+        blob = self._cached(key, size)
+        if blob is not None:
+            return blob, key
+        mime_type = mimetypes.guess_type(video_path)[0] or "video/mp4"
+        response = self.xrpc_factory().upload_file("com.atproto.repo.uploadBlob", video_path, mime_type)
+        if response.status_code != 200:
+            raise RuntimeError(f"Video upload failed: {response.text}")
+        blob_json = response.json()["blob"]
+        self.cache.set(key, blob_json)
+        self._record(size, size)
+        return blob_from_json(blob_json), key
+
+    def forget(self, key):
+        """Drop a cached blob ref, e.g. after a failed post (unreferenced blobs are garbage collected)."""
+        self.cache.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "dedup_hits": self.dedup_hits,
+                "bytes_original": self.bytes_original,
+                "bytes_uploaded": self.bytes_uploaded,
+                "bytes_saved": self.bytes_saved
+            }
+
+# ====================== MEDIA EMBEDS ======================
+
+def build_media_embed(image_paths=None, video_path=None, alt_text_fn=None, uploader=None, max_workers=None):
+    """
+    Upload up to MAX_IMAGES images (or one video) concurrently and return (embed, blob_keys).
+
+    `alt_text_fn(path)`, if given, writes each file's alt text; those calls run in the same
+    pool as the uploads, so building the embed takes about as long as the slowest upload.
+    """
+    image_paths = list(image_paths or [])
+    if image_paths and video_path:
+        raise ValueError("A post can embed images or a video, not both")
+    if len(image_paths) > MAX_IMAGES:
+        raise ValueError(f"A post can embed at most {MAX_IMAGES} images")
+    paths = [video_path] if video_path else image_paths
+    if not paths:
+        return None, []
+    uploader = uploader or get_blob_uploader()
+    upload = uploader.upload_video if video_path else uploader.upload
+
+    def alt_text(path):
+        try:
+            return (alt_text_fn(path) or DEFAULT_ALT_TEXT).strip()[:1000]
+        except Exception:
+            return DEFAULT_ALT_TEXT
+
+    # One worker per upload and per alt text, so none of them waits for another.
+    with ThreadPoolExecutor(max_workers=max_workers or len(paths) * (2 if alt_text_fn else 1)) as pool:
+        uploads = [pool.submit(carry_context(upload), path) for path in paths]
+        alts = [pool.submit(carry_context(alt_text), path) if alt_text_fn else None for path in paths]
+        results, errors = [], []
+        for future in uploads:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        alt_texts = [future.result() if future else DEFAULT_ALT_TEXT for future in alts]
+    keys = [key for _, key in results]
+    if errors:
+        for key in keys:
+            uploader.forget(key)
+        raise errors[0]
+
+    if video_path:
+        embed = {'$type': 'app.bsky.embed.video', 'video': results[0][0], 'alt': alt_texts[0]}
+    else:
+        embed = {
+            '$type': 'app.bsky.embed.images',
+            'images': [{'alt': alt, 'image': blob} for (blob, _), alt in zip(results, alt_texts)]
+        }
+    return embed, keys
+
+def forget_uploads(keys, uploader=None):
+    """Drop the cached blob refs of a post that failed."""
+    uploader = uploader or get_blob_uploader()
+    for key in keys:
+        uploader.forget(key)
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+def get_blob_uploader():
+    """Return the shared blob uploader."""
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = BlobUploader()
+        return _uploader
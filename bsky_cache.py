@@ -0,0 +1,173 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# ====================== TTL + LRU CACHE ======================
+
+class TTLCache:
+    """
+    Bounded in-memory cache with a TTL per entry and least-recently-used eviction.
+
+    When `sqlite_path` is given, entries are also written through to a local SQLite
+    file so they survive restarts; memory misses fall back to that file. The file is
+    bounded too: expired rows are deleted and at most `maxsize` rows (those expiring
+    last) are kept, at startup and every `prune_every` writes.
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, sqlite_path=None, namespace="default", prune_every=100):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.prune_every = prune_every
+        self._writes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_expiry ON cache (namespace, expires_at)")
+            self._prune()
+            self._db.commit()
+
+    def get(self, key, default=None):
+        """Return the cached value if present and not expired."""
+        value, fresh = self.get_with_state(key)
+        if value is None or not fresh:
+            return default
+        return value
+
+    def get_with_state(self, key):
+        """
+        Return (value, fresh). Expired entries are returned with fresh=False so the
+        caller can revalidate them instead of refetching from scratch.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._data.move_to_end(key)
+            value, expires_at = entry
+            if expires_at > time.time():
+                self.hits += 1
+                return value, True
+            self.stale_hits += 1
+            return value, False
+
+    def set(self, key, value, ttl=None):
+        """Store a value with the given TTL (defaults to the cache TTL)."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, (value, expires_at))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), expires_at)
+                )
+                self._writes += 1
+                if self._writes % self.prune_every == 0:
+                    self._prune()
+                self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss counters for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale_hits
+            return {
+                "namespace": self.namespace,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+    def _store(self, key, entry):
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self):
+        """Delete this namespace's expired rows, then all but the `maxsize` rows that expire last."""
+        self._db.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time()))
+        self._db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache WHERE namespace = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize)
+        )
+
+    def _load(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+# ====================== SHARED CACHES ======================
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def _get_cache(namespace, maxsize, ttl):
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = TTLCache(
+                maxsize=maxsize,
+                ttl=ttl,
+                sqlite_path=os.getenv('BSKY_CACHE_DB'),
+                namespace=namespace
+            )
+        return _caches[namespace]
+
+def get_handle_cache():
+    """Handle -> DID cache. Handles rarely change owner, so entries live for a day by default."""
+    return _get_cache("handle_did", int(os.getenv('HANDLE_CACHE_SIZE', '4096')),
+                      int(os.getenv('HANDLE_CACHE_TTL', '86400')))
+
+def get_feed_cache():
+    """Author feed page cache. Entries are short-lived and revalidated by the newest post."""
+    return _get_cache("author_feed", int(os.getenv('FEED_CACHE_SIZE', '256')),
+                      int(os.getenv('FEED_CACHE_TTL', '60')))
+
+def get_blob_cache():
+    """Image content hash -> uploaded blob ref, so the same image is never uploaded twice."""
+    return _get_cache("blob_refs", int(os.getenv('BLOB_CACHE_SIZE', '1024')),
+                      int(os.getenv('BLOB_CACHE_TTL', '604800')))
+
+def cache_stats():
+    """Return the counters of every shared cache."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return [cache.stats() for cache in caches]
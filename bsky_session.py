@@ -0,0 +1,179 @@
+import os
+import time
+import json
+import base64
+import threading
+import atproto
+from instrumentation import instrument
+
+# ====================== SESSION HELPERS ======================
+
+def decode_jwt_exp(token):
+    """Return the 'exp' claim of a JWT as a unix timestamp, or 0 if it cannot be read."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload)).get("exp", 0))
+    except Exception:
+        return 0
+
+def parse_session_string(session_string):
+    """
+    Split an atproto session string into its parts.
+    The SDK encodes sessions as 'handle:::did:::access_jwt:::refresh_jwt[:::pds_endpoint]'.
+    """
+    parts = (session_string or "").split(":::")
+    if len(parts) < 4:
+        return None
+    return {
+        "handle": parts[0],
+        "did": parts[1],
+        "access_jwt": parts[2],
+        "refresh_jwt": parts[3],
+        "pds_endpoint": parts[4] if len(parts) > 4 else None
+    }
+
+# ====================== SESSION MANAGER ======================
+
+class BlueskySessionManager:
+    """
+    Keep a single logged-in atproto.Client alive and share it between tool calls.
+
+    The session string is persisted to disk so a restarted process resumes the
+    existing session instead of calling createSession again. Access tokens are
+    refreshed `refresh_margin` seconds before they expire, and a full login is
+    only done when no usable refresh token is left.
+    """
+
+    def __init__(self, username, password, session_path=None, refresh_margin=300):
+        self.username = username
+        self.password = password
+        self.session_path = session_path
+        self.refresh_margin = refresh_margin
+        self.logins = 0
+        self.refreshes = 0
+        self._client = None
+        self._lock = threading.RLock()
+
+    def get_client(self):
+        """Return the shared client, logging in or refreshing only when needed."""
+        with self._lock:
+            if self._client is None:
+                self._client = self._restore_or_login()
+            elif self._needs_refresh():
+                self._refresh()
+            return self._client
+
+    def get_session(self):
+        """Return the current session parts (handle, did, tokens, pds endpoint)."""
+        with self._lock:
+            client = self.get_client()
+            return parse_session_string(client.export_session_string())
+
+    def invalidate(self):
+        """Drop the cached client, e.g. after the server rejected its token."""
+        with self._lock:
+            self._client = None
+
+    def refresh(self):
+        """Force a token refresh now."""
+        with self._lock:
+            if self._client is None:
+                self._client = self._restore_or_login()
+            else:
+                self._refresh()
+            return self._client
+
+    # ----- internals -----
+
+    def _new_client(self):
+        client = atproto.Client()
+        client.on_session_change(self._on_session_change)
+        return client
+
+    def _restore_or_login(self):
+        session_string = self._load_session_string()
+        session = parse_session_string(session_string)
+        if session and decode_jwt_exp(session["refresh_jwt"]) > time.time() + self.refresh_margin:
+            try:
+                client = self._new_client()
+                client.login(session_string=session_string)
+                return client
+            except Exception as e:
+                print(f"Stored Bluesky session could not be restored ({e}); logging in again.")
+        return self._login()
+
+    @instrument("bluesky:createSession")
+    def _login(self):
+        client = self._new_client()
+        client.login(self.username, self.password)
+        self.logins += 1
+        self._save_session_string(client.export_session_string())
+        return client
+
+    def _needs_refresh(self):
+        session = parse_session_string(self._client.export_session_string())
+        if not session:
+            return True
+        return decode_jwt_exp(session["access_jwt"]) <= time.time() + self.refresh_margin
+
+    @instrument("bluesky:refreshSession")
+    def _refresh(self):
+        session = parse_session_string(self._client.export_session_string())
+        if not session or decode_jwt_exp(session["refresh_jwt"]) <= time.time():
+            self._client = self._login()
+            return
+        try:
+            # Same call the SDK makes when it notices an expired token; doing it early
+            # keeps requests from stalling on a refresh round trip mid-workflow.
+            self._client._refresh_and_set_session()
+            self.refreshes += 1
+        except Exception as e:
+            print(f"Bluesky session refresh failed ({e}); logging in again.")
+            self._client = self._login()
+
+    def _on_session_change(self, event, session):
+        try:
+            self._save_session_string(session.export())
+        except Exception as e:
+            print(f"Could not persist Bluesky session: {e}")
+
+    def _load_session_string(self):
+        if not self.session_path or not os.path.exists(self.session_path):
+            return None
+        try:
+            with open(self.session_path, "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _save_session_string(self, session_string):
+        if not self.session_path or not session_string:
+            return
+        tmp_path = self.session_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(session_string)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.session_path)
+
+# ====================== SHARED INSTANCE ======================
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+def get_session_manager():
+    """Return the process-wide session manager configured from environment variables."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = BlueskySessionManager(
+                os.getenv('BSKYUNAME'),
+                os.getenv('BSKYPASSWD'),
+                session_path=os.getenv('BSKY_SESSION_FILE', '.bsky_session'),
+                refresh_margin=int(os.getenv('BSKY_REFRESH_MARGIN', '300'))
+            )
+        return _default_manager
+
+def get_bluesky_client():
+    """Return the shared, logged-in Bluesky client."""
+    return get_session_manager().get_client()
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+from urllib.parse import urlencode
+from post_refs import get_post_resolver
+
+# websockets is only needed for live streaming; replay files work without it.
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:
+    ws_connect = None
+
+DEFAULT_JETSTREAM_URL = "wss://jetstream2.us-east.bsky.network/subscribe"
+POST_COLLECTION = "app.bsky.feed.post"
+# Jetstream accepts at most 10,000 wantedDids per connection.
+MAX_WANTED_DIDS = 10000
+# On reconnect, rewind the cursor a little so events in flight are not lost; duplicates are dropped by URI.
+CURSOR_REWIND_US = 5 * 1_000_000
+
+# ====================== EVENT DECODING ======================
+
+def event_to_message(event):
+    """
+    Convert a Jetstream commit event for a new post into the message dict used by the workflows.
+    Returns None for anything that is not a post creation.
+    """
+    if event.get("kind") != "commit":
+        return None
+    commit = event.get("commit") or {}
+    if commit.get("operation") != "create" or commit.get("collection") != POST_COLLECTION:
+        return None
+    record = commit.get("record") or {}
+    did = event.get("did")
+    uri = f"at://{did}/{POST_COLLECTION}/{commit.get('rkey')}"
+    reply = record.get("reply") or {}
+    return {
+        "number": 0,
+        "did": uri,
+        "cid": commit.get("cid"),
+        "root": reply.get("root"),
+        "parent": reply.get("parent"),
+        "author": did,
+        "text": record.get("text", ""),
+        "timestamp": record.get("createdAt"),
+        "time_us": event.get("time_us")
+    }
+
+def load_followed_dids(client, actor=None):
+    """Return the DIDs the given actor (default: the logged-in account) follows."""
+    actor = actor or client.me.did
+    dids = []
+    cursor = None
+    while True:
+        response = client.get_follows(actor=actor, cursor=cursor, limit=100)
+        dids.extend(follow.did for follow in response.follows)
+        cursor = response.cursor
+        if not cursor or not response.follows:
+            return dids
+
+# ====================== INGESTOR ======================
+
+class PostStreamIngestor:
+    """
+    Read new posts from a Jetstream feed in a background thread and queue the matching ones.
+
+    Posts are kept when they come from one of `dids` and/or contain one of `keywords`
+    (no filter means everything). The queue is bounded: with overflow='block' the reader
+    waits for consumers (backpressure), with overflow='drop_oldest' stale posts make room.
+    Disconnects are retried with jittered backoff from the last cursor. A JSONL `replay_path`
+    of recorded events can be used instead of the socket.
+    """
+
+    def __init__(self, dids=None, keywords=None, queue_size=1000, overflow="block",
+                 url=None, replay_path=None, cursor=None, max_backoff=60):
+        self.dids = set(dids or [])
+        self.keywords = [k.lower() for k in (keywords or []) if k]
+        self.overflow = overflow
+        self.url = url or os.getenv('JETSTREAM_URL', DEFAULT_JETSTREAM_URL)
+        self.replay_path = replay_path
+        self.cursor = cursor
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.matched = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        self.started_at = None
+        self._seen = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ----- lifecycle -----
+
+    def start(self):
+        """Start ingesting in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="bsky-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ----- consumption -----
+
+    def get(self, timeout=None):
+        """Block until a post is available (or the timeout expires, returning None)."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self, max_items=20, timeout=0):
+        """Return up to `max_items` queued posts, waiting at most `timeout` seconds for the first one."""
+        posts = []
+        first = self.get(timeout=timeout) if timeout else None
+        if first is not None:
+            posts.append(first)
+        while len(posts) < max_items:
+            try:
+                posts.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return posts
+
+    def stats(self):
+        """Return throughput counters."""
+        elapsed = max(time.time() - self.started_at, 1e-9) if self.started_at else 0
+        return {
+            "received": self.received,
+            "matched": self.matched,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "reconnects": self.reconnects,
+            "queued": self.queue.qsize(),
+            "cursor": self.cursor,
+            "events_per_sec": round(self.received / elapsed, 1) if elapsed else 0.0,
+            "matched_per_sec": round(self.matched / elapsed, 2) if elapsed else 0.0
+        }
+
+    # ----- internals -----
+
+    def _run(self):
+        if self.replay_path:
+            self._consume(self._iter_replay())
+            return
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self._consume(self._iter_socket())
+                backoff = 1
+            except Exception as e:
+                print(f"Stream disconnected ({e}); reconnecting in {backoff}s from cursor {self.cursor}.")
+            if self._stop.wait(backoff * (0.5 + random.random())):
+                break
+            self.reconnects += 1
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _consume(self, lines):
+        for line in lines:
+            if self._stop.is_set():
+                return
+            self._handle_line(line)
+
+    def _iter_replay(self):
+        with open(self.replay_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def _iter_socket(self):
+        if ws_connect is None:
+            raise RuntimeError("The 'websockets' package is required for live streaming")
+        with ws_connect(self._subscribe_url(), max_size=None) as ws:
+            while not self._stop.is_set():
+                try:
+                    yield ws.recv(timeout=1)
+                except TimeoutError:
+                    continue
+
+    def _subscribe_url(self):
+        params = [("wantedCollections", POST_COLLECTION)]
+        if self.dids and len(self.dids) <= MAX_WANTED_DIDS:
+            params.extend(("wantedDids", did) for did in sorted(self.dids))
+        if self.cursor:
+            params.append(("cursor", max(int(self.cursor) - CURSOR_REWIND_US, 0)))
+        return f"{self.url}?{urlencode(params)}"
+
+    def _handle_line(self, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        self.received += 1
+        if event.get("time_us"):
+            self.cursor = event["time_us"]
+        message = event_to_message(event)
+        if message is None or not self._matches(event.get("did"), message["text"]):
+            return
+        if message["did"] in self._seen:
+            self.duplicates += 1
+            return
+        self._remember_seen(message["did"])
+        if message["cid"]:
+            get_post_resolver().remember({
+                "uri": message["did"],
+                "cid": message["cid"],
+                "root": message["root"],
+                "parent": message["parent"]
+            })
+        self._enqueue(message)
+        self.matched += 1
+
+    def _matches(self, did, text):
+        if self.dids and did not in self.dids:
+            return False
+        if self.keywords:
+            lowered = (text or "").lower()
+            return any(keyword in lowered for keyword in self.keywords)
+        return True
+
+    def _remember_seen(self, uri):
+        self._seen[uri] = True
+        if len(self._seen) > 10000:
+            # dicts keep insertion order, so this forgets the oldest URI.
+            self._seen.pop(next(iter(self._seen)))
+
+    def _enqueue(self, message):
+        if self.overflow == "drop_oldest":
+            while True:
+                try:
+                    self.queue.put_nowait(message)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not self._stop.is_set():
+            try:
+                self.queue.put(message, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+# ====================== SHARED INSTANCE ======================
+
+_default_ingestor = None
+_default_ingestor_lock = threading.Lock()
+
+def get_stream_ingestor(client=None):
+    """
+    Return the process-wide ingestor configured from environment variables.
+    BSKY_STREAM_FOLLOWING=1 restricts it to followed accounts (needs `client`),
+    BSKY_STREAM_KEYWORDS is a comma-separated keyword filter, and
+    BSKY_STREAM_REPLAY points at a recorded JSONL file to replay instead of the socket.
+    """
+    global _default_ingestor
+    with _default_ingestor_lock:
+        if _default_ingestor is None:
+            dids = None
+            if os.getenv('BSKY_STREAM_FOLLOWING', '1') == '1' and client is not None:
+                dids = load_followed_dids(client)
+            keywords = [k.strip() for k in os.getenv('BSKY_STREAM_KEYWORDS', '').split(',')]
+            _default_ingestor = PostStreamIngestor(
+                dids=dids,
+                keywords=keywords,
+                queue_size=int(os.getenv('BSKY_STREAM_QUEUE_SIZE', '1000')),
+                overflow=os.getenv('BSKY_STREAM_OVERFLOW', 'block'),
+                replay_path=os.getenv('BSKY_STREAM_REPLAY')
+            )
+        return _default_ingestor
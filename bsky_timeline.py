@@ -0,0 +1,133 @@
+import os
+import json
+import datetime
+import threading
+from bsky_session import get_bluesky_client
+from post_refs import get_post_resolver, ref_from_post_view
+
+# getTimeline returns at most 100 posts per page.
+MAX_PAGE_SIZE = 100
+
+# ====================== CONVERSION ======================
+
+def parse_timestamp(value):
+    """Parse an atproto datetime string; unparseable values sort as the epoch."""
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+
+def feed_view_sort_at(feed_view):
+    """Timestamp the timeline is ordered by: the repost time for reposts, otherwise the post's indexedAt."""
+    reason = getattr(feed_view, "reason", None)
+    return getattr(reason, "indexed_at", None) or feed_view.post.indexed_at
+
+def post_view_to_message(post, number):
+    """Convert a post view into the message dict used by the workflows."""
+    ref = ref_from_post_view(post)
+    return {
+        "number": number,
+        "did": post.uri,
+        "cid": post.cid,
+        "root": ref["root"],
+        "parent": ref["parent"],
+        "author": post.author.display_name or post.author.handle,
+        "text": post.record.text,
+        "timestamp": post.indexed_at
+    }
+
+# ====================== PAGINATION ======================
+
+def iter_timeline_pages(page_size=50, cursor=None, max_pages=None, client_factory=get_bluesky_client):
+    """
+    Lazily yield timeline pages as {'feed': [...feed views...], 'cursor': next_cursor}.
+    Iteration stops when the server returns no cursor or `max_pages` is reached.
+    """
+    client = client_factory()
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        timeline = client.get_timeline(limit=min(page_size, MAX_PAGE_SIZE), cursor=cursor)
+        pages += 1
+        cursor = timeline.cursor
+        yield {"feed": timeline.feed, "cursor": cursor}
+        if not cursor or not timeline.feed:
+            break
+
+def iter_timeline_posts(limit=None, page_size=50, cursor=None, stop_at=None, client_factory=get_bluesky_client):
+    """
+    Yield (message, cursor) pairs across pages, newest first, remembering each post's refs.
+    Stops after `limit` posts or at the first post not newer than the `stop_at` datetime.
+    """
+    resolver = get_post_resolver()
+    number = 0
+    for page in iter_timeline_pages(page_size=page_size, cursor=cursor, client_factory=client_factory):
+        for feed_view in page["feed"]:
+            if stop_at is not None and parse_timestamp(feed_view_sort_at(feed_view)) <= stop_at:
+                return
+            number += 1
+            message = post_view_to_message(feed_view.post, number)
+            resolver.remember(ref_from_post_view(feed_view.post))
+            message["sort_at"] = feed_view_sort_at(feed_view)
+            yield message, page["cursor"]
+            if limit is not None and number >= limit:
+                return
+
+# ====================== INCREMENTAL POLLING ======================
+
+class TimelinePoller:
+    """
+    Fetch only timeline posts newer than the last one seen.
+
+    The high-water mark is the newest sort timestamp returned so far; it is kept on disk
+    when `state_path` is set so polling resumes where the previous process stopped.
+    """
+
+    def __init__(self, state_path=None, page_size=50, client_factory=get_bluesky_client):
+        self.state_path = state_path
+        self.page_size = page_size
+        self.client_factory = client_factory
+        self.high_water_mark = None
+        self._lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            try:
+                with open(state_path, "r") as f:
+                    self.high_water_mark = json.load(f).get("high_water_mark")
+            except (OSError, ValueError):
+                self.high_water_mark = None
+
+    def poll(self, max_posts=None):
+        """
+        Return the posts added since the previous poll, newest first.
+        With `max_posts` set, anything older than the newest `max_posts` new posts is skipped.
+        """
+        with self._lock:
+            stop_at = parse_timestamp(self.high_water_mark) if self.high_water_mark else None
+            posts = [message for message, _ in iter_timeline_posts(
+                limit=max_posts,
+                page_size=self.page_size,
+                stop_at=stop_at,
+                client_factory=self.client_factory
+            )]
+            if posts:
+                newest = max(posts, key=lambda m: parse_timestamp(m["sort_at"]))["sort_at"]
+                if not self.high_water_mark or parse_timestamp(newest) > parse_timestamp(self.high_water_mark):
+                    self.high_water_mark = newest
+                    self._save()
+            return posts
+
+    def _save(self):
+        if not self.state_path:
+            return
+        with open(self.state_path, "w") as f:
+            json.dump({"high_water_mark": self.high_water_mark}, f)
+
+_default_poller = None
+_default_poller_lock = threading.Lock()
+
+def get_timeline_poller():
+    """Return the process-wide timeline poller."""
+    global _default_poller
+    with _default_poller_lock:
+        if _default_poller is None:
+            _default_poller = TimelinePoller(state_path=os.getenv('BSKY_TIMELINE_STATE'))
+        return _default_poller
@@ -0,0 +1,142 @@
+import os
+import io
+import base64
+import mimetypes
+import threading
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Images sent to the multimodal model are downscaled so their longest side is at most this many pixels.
+VISION_MAX_SIDE = int(os.getenv('PHI4_IMAGE_MAX_SIDE', '1024'))
+VISION_JPEG_QUALITY = int(os.getenv('PHI4_IMAGE_QUALITY', '85'))
+
+# ====================== PREPARATION ======================
+
+def prepare_image(image_path, max_side=None, quality=None):
+    """
+    Return (image_bytes, mime_type, info) for sending an image to a vision model: EXIF-rotated,
+    downscaled to `max_side` and re-encoded as JPEG. Without Pillow the file is sent as it is.
+    `info` has the original and sent byte sizes and dimensions.
+
+    The image is decoded straight from the file, and JPEGs are decoded at the smallest scale
+    that still covers `max_side`.
+    """
+    max_side = max_side or VISION_MAX_SIDE
+    quality = quality or VISION_JPEG_QUALITY
+    original_bytes = os.path.getsize(image_path)
+    if not PIL_AVAILABLE:
+        with open(image_path, "rb") as f:
+            original = f.read()
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        return original, mime_type, {"original_bytes": original_bytes, "sent_bytes": original_bytes}
+    with Image.open(image_path) as opened:
+        original_size = opened.size
+        opened.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(opened)
+        if image.size != opened.size:
+            original_size = original_size[::-1]
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+        sent_size = image.size
+    data = out.getvalue()
+    return data, "image/jpeg", {
+        "original_bytes": original_bytes,
+        "sent_bytes": len(data),
+        "original_size": original_size,
+        "sent_size": sent_size
+    }
+
+def image_data_url(image_bytes, mime_type):
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+# Bluesky rejects image blobs over 1,000,000 bytes; 2000 px is the largest side it displays.
+BSKY_IMAGE_MAX_BYTES = int(os.getenv('BSKY_IMAGE_MAX_BYTES', '1000000'))
+BSKY_IMAGE_MAX_SIDE = int(os.getenv('BSKY_IMAGE_MAX_SIDE', '2000'))
+UPLOAD_QUALITIES = (90, 82, 75, 68, 60, 50)
+
+def compress_for_upload(source, mime_type, max_bytes=None, max_side=None):
+    """
+    Return (image_bytes, mime_type, info) for a Bluesky image upload: EXIF-rotated and stripped
+    (no location or camera metadata leaves the machine), resized to `max_side` and recompressed
+    as JPEG at the best quality that fits `max_bytes`, shrinking further if even the lowest
+    quality does not fit. Without Pillow, images within the limit are passed through and
+    larger ones raise ValueError.
+
+    `source` is image bytes or a file path; a path is decoded straight from the file
+    rather than read into memory first.
+    """
+    max_bytes = max_bytes or BSKY_IMAGE_MAX_BYTES
+    max_side = max_side or BSKY_IMAGE_MAX_SIDE
+    is_path = isinstance(source, (str, os.PathLike))
+    original_bytes = os.path.getsize(source) if is_path else len(source)
+    if not PIL_AVAILABLE:
+        if original_bytes > max_bytes:
+            raise ValueError(f"Image is {original_bytes} bytes (limit {max_bytes}); install Pillow to compress it")
+        if is_path:
+            with open(source, "rb") as f:
+                source = f.read()
+        return source, mime_type, {"original_bytes": original_bytes, "upload_bytes": original_bytes}
+    with Image.open(source if is_path else io.BytesIO(source)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        original_size = image.size
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        while True:
+            for quality in UPLOAD_QUALITIES:
+                out = io.BytesIO()
+                # No exif= argument: the re-encoded JPEG carries no EXIF block.
+                image.save(out, format="JPEG", quality=quality, optimize=True)
+                if out.tell() <= max_bytes:
+                    encoded = out.getvalue()
+                    return encoded, "image/jpeg", {
+                        "original_bytes": original_bytes,
+                        "upload_bytes": len(encoded),
+                        "original_size": original_size,
+                        "upload_size": image.size,
+                        "quality": quality
+                    }
+            image = image.resize((max(image.width * 3 // 4, 1), max(image.height * 3 // 4, 1)), Image.LANCZOS)
+
+# ====================== STATS ======================
+
+class VisionStats:
+    """Latency, tokens and bytes of image calls to the multimodal model."""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, latency, prompt_tokens, completion_tokens, info):
+        with self._lock:
+            self.calls.append(dict(info, latency_sec=round(latency, 3),
+                                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+
+    def stats(self):
+        with self._lock:
+            if not self.calls:
+                return {"images": 0}
+            n = len(self.calls)
+            return {
+                "images": n,
+                "mean_latency_sec": round(sum(c["latency_sec"] for c in self.calls) / n, 3),
+                "mean_prompt_tokens": round(sum(c["prompt_tokens"] or 0 for c in self.calls) / n, 1),
+                "mean_completion_tokens": round(sum(c["completion_tokens"] or 0 for c in self.calls) / n, 1),
+                "bytes_sent": sum(c["sent_bytes"] for c in self.calls),
+                "bytes_original": sum(c["original_bytes"] for c in self.calls),
+                "last": self.calls[-1]
+            }
+
+vision_stats = VisionStats()
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import asyncio
+import itertools
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# OpenTelemetry is optional; with INSTRUMENTATION_OTEL=1 every span is also sent to the configured
+# tracer provider (set up the exporter as usual, e.g. with opentelemetry-instrument).
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+# One JSON object per span and per workflow summary; set to an empty string to disable.
+INSTRUMENTATION_LOG = os.getenv('INSTRUMENTATION_LOG', 'instrumentation.jsonl')
+OTEL_ENABLED = OTEL_AVAILABLE and os.getenv('INSTRUMENTATION_OTEL', '0') == '1'
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Ids of the workflows the current code runs in; a span only counts towards those workflows.
+_workflow_ids = contextvars.ContextVar("workflow_ids", default=())
+_log_lock = threading.Lock()
+_log_file = None
+_workflows = {}
+_workflow_counter = itertools.count(1)
+_workflows_lock = threading.Lock()
+_prices = {}
+
+def register_prices(config_list):
+    """Remember the "price" ([prompt, completion] USD per 1K tokens) of config_list entries, for span costs."""
+    for entry in config_list:
+        if entry.get("model") and entry.get("price"):
+            _prices[entry["model"]] = entry["price"]
+
+def _cost(record):
+    price = _prices.get(record.get("deployment"))
+    if not price:
+        return None
+    prompt_price, completion_price = (price, price) if isinstance(price, (int, float)) else price
+    prompt = record.get("prompt_tokens")
+    completion = record.get("completion_tokens")
+    if prompt is None and completion is None:
+        total = record.get("total_tokens") or 0
+        return round(total * (prompt_price + completion_price) / 2 / 1000, 6)
+    return round(((prompt or 0) * prompt_price + (completion or 0) * completion_price) / 1000, 6)
+
+# ====================== SPANS ======================
+
+def _write(record):
+    global _log_file
+    if not INSTRUMENTATION_LOG:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        if _log_file is None:
+            # Line-buffered: every record is on disk once written, without reopening the file per span.
+            _log_file = open(INSTRUMENTATION_LOG, "a", buffering=1)
+        _log_file.write(line + "\n")
+
+def outcome_of(result):
+    """'error' for tool results that report {"status": "error"} (as dicts or JSON strings), else 'ok'."""
+    if isinstance(result, str) and result.startswith("{"):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return "ok"
+    if isinstance(result, dict) and result.get("status") == "error":
+        return "error"
+    return "ok"
+
+def annotate(**attrs):
+    """
+    Add to the current span: token and queue-wait numbers are summed, everything else is set.
+    Does nothing outside a span.
+    """
+    record = _current_span.get()
+    if record is None:
+        return
+    for key, value in attrs.items():
+        if value is None:
+            continue
+        if key in ("prompt_tokens", "completion_tokens", "total_tokens", "queue_wait_sec"):
+            record[key] = round((record.get(key) or 0) + value, 4)
+        else:
+            record[key] = value
+
+def record_usage(usage):
+    """Annotate prompt/completion tokens from an API usage object."""
+    if usage is not None:
+        annotate(prompt_tokens=getattr(usage, "prompt_tokens", None),
+                 completion_tokens=getattr(usage, "completion_tokens", None))
+
+def current_span_name():
+    record = _current_span.get()
+    return record["span"] if record else None
+
+@contextmanager
+def span(name, kind="tool", **attrs):
+    """
+    Time one call. Yields the span record (callers may set "outcome"); annotate() adds tokens,
+    queue wait, cache state and deployment. The finished record goes to the JSONL log, the
+    workflows the caller runs in and, if enabled, OpenTelemetry.
+    """
+    parent = _current_span.get()
+    record = {"span": name, "kind": kind, "parent": parent["span"] if parent else None, "started_at": time.time()}
+    record.update(attrs)
+    token = _current_span.set(record)
+    otel = otel_trace.get_tracer("agentic-atproto").start_as_current_span(name) if OTEL_ENABLED else None
+    otel_span = otel.__enter__() if otel else None
+    started = time.perf_counter()
+    try:
+        yield record
+        record.setdefault("outcome", "ok")
+    except BaseException as e:
+        record["outcome"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_sec"] = round(time.perf_counter() - started, 4)
+        cost = _cost(record)
+        if cost is not None:
+            record["cost_usd"] = cost
+        _current_span.reset(token)
+        if otel_span is not None:
+            for key, value in record.items():
+                if value is not None and key != "span":
+                    otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+            otel.__exit__(None, None, None)
+        _write(record)
+        with _workflows_lock:
+            for workflow_id in _workflow_ids.get():
+                if workflow_id in _workflows:
+                    _workflows[workflow_id]["spans"].append(record)
+
+def instrument(name=None, kind="tool"):
+    """Decorator: run each call of the function (sync or async) in a span; tool results set the outcome."""
+    def decorate(fn):
+        span_name = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind) as record:
+                    result = await fn(*args, **kwargs)
+                    record["outcome"] = outcome_of(result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind) as record:
+                result = fn(*args, **kwargs)
+                record["outcome"] = outcome_of(result)
+                return result
+        return wrapper
+    return decorate
+
+def instrument_agent(agent):
+    """
+    Time the agent's generate_reply calls, including the ones autogen's GroupChat makes.
+    Calls already inside a span for this agent (e.g. dispatched_generate_reply) are not counted twice.
+    """
+    generate_reply = agent.generate_reply
+    name = f"llm:{agent.name}"
+
+    @functools.wraps(generate_reply)
+    def wrapper(*args, **kwargs):
+        if current_span_name() == name:
+            return generate_reply(*args, **kwargs)
+        with span(name, "llm"):
+            return generate_reply(*args, **kwargs)
+
+    agent.generate_reply = wrapper
+    return agent
+
+# ====================== WORKFLOW SUMMARIES ======================
+
+def current_workflows():
+    """Ids of the workflows the caller runs in, for work done on its behalf in another thread."""
+    return _workflow_ids.get()
+
+@contextmanager
+def in_workflows(workflow_ids):
+    """Count the spans of this block towards `workflow_ids` (from current_workflows())."""
+    token = _workflow_ids.set(tuple(workflow_ids))
+    try:
+        yield
+    finally:
+        _workflow_ids.reset(token)
+
+def carry_context(fn):
+    """
+    `fn` run in a copy of the caller's context (current span and workflows), for thread-pool
+    workers; asyncio.to_thread already does this. Wrap once per submit.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+def summarize(spans):
+    """Per-span-name calls, errors, wall/queue time, tokens, cache hits and cost."""
+    stages = {}
+    for record in spans:
+        stage = stages.setdefault(record["span"], {
+            "calls": 0, "errors": 0, "wall_sec": 0.0, "max_wall_sec": 0.0, "queue_wait_sec": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cache_hits": 0, "cost_usd": 0.0
+        })
+        stage["calls"] += 1
+        stage["errors"] += record.get("outcome") != "ok"
+        stage["wall_sec"] = round(stage["wall_sec"] + record["wall_sec"], 4)
+        stage["max_wall_sec"] = max(stage["max_wall_sec"], record["wall_sec"])
+        stage["cache_hits"] += record.get("cache") == "hit"
+        for key in ("queue_wait_sec", "prompt_tokens", "completion_tokens", "total_tokens", "cost_usd"):
+            stage[key] = round(stage[key] + (record.get(key) or 0), 6)
+    return stages
+
+@contextmanager
+def workflow(name):
+    """
+    Collect the spans the workflow's own code finishes and print a per-stage summary at the
+    end; the summary is also written to the JSONL log. Spans belong to the workflows in their
+    context, which asyncio tasks and to_thread inherit and thread pools get via carry_context(),
+    so concurrent workflows do not count each other's calls.
+    """
+    record = {"workflow": name, "spans": []}
+    workflow_id = next(_workflow_counter)
+    with _workflows_lock:
+        _workflows[workflow_id] = record
+    token = _workflow_ids.set(_workflow_ids.get() + (workflow_id,))
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _workflow_ids.reset(token)
+        with _workflows_lock:
+            del _workflows[workflow_id]
+        stages = summarize(record["spans"])
+        summary = {"workflow": name, "wall_sec": round(time.perf_counter() - started, 3), "stages": stages}
+        _write(summary)
+        print_summary(summary)
+
+def print_summary(summary):
+    print(f"\n--- {summary['workflow']} workflow: {summary['wall_sec']}s ---")
+    for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["wall_sec"]):
+        line = f"  {name}: {stage['calls']} call(s), {stage['wall_sec']}s (max {stage['max_wall_sec']}s)"
+        if stage["queue_wait_sec"]:
+            line += f", queued {stage['queue_wait_sec']}s"
+        tokens = stage["total_tokens"] or stage["prompt_tokens"] + stage["completion_tokens"]
+        if tokens:
+            line += f", tokens {tokens}"
+        if stage["prompt_tokens"] or stage["completion_tokens"]:
+            line += f" ({stage['prompt_tokens']} prompt / {stage['completion_tokens']} completion)"
+        if stage["cache_hits"]:
+            line += f", cache hits {stage['cache_hits']}"
+        if stage["cost_usd"]:
+            line += f", ${stage['cost_usd']:.6f}"
+        if stage["errors"]:
+            line += f", errors {stage['errors']}"
+        print(line)
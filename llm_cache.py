@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from autogen import OpenAIWrapper
+from llm_dispatch import dispatch, estimate_tokens
+from instrumentation import span, annotate, record_usage
+
+# ====================== RESPONSE CACHE ======================
+
+class ResponseCache:
+    """
+    Content-addressed, on-disk cache of LLM completions.
+
+    Keys hash (deployment, system message, prompt, params), so an identical request returns
+    the stored completion without calling the model. The file is bounded to `max_bytes`
+    (least recently used entries are evicted first) and entries older than `ttl` seconds,
+    if set, are treated as misses. Each entry remembers the tokens and latency of the
+    original call so hits can report what they saved.
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, deployment TEXT, response TEXT, size INTEGER, "
+            "tokens INTEGER, latency REAL, created_at REAL, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(deployment, system_message, messages, params=None):
+        """Hash the parts of a request that determine its completion."""
+        prompt_hash = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        material = json.dumps([deployment, system_message, prompt_hash, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, tokens, latency, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl is not None and row[3] + self.ttl < now):
+                self.misses += 1
+                annotate(cache="miss")
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            self.tokens_saved += row[1] or 0
+            self.latency_saved += row[2] or 0.0
+            annotate(cache="hit")
+            return json.loads(row[0])
+
+    def set(self, key, response, deployment=None, tokens=0, latency=0.0):
+        """Store a response together with the tokens and latency it cost."""
+        payload = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, deployment, response, size, tokens, latency, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, deployment, payload, len(payload), tokens, latency, now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "latency_saved_sec": round(self.latency_saved, 2)
+        }
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            doomed.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+# ====================== AGENT WRAPPER ======================
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Return the process-wide response cache (LLM_CACHE_DB, LLM_CACHE_MAX_MB, LLM_CACHE_TTL)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = os.getenv('LLM_CACHE_TTL')
+            _default_cache = ResponseCache(
+                os.getenv('LLM_CACHE_DB', 'llm_cache.db'),
+                max_bytes=int(float(os.getenv('LLM_CACHE_MAX_MB', '50')) * 1024 * 1024),
+                ttl=float(ttl) if ttl else None
+            )
+        return _default_cache
+
+def agent_deployment(agent):
+    """Return the deployment name of an autogen agent's first config entry."""
+    config_list = (agent.llm_config or {}).get("config_list") or [{}]
+    return config_list[0].get("model")
+
+def agent_deployments(agent):
+    """Deployment names of all of an agent's config entries, in order."""
+    return [entry.get("model") for entry in (agent.llm_config or {}).get("config_list") or [{}]]
+
+def agent_cache_key(agent, messages, request_params=None):
+    """
+    Cache key of an agent request: deployment, system message, prompt and llm_config params,
+    plus any extra request parameters (e.g. a response_format) that change the completion.
+    """
+    llm_config = dict(agent.llm_config or {})
+    llm_config.pop("config_list", None)
+    functions = [f.get("name") if isinstance(f, dict) else getattr(f, "__name__", str(f))
+                 for f in llm_config.pop("functions", []) or []]
+    params = {"llm_config": llm_config, "functions": functions}
+    if request_params:
+        params["request"] = request_params
+    # Every deployment the agent may be served by is part of the key, not just the first one.
+    return ResponseCache.make_key(",".join(map(str, agent_deployments(agent))), agent.system_message, messages, params)
+
+def _agent_completion(agent, client, messages):
+    """
+    One completion on an autogen agent's OpenAIWrapper `client`, like generate_reply's LLM step.
+    Returns (reply as generate_reply would give it, the response with its own usage).
+    """
+    response = client.create(messages=[{"role": "system", "content": agent.system_message}] + list(messages))
+    reply = client.extract_text_or_completion_object(response)[0]
+    if hasattr(reply, "model_dump"):
+        reply = reply.model_dump()
+    return reply, response
+
+_entry_clients = {}
+_entry_clients_lock = threading.Lock()
+
+def _entry_client(agent, entry):
+    """An OpenAIWrapper for one of the agent's config entries, so each call is served by a known deployment."""
+    config_list = (agent.llm_config or {}).get("config_list") or []
+    if len(config_list) <= 1:
+        return agent.client
+    key = (agent.name, entry.get("model"))
+    with _entry_clients_lock:
+        if key not in _entry_clients:
+            _entry_clients[key] = OpenAIWrapper(**dict(agent.llm_config, config_list=[entry]))
+        return _entry_clients[key]
+
+def _limited_reply(agent, messages):
+    """
+    Reply from the agent's first config entry that answers, each under its own deployment's
+    dispatcher (as autogen falls back through the config_list, but with every call charged to
+    the deployment that served it). Returns (reply, tokens, deployment).
+    """
+    config_list = (agent.llm_config or {}).get("config_list") or [{}]
+    for position, entry in enumerate(config_list):
+        is_last = position == len(config_list) - 1
+        deployment = entry.get("model")
+        client = _entry_client(agent, entry)
+
+        def call():
+            # Usage comes from this call's response; the client's running totals also count concurrent calls.
+            reply, response = _agent_completion(agent, client, messages)
+            usage = getattr(response, "usage", None)
+            record_usage(usage)
+            return reply, getattr(usage, "total_tokens", 0) or 0
+
+        try:
+            # With an alternate left, fail over instead of waiting out throttles here.
+            reply, tokens = dispatch(deployment, call, estimate_tokens(messages, deployment),
+                                     retries=None if is_last else 0)
+        except Exception:
+            if is_last:
+                raise
+            continue
+        return reply, tokens, deployment
+
+def dispatched_generate_reply(agent, messages):
+    """agent.generate_reply(messages=...) under its deployment's rate limits, retrying throttled calls."""
+    with span(f"llm:{agent.name}", "llm"):
+        return _limited_reply(agent, messages)[0]
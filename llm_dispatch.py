@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from rate_limits import TokenBucket, backoff_delay
+from prompt_budget import count_tokens
+from instrumentation import annotate
+
+# Per-deployment quotas, e.g. LLM_LIMITS='{"gpt-4o-mini": {"rpm": 2500, "tpm": 250000, "concurrency": 32}}';
+# deployments not listed get the defaults below.
+LLM_DEFAULT_RPM = int(os.getenv('LLM_RPM', '300'))
+LLM_DEFAULT_TPM = int(os.getenv('LLM_TPM', '50000'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_LIMITS = json.loads(os.getenv('LLM_LIMITS', '{}'))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', '4'))
+# Completion tokens assumed for a call without max_tokens, until its real usage is known.
+COMPLETION_ESTIMATE = 300
+
+# ====================== THROTTLE DETECTION ======================
+
+def estimate_tokens(messages, deployment=None, max_tokens=None):
+    """Tokens a call will be charged for up front: its prompt plus the completion cap (or an estimate)."""
+    return count_tokens(json.dumps(messages, default=str), deployment) + (max_tokens or COMPLETION_ESTIMATE)
+
+def throttle_delay(error, attempt):
+    """
+    Seconds to pause a deployment after `error` if it is a throttle (HTTP 429), else None.
+    Honors retry-after-ms / retry-after from the response; otherwise backs off with jitter.
+    Works for openai and azure-core exceptions alike.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return backoff_delay(attempt)
+
+# ====================== DEPLOYMENT LIMITER ======================
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class DeploymentLimiter:
+    """
+    Admission control for one deployment: requests-per-minute and tokens-per-minute buckets
+    plus a concurrency window.
+
+    Callers are admitted strictly in arrival order, so a burst of batch calls cannot starve
+    an interactive one that queued earlier. The concurrency window adapts AIMD-style: it grows
+    by one call per window's worth of successes and halves on every throttle, and a throttle
+    with retry-after pauses all admissions for that long.
+    """
+
+    def __init__(self, deployment, rpm=None, tpm=None, max_concurrency=None):
+        limits = LLM_LIMITS.get(deployment or "", {})
+        self.deployment = deployment
+        self.requests = TokenBucket(rpm or limits.get("rpm", LLM_DEFAULT_RPM), 60)
+        self.tokens = TokenBucket(tpm or limits.get("tpm", LLM_DEFAULT_TPM), 60)
+        self.max_concurrency = max_concurrency or limits.get("concurrency", LLM_MAX_CONCURRENCY)
+        self.window = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.counts = {"calls": 0, "throttled": 0, "errors": 0, "tokens": 0}
+        self._queue_waits = []
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+        self._async_waiters = []
+        self._cond = threading.Condition()
+
+    def _admit_wait(self, cost, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(int(self.window), 1):
+            return None
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(min(cost, self.tokens.capacity), now))
+
+    def _advance(self):
+        self._serving += 1
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+
+    def _take_ticket(self):
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        return ticket
+
+    def _try_admit(self, ticket, cost, started):
+        """
+        With the lock held: admit `ticket` if it is its turn and the limits allow, returning
+        (True, seconds waited); otherwise (False, seconds to wait or None for "until notified").
+        """
+        wait = self._admit_wait(cost, time.time()) if ticket == self._serving else None
+        if wait != 0:
+            return False, wait
+        self._advance()
+        self.in_flight += 1
+        self.requests.take(1)
+        self.tokens.take(min(cost, self.tokens.capacity))
+        waited = time.perf_counter() - started
+        self._queue_waits.append(waited)
+        del self._queue_waits[:-1000]
+        self._notify()
+        return True, waited
+
+    def _abandon(self, ticket):
+        if ticket == self._serving:
+            self._advance()
+        else:
+            self._abandoned.add(ticket)
+        self._notify()
+
+    def _notify(self):
+        """Wake every waiter, threads and coroutines alike, to re-check its turn."""
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters.clear()
+
+    def acquire(self, cost):
+        """Block until this call may start; `cost` is its estimated tokens. Returns the seconds waited."""
+        started = time.perf_counter()
+        with self._cond:
+            ticket = self._take_ticket()
+            try:
+                while True:
+                    admitted, wait = self._try_admit(ticket, cost, started)
+                    if admitted:
+                        return wait
+                    # None means "until someone releases a slot or moves the queue"; still re-check now and then.
+                    self._cond.wait(timeout=wait if wait else 1.0)
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def aacquire(self, cost):
+        """acquire() for coroutines: waits on the event loop, without holding a thread."""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            ticket = self._take_ticket()
+        try:
+            while True:
+                future = loop.create_future()
+                with self._cond:
+                    admitted, wait = self._try_admit(ticket, cost, started)
+                    if admitted:
+                        return wait
+                    self._async_waiters.append((loop, future))
+                await asyncio.wait([future], timeout=wait if wait else 1.0)
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket)
+            raise
+
+    def release(self, cost, used, throttled_for=None, failed=False):
+        """End a call: settle its token charge with what it really `used`, and adapt the window."""
+        with self._cond:
+            self.in_flight -= 1
+            self.tokens.take(used - min(cost, self.tokens.capacity))
+            self.counts["tokens"] += used
+            if throttled_for is not None:
+                self.counts["throttled"] += 1
+                self.window = max(self.window / 2, 1.0)
+                self.paused_until = max(self.paused_until, time.time() + throttled_for)
+            elif failed:
+                self.counts["errors"] += 1
+            else:
+                self.counts["calls"] += 1
+                self.window = min(self.window + 1.0 / self.window, float(self.max_concurrency))
+            self._notify()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._queue_waits)
+            return dict(
+                self.counts,
+                in_flight=self.in_flight,
+                concurrency_window=round(self.window, 2),
+                queue_wait_p50_sec=round(waits[len(waits) // 2], 3) if waits else None,
+                queue_wait_max_sec=round(waits[-1], 3) if waits else None
+            )
+
+# ====================== DISPATCH ======================
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(deployment):
+    """Return the shared limiter of a deployment."""
+    with _limiters_lock:
+        if deployment not in _limiters:
+            _limiters[deployment] = DeploymentLimiter(deployment)
+        return _limiters[deployment]
+
+def dispatch(deployment, call, estimated_tokens, retries=None):
+    """
+    Run `call()` -> (result, tokens_used) under the deployment's limits. Throttled calls are
+    retried (LLM_RETRIES by default) once the limiter's pause is over; other errors are raised.
+    Returns (result, tokens_used).
+    """
+    limiter = get_limiter(deployment)
+    retries = LLM_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        annotate(deployment=deployment, queue_wait_sec=limiter.acquire(estimated_tokens))
+        try:
+            result, used = call()
+        except Exception as e:
+            delay = throttle_delay(e, attempt)
+            limiter.release(estimated_tokens, 0 if delay is not None else estimated_tokens,
+                            throttled_for=delay, failed=delay is None)
+            if delay is None or attempt == retries:
+                raise
+            continue
+        except BaseException:
+            limiter.release(estimated_tokens, estimated_tokens, failed=True)
+            raise
+        limiter.release(estimated_tokens, used)
+        annotate(total_tokens=used)
+        return result, used
+
+async def adispatch(deployment, call, estimated_tokens, retries=None):
+    """dispatch() for a coroutine function `call`; admission is awaited on the event loop, not in a thread."""
+    limiter = get_limiter(deployment)
+    retries = LLM_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        annotate(deployment=deployment, queue_wait_sec=await limiter.aacquire(estimated_tokens))
+        try:
+            result, used = await call()
+        except Exception as e:
+            delay = throttle_delay(e, attempt)
+            limiter.release(estimated_tokens, 0 if delay is not None else estimated_tokens,
+                            throttled_for=delay, failed=delay is None)
+            if delay is None or attempt == retries:
+                raise
+            continue
+        except BaseException:
+            limiter.release(estimated_tokens, estimated_tokens, failed=True)
+            raise
+        limiter.release(estimated_tokens, used)
+        annotate(total_tokens=used)
+        return result, used
+
+def dispatch_stats():
+    """Per-deployment calls, throttles, tokens, concurrency window and queue waits."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.deployment: limiter.stats() for limiter in limiters}
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+from types import SimpleNamespace
+from llm_dispatch import get_limiter
+from reply_streaming import StreamInterrupted
+
+# Task classes of the structured response models; a config_list entry with "tags" only serves those classes.
+TASK_CLASSES = {
+    "political_analysis": "classify",
+    "message_analysis": "classify",
+    "subject_analysis": "classify",
+    "reply": "draft",
+    "fused_reply": "draft",
+    "validation": "validate"
+}
+# Latency SLO per task class in seconds, e.g. ROUTER_SLOS='{"classify": 2, "draft": 4}'.
+ROUTER_SLOS = {"classify": 3.0, "draft": 5.0, "validate": 4.0}
+ROUTER_SLOS.update(json.loads(os.getenv('ROUTER_SLOS', '{}')))
+# A call running this many times past its SLO is abandoned for the next deployment (when there is one).
+ROUTER_TIMEOUT_FACTOR = float(os.getenv('ROUTER_TIMEOUT_FACTOR', '3'))
+ROUTER_MAX_ERROR_RATE = float(os.getenv('ROUTER_MAX_ERROR_RATE', '0.5'))
+# Measurements older than this are dropped, so a demoted deployment gets measured again.
+ROUTER_FORGET_SECONDS = float(os.getenv('ROUTER_FORGET_SECONDS', '300'))
+EWMA_ALPHA = 0.2
+
+# ====================== MEASUREMENTS ======================
+
+class RouteStats:
+    """Moving averages for one (deployment, task class): latency, tokens and error rate."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = None
+        self.tokens = None
+        self.error_rate = 0.0
+        self.last_used = 0.0
+
+    def record(self, latency, tokens, ok):
+        self.calls += 1
+        self.last_used = time.time()
+        self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.errors += 1
+            return
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        self.tokens = tokens if self.tokens is None else self.tokens + EWMA_ALPHA * (tokens - self.tokens)
+
+def entry_price(entry):
+    """Mean price per 1K tokens of a config_list entry (autogen's "price": [prompt, completion]), or None."""
+    price = entry.get("price")
+    if isinstance(price, (list, tuple)) and price:
+        return sum(price) / len(price)
+    return price
+
+def routed_agent(agent, entry):
+    """A stand-in for `agent` whose llm_config holds only the chosen config_list entry."""
+    return SimpleNamespace(
+        name=agent.name,
+        system_message=agent.system_message,
+        llm_config=dict(agent.llm_config or {}, config_list=[entry])
+    )
+
+# ====================== ROUTER ======================
+
+class ModelRouter:
+    """
+    Routes each structured call to one of the agent's config_list entries, per task class.
+
+    Entries are ranked by: not throttled (its dispatcher is not paused), within the task's
+    latency SLO and error budget, lowest expected cost (mean tokens x "price"), lowest latency.
+    Entries without measurements rank first so every deployment gets measured. When a call
+    fails (throttled, timed out past ROUTER_TIMEOUT_FACTOR x SLO, or any other error) the next
+    entry is tried, except for a streamed reply that already showed text (StreamInterrupted),
+    which is raised as is. Adding a deployment is just another entry in the config_list.
+
+    Entries are deployments on the same Azure OpenAI resource as the client they are called with.
+    """
+
+    def __init__(self, slos=None):
+        self.slos = dict(ROUTER_SLOS, **(slos or {}))
+        self.failovers = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def entries(self, agent, task):
+        config_list = (agent.llm_config or {}).get("config_list") or []
+        return [entry for entry in config_list if not entry.get("tags") or task in entry["tags"]] or config_list
+
+    def rank(self, agent, task):
+        """The agent's entries for `task`, best first."""
+        now = time.time()
+        slo = self.slos.get(task)
+        ranked = []
+        with self._lock:
+            for index, entry in enumerate(self.entries(agent, task)):
+                stats = self._stats.get((entry.get("model"), task))
+                if stats is not None and now - stats.last_used > ROUTER_FORGET_SECONDS:
+                    stats = self._stats[(entry.get("model"), task)] = RouteStats()
+                # Any call, failed or not, counts as a measurement; an entry that has never
+                # succeeded is unhealthy, so a dead deployment is not retried ahead of working ones.
+                measured = stats is not None and stats.calls > 0
+                succeeded = measured and stats.latency is not None
+                throttled = get_limiter(entry.get("model")).paused_until > now
+                unhealthy = measured and (not succeeded or stats.error_rate > ROUTER_MAX_ERROR_RATE
+                                          or (slo is not None and stats.latency > slo))
+                price = entry_price(entry)
+                cost = stats.tokens * price / 1000 if succeeded and price else 0.0
+                ranked.append(((throttled, unhealthy, measured, cost, stats.latency if succeeded else 0.0, index), entry))
+        return [entry for _, entry in sorted(ranked, key=lambda item: item[0])]
+
+    def record(self, deployment, task, latency, tokens, ok=True):
+        with self._lock:
+            self._stats.setdefault((deployment, task), RouteStats()).record(latency, tokens, ok)
+
+    def _attempt_options(self, task, is_last):
+        # With an alternate left, fail over instead of retrying throttles or waiting out a hung call.
+        if is_last:
+            return {}
+        options = {"retries": 0}
+        if self.slos.get(task):
+            options["timeout"] = self.slos[task] * ROUTER_TIMEOUT_FACTOR
+        return options
+
+    def call(self, agent, task, fn):
+        """
+        Run `fn(routed_agent, **options)` -> (content, tokens) on the best entry for `task`,
+        failing over to the next entry on errors. Returns (content, tokens, deployment).
+        """
+        entries = self.rank(agent, task)
+        for position, entry in enumerate(entries):
+            is_last = position == len(entries) - 1
+            started = time.perf_counter()
+            try:
+                content, tokens = fn(routed_agent(agent, entry), **self._attempt_options(task, is_last))
+            except Exception as e:
+                self.record(entry.get("model"), task, time.perf_counter() - started, 0, ok=False)
+                if is_last or isinstance(e, StreamInterrupted):
+                    raise
+                with self._lock:
+                    self.failovers += 1
+                continue
+            self.record(entry.get("model"), task, time.perf_counter() - started, tokens)
+            return content, tokens, entry.get("model")
+
+    async def acall(self, agent, task, fn):
+        """call() for a coroutine function `fn`."""
+        entries = self.rank(agent, task)
+        for position, entry in enumerate(entries):
+            is_last = position == len(entries) - 1
+            started = time.perf_counter()
+            try:
+                content, tokens = await fn(routed_agent(agent, entry), **self._attempt_options(task, is_last))
+            except Exception as e:
+                self.record(entry.get("model"), task, time.perf_counter() - started, 0, ok=False)
+                if is_last or isinstance(e, StreamInterrupted):
+                    raise
+                with self._lock:
+                    self.failovers += 1
+                continue
+            self.record(entry.get("model"), task, time.perf_counter() - started, tokens)
+            return content, tokens, entry.get("model")
+
+    def stats(self):
+        with self._lock:
+            report = {"failovers": self.failovers}
+            for (deployment, task), stats in self._stats.items():
+                report.setdefault(task, {})[deployment] = {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "error_rate": round(stats.error_rate, 3),
+                    "latency_sec": round(stats.latency, 3) if stats.latency is not None else None,
+                    "tokens": round(stats.tokens, 1) if stats.tokens is not None else None
+                }
+            return report
+
+model_router = ModelRouter()
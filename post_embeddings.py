@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import zlib
+import threading
+import numpy as np
+from llm_dispatch import dispatch, estimate_tokens
+from instrumentation import span
+
+# ====================== EMBEDDERS ======================
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: hashed word and character-trigram features, L2-normalized.
+    Needs no network or model, so it is the offline/test stand-in for a real embedding model.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", (text or "").lower())
+            features = list(words)
+            for word in words:
+                padded = f"#{word}#"
+                features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return normalize_rows(matrix)
+
+class AzureEmbedder:
+    """Embeddings from an Azure OpenAI embedding deployment, requested in batches through the dispatcher."""
+
+    def __init__(self, client, deployment, batch_size=64):
+        self.client = client
+        self.deployment = deployment
+        self.batch_size = batch_size
+        self.name = f"azure:{deployment}"
+        self.dim = None
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [text or " " for text in texts[start:start + self.batch_size]]
+
+            def call():
+                response = self.client.embeddings.create(model=self.deployment, input=batch)
+                usage = getattr(response, "usage", None)
+                return response, getattr(usage, "total_tokens", 0) or 0
+
+            with span(f"embed:{self.deployment}", "llm", texts=len(batch)):
+                response, _ = dispatch(self.deployment, call, estimate_tokens(batch, self.deployment, max_tokens=1))
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        self.dim = matrix.shape[1]
+        return normalize_rows(matrix)
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# ====================== VECTOR INDEX ======================
+
+class VectorIndex:
+    """
+    Post embeddings as one float32 matrix on disk, memory-mapped and grown in place:
+    `<prefix>.vec` holds the rows (preallocated, doubling when full), `<prefix>.uris` is an
+    append-only log with one URI per row, and `<prefix>.json` records the embedder and dimension.
+    Adding posts writes only the new rows and URIs.
+
+    Search is exact cosine top-k over the whole matrix. Once the index grows past
+    `ivf_threshold` rows, an IVF coarse quantizer (k-means lists) is built and only the
+    `nprobe` closest lists are scanned, plus any rows added since the last build.
+    """
+
+    def __init__(self, prefix, embedder_name, ivf_threshold=20000, nprobe=8, initial_capacity=1024):
+        self.prefix = prefix
+        self.embedder_name = embedder_name
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.initial_capacity = initial_capacity
+        self.uris = []
+        self.dim = None
+        self._data = None
+        self._centroids = None
+        self._lists = None
+        self._ivf_rows = 0
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __contains__(self, uri):
+        return uri in self._positions
+
+    @property
+    def matrix(self):
+        """The indexed rows (a view of the memory-mapped file), or None while empty."""
+        if self._data is None:
+            return None
+        return self._data[:len(self.uris)]
+
+    def add(self, uris, vectors):
+        """Append vectors for new URIs (already-indexed URIs are skipped) and persist them."""
+        with self._lock:
+            fresh = [(uri, vector) for uri, vector in zip(uris, vectors) if uri not in self._positions]
+            if not fresh:
+                return 0
+            block = np.asarray([vector for _, vector in fresh], dtype=np.float32)
+            if self.dim is None:
+                self._create(block.shape[1])
+            rows = len(self.uris)
+            self._reserve(rows + len(block))
+            self._data[rows:rows + len(block)] = block
+            self._data.flush()
+            # Rows are written before their URIs, so a crash in between leaves only unused rows.
+            with open(f"{self.prefix}.uris", "a") as f:
+                f.write("".join(uri + "\n" for uri, _ in fresh))
+            for uri, _ in fresh:
+                self._positions[uri] = len(self.uris)
+                self.uris.append(uri)
+            if len(self.uris) >= self.ivf_threshold and len(self.uris) >= 2 * max(self._ivf_rows, 1):
+                self._build_ivf()
+            return len(fresh)
+
+    def search(self, query_vector, k=10):
+        """Return [(uri, score)] for the k most similar posts, best first."""
+        with self._lock:
+            if self.matrix is None or not self.uris:
+                return []
+            query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+            candidates = self._candidates(query)
+            scores = self.matrix[candidates] @ query
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.uris[candidates[i]], float(scores[i])) for i in top]
+
+    # ----- internals -----
+
+    def _candidates(self, query):
+        if self._centroids is None:
+            return np.arange(len(self.uris))
+        nearest = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        probed = [self._lists[i] for i in nearest]
+        probed.append(np.arange(self._ivf_rows, len(self.uris)))
+        return np.concatenate(probed)
+
+    def _build_ivf(self, iterations=10):
+        data = np.asarray(self.matrix)
+        nlist = max(int(np.sqrt(len(data))), 1)
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(data), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+        assignment = np.argmax(data @ centroids.T, axis=1)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assignment == c) for c in range(nlist)]
+        self._ivf_rows = len(data)
+
+    def _load(self):
+        meta_path = f"{self.prefix}.json"
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("embedder") != self.embedder_name:
+            print(f"Vector index was built with {meta.get('embedder')}; starting a new one for {self.embedder_name}.")
+            return
+        if "uris" in meta:
+            self._migrate(meta)
+            return
+        self.dim = meta["dim"]
+        if os.path.exists(f"{self.prefix}.uris"):
+            with open(f"{self.prefix}.uris", "r") as f:
+                self.uris = f.read().splitlines()
+        self._map()
+        self.uris = self.uris[:len(self._data) if self._data is not None else 0]
+        self._positions = {uri: i for i, uri in enumerate(self.uris)}
+        if len(self.uris) >= self.ivf_threshold:
+            self._build_ivf()
+
+    def _migrate(self, meta):
+        """Move an index saved as one .npy matrix plus a URI list in the .json to the append-only files."""
+        matrix = np.load(f"{self.prefix}.npy") if os.path.exists(f"{self.prefix}.npy") else None
+        if matrix is None or not len(matrix):
+            return
+        uris = meta["uris"][:len(matrix)]
+        self._create(matrix.shape[1])
+        self.add(uris, matrix[:len(uris)])
+        os.remove(f"{self.prefix}.npy")
+
+    def _create(self, dim):
+        self.dim = dim
+        for suffix in (".vec", ".uris"):
+            open(f"{self.prefix}{suffix}", "w").close()
+        with open(f"{self.prefix}.json.tmp", "w") as f:
+            json.dump({"embedder": self.embedder_name, "dim": dim}, f)
+        os.replace(f"{self.prefix}.json.tmp", f"{self.prefix}.json")
+        self._data = None
+
+    def _map(self):
+        rows = os.path.getsize(f"{self.prefix}.vec") // (self.dim * 4)
+        self._data = np.memmap(f"{self.prefix}.vec", dtype=np.float32, mode="r+", shape=(rows, self.dim)) if rows else None
+
+    def _reserve(self, rows):
+        """Grow the preallocated file (doubling) so it holds at least `rows` rows."""
+        capacity = len(self._data) if self._data is not None else 0
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity, self.initial_capacity)
+        self._data = None
+        with open(f"{self.prefix}.vec", "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._map()
+
+# ====================== SHARED INSTANCES ======================
+
+_embedder = None
+_index = None
+_shared_lock = threading.Lock()
+
+def get_embedder(client=None):
+    """
+    Return the embedder: the Azure deployment named by EMBEDDING_DEPLOYMENT_NAME when a client
+    is given, otherwise (or with EMBEDDER=hashing) the local hashing stand-in.
+    """
+    global _embedder
+    with _shared_lock:
+        if _embedder is None:
+            deployment = os.getenv('EMBEDDING_DEPLOYMENT_NAME')
+            if client is not None and deployment and os.getenv('EMBEDDER', 'azure') != 'hashing':
+                _embedder = AzureEmbedder(client, deployment)
+            else:
+                _embedder = HashingEmbedder(dim=int(os.getenv('HASHING_EMBEDDING_DIM', '256')))
+        return _embedder
+
+def get_vector_index(client=None):
+    """Return the process-wide vector index (POST_VECTORS_PREFIX, default 'bsky_vectors')."""
+    global _index
+    embedder = get_embedder(client)
+    with _shared_lock:
+        if _index is None:
+            _index = VectorIndex(os.getenv('POST_VECTORS_PREFIX', 'bsky_vectors'), embedder.name)
+        return _index
+
+def index_posts(posts, client=None):
+    """Embed and index the posts that are not in the vector index yet. Returns how many were added."""
+    index = get_vector_index(client)
+    new_posts = [post for post in posts if post.get("did") and post["did"] not in index]
+    if not new_posts:
+        return 0
+    vectors = get_embedder(client).embed([post.get("text", "") for post in new_posts])
+    return index.add([post["did"] for post in new_posts], vectors)
+
+def semantic_search(subject, k=10, client=None):
+    """Return [(uri, score)] of the indexed posts closest in meaning to `subject`."""
+    query = get_embedder(client).embed([subject])[0]
+    return get_vector_index(client).search(query, k=k)
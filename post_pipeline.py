@@ -0,0 +1,82 @@
+import json
+import time
+from instrumentation import span, outcome_of
+
+# ====================== STEP GRAPH ======================
+
+class Step:
+    """
+    One step of a pipeline: `run(context)` returns the step's structured output, which is
+    stored as context[name] for the steps after it. `when(context)`, if given, decides
+    whether the step runs at all.
+    """
+
+    def __init__(self, name, run, when=None):
+        self.name = name
+        self.run = run
+        self.when = when
+
+class StepPipeline:
+    """
+    Runs steps in a fixed order, calling agents directly instead of letting a GroupChatManager
+    pick the next speaker with an extra completion every round.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+    def run(self, context):
+        """
+        Run every step against `context` (a dict of inputs) and return it with each step's output
+        added, plus a "trace" of [{step, status, seconds}]. Stops at the first failing step;
+        its error is recorded in the trace and as context["error"].
+        """
+        context = dict(context)
+        trace = context.setdefault("trace", [])
+        for step in self.steps:
+            if step.when is not None and not step.when(context):
+                trace.append({"step": step.name, "status": "skipped", "seconds": 0.0})
+                continue
+            started = time.perf_counter()
+            try:
+                with span(f"step:{step.name}", "step") as record:
+                    context[step.name] = step.run(context)
+                    record["outcome"] = outcome_of(context[step.name])
+            except Exception as e:
+                trace.append({"step": step.name, "status": "error", "seconds": round(time.perf_counter() - started, 3)})
+                context["error"] = f"{step.name}: {e}"
+                break
+            trace.append({"step": step.name, "status": "ok", "seconds": round(time.perf_counter() - started, 3)})
+        return context
+
+# ====================== AGENT OUTPUT ======================
+
+def reply_text(reply):
+    """Return the text of a generate_reply result (string, dict or message object)."""
+    if isinstance(reply, str):
+        return reply
+    if isinstance(reply, dict):
+        return reply.get("content", "") or ""
+    return getattr(reply, "content", "") or ""
+
+def reply_function_arguments(reply):
+    """Return the parsed arguments of a function/tool call in a generate_reply result, or None."""
+    if not isinstance(reply, dict):
+        return None
+    call = reply.get("function_call")
+    if not call and reply.get("tool_calls"):
+        call = reply["tool_calls"][0].get("function")
+    if not call:
+        return None
+    try:
+        return json.loads(call.get("arguments") or "{}")
+    except json.JSONDecodeError:
+        return None
+
+def parse_json_reply(reply):
+    """Parse a JSON agent reply (code fences allowed). Raises ValueError if it is not a JSON object."""
+    content = reply_text(reply).replace("```json", "").replace("```", "").strip()
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"expected a JSON object, got: {content[:200]!r}")
+    return json.loads(content[start:end + 1])
@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from bsky_cache import TTLCache
+from bsky_session import get_bluesky_client
+from instrumentation import instrument
+
+# getPosts accepts at most 25 URIs per call.
+GET_POSTS_BATCH_SIZE = 25
+# Seconds a lookup waits for concurrent lookups to join its getPosts call.
+GET_POSTS_WINDOW = float(os.getenv('POST_REF_BATCH_WINDOW', '0.02'))
+
+# ====================== STRONG REF HELPERS ======================
+
+def strong_ref(uri, cid):
+    """Build a com.atproto.repo.strongRef dict."""
+    return {"uri": uri, "cid": cid}
+
+def ref_from_post_view(post):
+    """
+    Extract the uri/cid of a post view plus the root/parent refs it replies to.
+    Works for both timeline `post` objects and getPosts results.
+    """
+    ref = {"uri": post.uri, "cid": post.cid, "root": None, "parent": None}
+    reply = getattr(post.record, "reply", None)
+    if reply is not None:
+        ref["root"] = strong_ref(reply.root.uri, reply.root.cid)
+        ref["parent"] = strong_ref(reply.parent.uri, reply.parent.cid)
+    return ref
+
+def reply_refs_for(ref):
+    """Return the 'root'/'parent' pair for a reply to the post described by `ref`."""
+    parent = strong_ref(ref["uri"], ref["cid"])
+    return {"root": ref.get("root") or parent, "parent": parent}
+
+# ====================== COALESCING RESOLVER ======================
+
+class PostRefResolver:
+    """
+    Resolve post URIs to their CID and reply refs with as few getPosts calls as possible.
+
+    Refs already seen (e.g. from the timeline) are answered from memory. Missing URIs from
+    all threads go into one queue: the first lookup to find the queue idle collects it for
+    `batch_window` seconds (or until 25 URIs are waiting) and sends it in getPosts batches of
+    up to 25, while the other lookups wait for their URIs. A URI that is already queued or
+    being fetched is waited on instead of being requested twice.
+    """
+
+    def __init__(self, client_factory=get_bluesky_client, maxsize=10000, wait_timeout=30, batch_window=None):
+        self.client_factory = client_factory
+        self.wait_timeout = wait_timeout
+        self.batch_window = GET_POSTS_WINDOW if batch_window is None else batch_window
+        self.lookups = 0
+        self._refs = TTLCache(maxsize=maxsize, ttl=7 * 24 * 3600, namespace="post_refs")
+        self._pending = {}
+        self._queue = []
+        self._collecting = False
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+
+    def remember(self, ref):
+        """Record a ref ({'uri', 'cid', 'root', 'parent'}) so later lookups need no reads."""
+        if ref.get("uri") and ref.get("cid"):
+            self._refs.set(ref["uri"], {
+                "uri": ref["uri"],
+                "cid": ref["cid"],
+                "root": ref.get("root"),
+                "parent": ref.get("parent")
+            })
+
+    def resolve(self, uri):
+        """Return the ref for one URI, or None if the post does not exist."""
+        return self.resolve_many([uri]).get(uri)
+
+    def resolve_many(self, uris):
+        """Return {uri: ref or None} for the given URIs."""
+        to_wait = []
+        with self._lock:
+            for uri in dict.fromkeys(uris):
+                if self._refs.get(uri) is not None:
+                    continue
+                if uri not in self._pending:
+                    self._pending[uri] = threading.Event()
+                    self._queue.append(uri)
+                to_wait.append(self._pending[uri])
+            if len(self._queue) >= GET_POSTS_BATCH_SIZE:
+                self._queued.notify_all()
+            lead = bool(self._queue) and not self._collecting
+            if lead:
+                self._collecting = True
+        if lead:
+            self._send_queue()
+        for event in to_wait:
+            event.wait(self.wait_timeout)
+        return {uri: self._refs.get(uri) for uri in uris}
+
+    def _send_queue(self):
+        """Collect queued URIs for the batch window, then send them in getPosts batches until none are left."""
+        deadline = time.monotonic() + self.batch_window
+        try:
+            error = self._send_batches(deadline)
+        except BaseException:
+            # Interrupted: release everyone still waiting on the queue and hand leadership back.
+            with self._lock:
+                for uri in self._queue:
+                    self._pending.pop(uri).set()
+                self._queue.clear()
+                self._collecting = False
+            raise
+        if error is not None:
+            raise error
+
+    def _send_batches(self, deadline):
+        """Send the queue in batches; returns the first getPosts error, if any."""
+        error = None
+        while True:
+            with self._lock:
+                while len(self._queue) < GET_POSTS_BATCH_SIZE and deadline > time.monotonic():
+                    self._queued.wait(deadline - time.monotonic())
+                batch = self._queue[:GET_POSTS_BATCH_SIZE]
+                del self._queue[:GET_POSTS_BATCH_SIZE]
+                if not batch:
+                    self._collecting = False
+                    break
+            try:
+                self._fetch_batch(batch)
+            except Exception as e:
+                # URIs of a failed batch resolve to None; the rest of the queue is still sent.
+                error = error or e
+            finally:
+                with self._lock:
+                    for uri in batch:
+                        self._pending.pop(uri).set()
+        return error
+
+    def stats(self):
+        stats = self._refs.stats()
+        stats["get_posts_calls"] = self.lookups
+        return stats
+
+    @instrument("bluesky:getPosts")
+    def _fetch_batch(self, uris):
+        client = self.client_factory()
+        response = client.app.bsky.feed.get_posts({"uris": uris})
+        with self._lock:
+            self.lookups += 1
+        for post in response.posts:
+            self.remember(ref_from_post_view(post))
+
+# ====================== SHARED INSTANCE ======================
+
+_default_resolver = None
+_default_resolver_lock = threading.Lock()
+
+def get_post_resolver():
+    """Return the process-wide post ref resolver."""
+    global _default_resolver
+    with _default_resolver_lock:
+        if _default_resolver is None:
+            _default_resolver = PostRefResolver(maxsize=int(os.getenv('POST_REF_CACHE_SIZE', '10000')))
+        return _default_resolver
@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# ====================== SCHEMA ======================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    uri TEXT PRIMARY KEY,
+    cid TEXT,
+    author TEXT,
+    text TEXT,
+    timestamp TEXT,
+    root TEXT,
+    parent TEXT,
+    ingested_at REAL
+);
+CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
+CREATE TABLE IF NOT EXISTS labels (
+    task TEXT,
+    text_hash TEXT,
+    text TEXT,
+    label TEXT,
+    source TEXT,
+    labeled_at REAL,
+    PRIMARY KEY (task, text_hash)
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    text, author, content='posts', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, text, author) VALUES (new.rowid, new.text, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, text, author) VALUES ('delete', old.rowid, old.text, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_au AFTER UPDATE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, text, author) VALUES ('delete', old.rowid, old.text, old.author);
+    INSERT INTO posts_fts (rowid, text, author) VALUES (new.rowid, new.text, new.author);
+END;
+"""
+
+def fts_query(subject):
+    """Turn free text into an FTS5 query matching all of its words (as prefixes)."""
+    terms = re.findall(r"\w+", subject.lower())
+    return " ".join(f'"{term}"*' for term in terms)
+
+# ====================== POST STORE ======================
+
+class PostStore:
+    """
+    Local SQLite store of every post we have ingested, with a full-text index on text and author.
+
+    Search uses FTS5 with bm25 ranking when the SQLite build supports it and falls back
+    to a LIKE scan otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self._db.commit()
+
+    def add_posts(self, posts):
+        """Insert or update message dicts as produced by the timeline/stream fetchers."""
+        rows = [(
+            post["did"],
+            post.get("cid"),
+            post.get("author"),
+            post.get("text", ""),
+            post.get("timestamp"),
+            json.dumps(post.get("root")) if post.get("root") else None,
+            json.dumps(post.get("parent")) if post.get("parent") else None,
+            time.time()
+        ) for post in posts if post.get("did")]
+        if not rows:
+            return 0
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO posts (uri, cid, author, text, timestamp, root, parent, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(uri) DO UPDATE SET cid = excluded.cid, author = excluded.author, "
+                "text = excluded.text, timestamp = excluded.timestamp",
+                rows
+            )
+            self._db.commit()
+        return len(rows)
+
+    def search(self, subject, limit=20, since=None):
+        """
+        Return the best matches for `subject` as numbered message dicts, best first.
+        `since` restricts results to posts with a timestamp at or after that ISO string.
+        """
+        query = fts_query(subject)
+        if not query:
+            return []
+        since_clause = "AND p.timestamp >= ?" if since else ""
+        params = [query] + ([since] if since else []) + [limit]
+        with self._lock:
+            if self.has_fts:
+                rows = self._db.execute(
+                    "SELECT p.*, bm25(posts_fts, 2.0, 1.0) AS rank FROM posts_fts "
+                    "JOIN posts p ON p.rowid = posts_fts.rowid "
+                    f"WHERE posts_fts MATCH ? {since_clause} "
+                    "ORDER BY rank, p.timestamp DESC LIMIT ?",
+                    params
+                ).fetchall()
+            else:
+                params[0] = f"%{subject.lower()}%"
+                rows = self._db.execute(
+                    "SELECT p.*, 0 AS rank FROM posts p "
+                    f"WHERE lower(p.text) LIKE ? {since_clause} "
+                    "ORDER BY p.timestamp DESC LIMIT ?",
+                    params
+                ).fetchall()
+        return [self._row_to_message(row, number) for number, row in enumerate(rows, start=1)]
+
+    def get_posts(self, uris):
+        """Return stored message dicts for the given URIs, in the same order (missing ones skipped)."""
+        if not uris:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM posts WHERE uri IN ({','.join('?' * len(uris))})", list(uris)
+            ).fetchall()
+        by_uri = {row["uri"]: row for row in rows}
+        return [self._row_to_message(by_uri[uri], number)
+                for number, uri in enumerate((u for u in uris if u in by_uri), start=1)]
+
+    def add_labels(self, task, labeled, source="llm"):
+        """Store (text, label) pairs for a classification task; a text keeps its latest label."""
+        rows = [(task, hashlib.sha1(text.encode("utf-8")).hexdigest(), text, label, source, time.time())
+                for text, label in labeled if text and label]
+        if not rows:
+            return 0
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO labels (task, text_hash, text, label, source, labeled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+        return len(rows)
+
+    def labels(self, task, source="llm", limit=20000):
+        """Return the most recent (text, label) pairs of a task, newest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT text, label FROM labels WHERE task = ? AND source = ? ORDER BY labeled_at DESC LIMIT ?",
+                (task, source, limit)
+            ).fetchall()
+        return [(row["text"], row["label"]) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def _row_to_message(self, row, number):
+        return {
+            "number": number,
+            "did": row["uri"],
+            "cid": row["cid"],
+            "root": json.loads(row["root"]) if row["root"] else None,
+            "parent": json.loads(row["parent"]) if row["parent"] else None,
+            "author": row["author"],
+            "text": row["text"],
+            "timestamp": row["timestamp"],
+            "rank": row["rank"] if "rank" in row.keys() else None
+        }
+
+# ====================== SHARED INSTANCE ======================
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_post_store():
+    """Return the process-wide post store (POST_STORE_DB, default 'bsky_posts.db')."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PostStore(os.getenv('POST_STORE_DB', 'bsky_posts.db'))
+        return _default_store
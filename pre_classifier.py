@@ -0,0 +1,174 @@
+import os
+import re
+import random
+import threading
+import numpy as np
+from post_store import get_post_store
+from post_embeddings import HashingEmbedder
+
+# Local predictions at or above this confidence skip the LLM.
+PRECLASSIFY_THRESHOLD = float(os.getenv('PRECLASSIFY_THRESHOLD', '0.85'))
+# The linear model is only used once this many LLM labels exist for its task.
+PRECLASSIFY_MIN_LABELS = int(os.getenv('PRECLASSIFY_MIN_LABELS', '100'))
+# Share of confident local predictions still sent to the LLM to measure agreement.
+PRECLASSIFY_AUDIT_RATE = float(os.getenv('PRECLASSIFY_AUDIT_RATE', '0.05'))
+PRECLASSIFY_RETRAIN_EVERY = 50
+FEATURE_DIM = 2048
+# Most recent labels used for training (features are dense, FEATURE_DIM floats per label).
+PRECLASSIFY_MAX_TRAIN = int(os.getenv('PRECLASSIFY_MAX_TRAIN', '5000'))
+
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+MENTION_PATTERN = re.compile(r"[@#]\S+")
+
+def substantive_words(text):
+    """Words of a post once links, mentions and hashtags are removed."""
+    stripped = MENTION_PATTERN.sub(" ", URL_PATTERN.sub(" ", text or ""))
+    return re.findall(r"[^\W\d_]{2,}", stripped)
+
+def is_trivial(text, max_words=2):
+    """Posts that are only links, mentions, emoji or a word or two carry no stance to classify."""
+    return len(substantive_words(text)) <= max_words
+
+# ====================== LINEAR MODEL ======================
+
+class LinearClassifier:
+    """Multinomial logistic regression over hashed word and character-trigram features."""
+
+    def __init__(self, dim=FEATURE_DIM, epochs=150, learning_rate=1.0, l2=1e-4):
+        self.featurizer = HashingEmbedder(dim=dim)
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.classes = []
+        self.weights = None
+        self.bias = None
+
+    def fit(self, texts, labels):
+        self.classes = sorted(set(labels))
+        index = {label: i for i, label in enumerate(self.classes)}
+        features = self.featurizer.embed(texts)
+        targets = np.zeros((len(texts), len(self.classes)), dtype=np.float32)
+        targets[np.arange(len(texts)), [index[label] for label in labels]] = 1.0
+        self.weights = np.zeros((features.shape[1], len(self.classes)), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        for _ in range(self.epochs):
+            gradient = (self._softmax(features @ self.weights + self.bias) - targets) / len(texts)
+            self.weights -= self.learning_rate * (features.T @ gradient + self.l2 * self.weights)
+            self.bias -= self.learning_rate * gradient.sum(axis=0)
+        return self
+
+    def predict(self, texts):
+        """Return [(label, probability)] for each text."""
+        probabilities = self._softmax(self.featurizer.embed(texts) @ self.weights + self.bias)
+        best = probabilities.argmax(axis=1)
+        return [(self.classes[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    @staticmethod
+    def _softmax(scores):
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(scores)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+# ====================== PRE-CLASSIFIER ======================
+
+class PreClassifier:
+    """
+    Local first pass in front of an LLM classification task.
+
+    Trivial posts (see is_trivial) get `trivial_label`. Other posts go through a linear model
+    trained on the LLM's earlier labels for the task (kept in the post store), and predictions
+    at or above `threshold` confidence are used directly; the rest return None and go to the
+    LLM. A sample (`audit_rate`) of confident predictions still goes to the LLM, and the
+    agreement between the two is reported together with the model's hold-out precision and
+    coverage at the threshold.
+    """
+
+    def __init__(self, task, trivial_label, store=None, threshold=None, min_labels=None, audit_rate=None):
+        self.task = task
+        self.trivial_label = trivial_label
+        self.store = store
+        self.threshold = PRECLASSIFY_THRESHOLD if threshold is None else threshold
+        self.min_labels = PRECLASSIFY_MIN_LABELS if min_labels is None else min_labels
+        self.audit_rate = PRECLASSIFY_AUDIT_RATE if audit_rate is None else audit_rate
+        self.model = None
+        self.trained_on = 0
+        self.holdout = {}
+        self.counts = {"rule": 0, "model": 0, "llm": 0, "audited": 0, "agreed": 0}
+        self._new_labels = 0
+        self._checked = False
+        self._lock = threading.Lock()
+
+    def _store(self):
+        return self.store or get_post_store()
+
+    def _maybe_train(self):
+        if self._checked and self._new_labels < PRECLASSIFY_RETRAIN_EVERY:
+            return
+        self._checked, self._new_labels = True, 0
+        labeled = self._store().labels(self.task, limit=PRECLASSIFY_MAX_TRAIN)
+        if len(labeled) < self.min_labels or len({label for _, label in labeled}) < 2:
+            return
+        random.Random(0).shuffle(labeled)
+        split = max(len(labeled) // 5, 1)
+        holdout, train = labeled[:split], labeled[split:]
+        model = LinearClassifier().fit([text for text, _ in train], [label for _, label in train])
+        predicted = model.predict([text for text, _ in holdout])
+        confident = [(p, label) for p, (_, label) in zip(predicted, holdout) if p[1] >= self.threshold]
+        self.holdout = {
+            "size": len(holdout),
+            "coverage": round(len(confident) / len(holdout), 3),
+            "precision": round(sum(p[0] == label for p, label in confident) / len(confident), 3) if confident else None
+        }
+        self.model = model.fit([text for text, _ in labeled], [label for _, label in labeled])
+        self.trained_on = len(labeled)
+
+    def classify(self, text):
+        """
+        Return {"label", "confidence", "source", "audit"} for a confident local answer, or None
+        when the LLM should decide. With "audit" set the caller asks the LLM anyway and passes
+        this prediction to record().
+        """
+        with self._lock:
+            if is_trivial(text):
+                prediction = {"label": self.trivial_label, "confidence": 1.0, "source": "rule"}
+            else:
+                self._maybe_train()
+                if self.model is None:
+                    self.counts["llm"] += 1
+                    return None
+                label, confidence = self.model.predict([text])[0]
+                if confidence < self.threshold:
+                    self.counts["llm"] += 1
+                    return None
+                prediction = {"label": label, "confidence": round(confidence, 3), "source": "model"}
+            prediction["audit"] = random.random() < self.audit_rate
+            self.counts["llm" if prediction["audit"] else prediction["source"]] += 1
+            return prediction
+
+    def record(self, text, label, prediction=None):
+        """Keep an LLM label for training; with the audited local `prediction`, count agreement."""
+        self._store().add_labels(self.task, [(text, label)])
+        with self._lock:
+            self._new_labels += 1
+            if prediction is not None:
+                self.counts["audited"] += 1
+                self.counts["agreed"] += int(prediction["label"].lower() == (label or "").lower())
+
+    def record_many(self, labeled):
+        """Keep many (text, label) LLM labels at once."""
+        stored = self._store().add_labels(self.task, labeled)
+        with self._lock:
+            self._new_labels += stored
+
+    def stats(self):
+        with self._lock:
+            decided = self.counts["rule"] + self.counts["model"]
+            total = decided + self.counts["llm"]
+            return dict(
+                self.counts,
+                local_rate=round(decided / total, 3) if total else 0.0,
+                agreement=round(self.counts["agreed"] / self.counts["audited"], 3) if self.counts["audited"] else None,
+                threshold=self.threshold,
+                trained_on=self.trained_on,
+                holdout=self.holdout
+            )
@@ -0,0 +1,115 @@
+import os
+import json
+import threading
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Token budget for one multi-post prompt (instruction plus packed posts).
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+
+# ====================== TOKEN COUNTING ======================
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def _encoding_for(deployment):
+    """tiktoken encoding for a deployment name (Azure names often differ from model names)."""
+    with _encodings_lock:
+        if deployment not in _encodings:
+            try:
+                _encodings[deployment] = tiktoken.encoding_for_model(deployment or "")
+            except KeyError:
+                name = "o200k_base" if any(tag in (deployment or "") for tag in ("4o", "o1", "o3", "o4")) else "cl100k_base"
+                _encodings[deployment] = tiktoken.get_encoding(name)
+        return _encodings[deployment]
+
+def count_tokens(text, deployment=None):
+    """Tokens in `text` for a deployment: exact with tiktoken installed, otherwise about 4 characters per token."""
+    if TIKTOKEN_AVAILABLE:
+        return len(_encoding_for(deployment).encode(text))
+    return (len(text) + 3) // 4
+
+# ====================== PROMPT BUILDER ======================
+
+def compact_post(post, fields=("number", "text")):
+    """Keep only the fields a task needs; posts are referred to by their short number, never their URI."""
+    return {field: post[field] for field in fields if field in post}
+
+class PromptBuilder:
+    """
+    Builds JSON prompts over many posts within a per-deployment token budget.
+
+    `pack()` fills one prompt with as many posts as fit; `chunks()` splits all posts into
+    prompts that each fit. Every built prompt is recorded in `prompt_stats`.
+    """
+
+    def __init__(self, deployment, budget=None, fields=("number", "text")):
+        self.deployment = deployment
+        self.budget = budget or PROMPT_TOKEN_BUDGET
+        self.fields = fields
+
+    def _payload(self, task, instruction, posts, extra):
+        payload = {"task": task}
+        payload.update(extra or {})
+        payload["messages"] = posts
+        payload["instruction"] = instruction
+        return payload
+
+    def pack(self, task, instruction, posts, extra=None, max_posts=None):
+        """
+        Return (prompt, packed_posts, left_over_posts): the prompt holds posts in order until the
+        next one would pass the budget (at least one post is always included).
+        """
+        base_tokens = count_tokens(json.dumps(self._payload(task, instruction, [], extra)), self.deployment)
+        packed, used = [], base_tokens
+        for post in posts:
+            compact = compact_post(post, self.fields)
+            cost = count_tokens(json.dumps(compact), self.deployment) + 1
+            if packed and (used + cost > self.budget or (max_posts and len(packed) >= max_posts)):
+                break
+            packed.append(compact)
+            used += cost
+        prompt = json.dumps(self._payload(task, instruction, packed, extra))
+        prompt_stats.record(task, self.deployment, count_tokens(prompt, self.deployment), len(packed))
+        return prompt, posts[:len(packed)], posts[len(packed):]
+
+    def chunks(self, task, instruction, posts, extra=None, max_posts=None):
+        """Split posts into [(prompt, chunk_posts)], each prompt within the budget."""
+        result = []
+        while posts:
+            prompt, packed, posts = self.pack(task, instruction, posts, extra, max_posts)
+            result.append((prompt, packed))
+        return result
+
+# ====================== REPORT ======================
+
+class PromptStats:
+    """Per-task prompt sizes: prompts built, posts packed, total/mean/max tokens."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def record(self, task, deployment, tokens, posts):
+        with self._lock:
+            entry = self._tasks.setdefault(task, {"deployment": deployment, "prompts": 0, "posts": 0,
+                                                  "tokens": 0, "max_tokens": 0})
+            entry["prompts"] += 1
+            entry["posts"] += posts
+            entry["tokens"] += tokens
+            entry["max_tokens"] = max(entry["max_tokens"], tokens)
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for task, entry in self._tasks.items():
+                report[task] = dict(entry, mean_tokens=round(entry["tokens"] / entry["prompts"], 1),
+                                    tokens_per_post=round(entry["tokens"] / max(entry["posts"], 1), 1))
+            report["token_counter"] = "tiktoken" if TIKTOKEN_AVAILABLE else "estimate"
+            return report
+
+prompt_stats = PromptStats()
@@ -0,0 +1,54 @@
+import time
+import random
+
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 300.0
+
+# ====================== TOKEN BUCKET ======================
+
+class TokenBucket:
+    """
+    Token bucket refilled at `capacity` per `window` seconds. `sync()` takes the server's view
+    (limit, remaining, reset) from ratelimit-* headers, which always wins over our estimate.
+    """
+
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.window = window
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if self.blocked_until and now >= self.blocked_until:
+            # The server's window has reset.
+            self.tokens, self.blocked_until = float(self.capacity), 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.window)
+        self.updated = now
+
+    def wait_time(self, cost=1, now=None):
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        now = now or time.time()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) * self.window / self.capacity
+
+    def take(self, cost=1):
+        self._refill(time.time())
+        self.tokens -= cost
+
+    def sync(self, limit, remaining, reset_at=None):
+        now = time.time()
+        self.capacity = limit
+        self.tokens = float(remaining)
+        self.updated = now
+        self.blocked_until = reset_at if remaining <= 0 and reset_at else 0.0
+
+# ====================== BACKOFF ======================
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_CAP_SECONDS):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import time
+import threading
+from llm_cache import agent_deployment
+from llm_dispatch import dispatch, adispatch, estimate_tokens
+from instrumentation import annotate, record_usage
+
+# Reply drafts only need a few dozen tokens; this caps a streamed reply that never closes its field.
+STREAM_MAX_TOKENS = int(os.getenv('STREAM_MAX_TOKENS', '300'))
+
+# ====================== INCREMENTAL FIELD DECODER ======================
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class StreamedFieldDecoder:
+    """
+    Decodes the value of one string field (e.g. "formatted_message") from JSON text that
+    arrives in pieces, so the reply can be shown and measured before the object is complete.
+    """
+
+    def __init__(self, field):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = None
+        self.value = ""
+        self.complete = False
+
+    def feed(self, text):
+        """Add streamed text; returns the newly decoded part of the field value."""
+        self._buffer += text
+        if self._pos is None:
+            match = self._key.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+        decoded = []
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and not self.complete:
+            char = buffer[pos]
+            if char == '"':
+                self.complete = True
+                pos += 1
+            elif char == '\\':
+                if pos + 1 >= len(buffer):
+                    break
+                code = buffer[pos + 1]
+                if code == 'u':
+                    if pos + 6 > len(buffer):
+                        break
+                    decoded.append(chr(int(buffer[pos + 2:pos + 6], 16)))
+                    pos += 6
+                else:
+                    decoded.append(_ESCAPES.get(code, code))
+                    pos += 2
+            else:
+                decoded.append(char)
+                pos += 1
+        self._pos = pos
+        new_text = "".join(decoded)
+        self.value += new_text
+        return new_text
+
+def cut_to_budget(text, budget):
+    """Cut text to at most `budget` characters, at a word boundary when there is one."""
+    if len(text) <= budget:
+        return text
+    cut = text[:budget]
+    return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+# ====================== STATS ======================
+
+class StreamStats:
+    """Time to first token, streamed tokens and early cutoffs across streamed replies."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cutoffs = 0
+        self.tokens = 0
+        self.tokens_saved = 0
+        self._ttfts = []
+        self._lock = threading.Lock()
+
+    def record(self, ttft, tokens, cut_off, max_tokens):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            if ttft is not None:
+                self._ttfts.append(ttft)
+            if cut_off:
+                self.cutoffs += 1
+                self.tokens_saved += max(max_tokens - tokens, 0)
+
+    def stats(self):
+        with self._lock:
+            ttfts = sorted(self._ttfts)
+            return {
+                "calls": self.calls,
+                "cutoffs": self.cutoffs,
+                "streamed_tokens": self.tokens,
+                # Tokens of the completion cap that cut-off replies did not spend.
+                "tokens_saved": self.tokens_saved,
+                "ttft_p50_sec": round(ttfts[len(ttfts) // 2], 3) if ttfts else None,
+                "ttft_max_sec": round(ttfts[-1], 3) if ttfts else None
+            }
+
+stream_stats = StreamStats()
+
+# ====================== STREAMED COMPLETIONS ======================
+
+class StreamInterrupted(Exception):
+    """
+    A streamed reply failed after text had already been handed to on_text; retrying it on
+    another deployment would show that text twice, so it is not failed over.
+    """
+
+def _stream_request(agent, messages, max_tokens, params):
+    return dict(
+        model=agent_deployment(agent),
+        messages=[{"role": "system", "content": agent.system_message}] + list(messages),
+        stream=True,
+        stream_options={"include_usage": True},
+        max_completion_tokens=max_tokens,
+        **params
+    )
+
+class _StreamState:
+    def __init__(self, field, budget, on_text):
+        self.decoder = StreamedFieldDecoder(field)
+        self.field = field
+        self.budget = budget
+        self.on_text = on_text
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.parts = []
+        self.tokens = 0
+        self.usage = None
+        self.usage_tokens = None
+        self.cut_off = False
+
+    def add(self, chunk):
+        """Take one stream chunk; returns True once the field has run past the budget."""
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+            self.usage_tokens = getattr(usage, "completion_tokens", None)
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return False
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+        self.tokens += 1
+        self.parts.append(delta)
+        new_text = self.decoder.feed(delta)
+        if new_text and self.on_text:
+            self.on_text(new_text)
+        self.cut_off = len(self.decoder.value) > self.budget
+        return self.cut_off
+
+    def finish(self, max_tokens):
+        tokens = self.usage_tokens if self.usage_tokens is not None else self.tokens
+        stream_stats.record(self.ttft, tokens, self.cut_off, max_tokens)
+        if self.usage is not None:
+            record_usage(self.usage)
+        else:
+            annotate(completion_tokens=tokens)
+        annotate(ttft_sec=round(self.ttft, 4) if self.ttft is not None else None, cut_off=self.cut_off)
+        if self.cut_off:
+            content = json.dumps({self.field: cut_to_budget(self.decoder.value, self.budget)})
+        else:
+            content = "".join(self.parts)
+        return content, tokens
+
+def stream_for_agent(agent, messages, client, field="formatted_message", budget=180,
+                     on_text=None, max_tokens=None, retries=None, **params):
+    """
+    Streamed agent completion that hands each decoded piece of `field` to `on_text` and stops
+    generating once the field passes `budget` characters. A cut-off reply is returned as
+    {field: value cut to the budget}. Errors after the first streamed text are raised as
+    StreamInterrupted. Returns (content, completion_tokens).
+    """
+    max_tokens = max_tokens or STREAM_MAX_TOKENS
+    request = _stream_request(agent, messages, max_tokens, params)
+
+    def call():
+        state = _StreamState(field, budget, on_text)
+        stream = client.chat.completions.create(**request)
+        try:
+            for chunk in stream:
+                if state.add(chunk):
+                    break
+        except Exception as e:
+            if state.ttft is not None:
+                raise StreamInterrupted(f"{type(e).__name__}: {e}") from e
+            raise
+        finally:
+            stream.close()
+        return state.finish(max_tokens)
+
+    return dispatch(request["model"], call, estimate_tokens(request["messages"], request["model"], max_tokens), retries)
+
+async def astream_for_agent(agent, messages, client, field="formatted_message", budget=180,
+                            on_text=None, max_tokens=None, retries=None, **params):
+    """Async stream_for_agent on an AsyncAzureOpenAI client."""
+    max_tokens = max_tokens or STREAM_MAX_TOKENS
+    request = _stream_request(agent, messages, max_tokens, params)
+
+    async def call():
+        state = _StreamState(field, budget, on_text)
+        stream = await client.chat.completions.create(**request)
+        try:
+            async for chunk in stream:
+                if state.add(chunk):
+                    break
+        except Exception as e:
+            if state.ttft is not None:
+                raise StreamInterrupted(f"{type(e).__name__}: {e}") from e
+            raise
+        finally:
+            await stream.close()
+        return state.finish(max_tokens)
+
+    return await adispatch(request["model"], call, estimate_tokens(request["messages"], request["model"], max_tokens),
+                           retries)
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from async_pipeline import acomplete_for_agent, get_async_azure_client
+from reply_streaming import stream_for_agent, astream_for_agent
+from llm_cache import get_response_cache, agent_cache_key, agent_deployment
+from llm_dispatch import dispatch, estimate_tokens
+from model_router import model_router, TASK_CLASSES
+from instrumentation import span, record_usage
+
+# 'json_schema' sends each model's schema as a strict response_format, 'json_object' only asks for JSON
+# (for deployments without structured-output support), 'off' sends no response_format at all.
+STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', 'json_schema')
+STRUCTURED_REPAIRS = int(os.getenv('STRUCTURED_REPAIRS', '1'))
+
+class ResponseParseError(ValueError):
+    """An agent reply that does not match its response model."""
+
+# ====================== SCHEMAS ======================
+
+def object_schema(properties):
+    """Strict JSON schema for an object: every property is required and no others are allowed."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+def array_schema(items):
+    return {"type": "array", "items": items}
+
+STRING = {"type": "string"}
+BOOLEAN = {"type": "boolean"}
+INTEGER = {"type": "integer"}
+POLITICAL_CATEGORIES = ["far-left", "left", "middle", "right", "far-right"]
+
+class ResponseModel:
+    """
+    A named JSON schema for one task's agent reply.
+
+    `response_format()` is what goes to the chat completions API; `parse()` is the one parser
+    for replies, returning the validated object or raising ResponseParseError. Enum values are
+    matched case-insensitively and returned in their canonical spelling.
+    """
+
+    def __init__(self, name, schema):
+        self.name = name
+        self.schema = schema
+
+    def response_format(self):
+        if STRUCTURED_OUTPUT == "json_schema":
+            return {"type": "json_schema", "json_schema": {"name": self.name, "schema": self.schema, "strict": True}}
+        if STRUCTURED_OUTPUT == "json_object":
+            return {"type": "json_object"}
+        return None
+
+    def parse(self, content):
+        if not isinstance(content, str):
+            raise ResponseParseError(f"{self.name}: expected text, got {type(content).__name__}")
+        text = content.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[4:] if text.startswith("json") else text
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ResponseParseError(f"{self.name}: invalid JSON ({e})")
+        return _validate(value, self.schema, self.name)
+
+def _validate(value, schema, path):
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise ResponseParseError(f"{path}: expected an object")
+        missing = [key for key in schema.get("required", []) if key not in value]
+        if missing:
+            raise ResponseParseError(f"{path}: missing {', '.join(missing)}")
+        return {key: _validate(value[key], sub, f"{path}.{key}")
+                for key, sub in schema["properties"].items() if key in value}
+    if kind == "array":
+        if not isinstance(value, list):
+            raise ResponseParseError(f"{path}: expected an array")
+        return [_validate(item, schema["items"], f"{path}[{i}]") for i, item in enumerate(value)]
+    if kind == "string":
+        if not isinstance(value, str):
+            raise ResponseParseError(f"{path}: expected a string")
+        if "enum" in schema:
+            canonical = {option.lower(): option for option in schema["enum"]}
+            if value.strip().lower() not in canonical:
+                raise ResponseParseError(f"{path}: {value!r} is not one of {schema['enum']}")
+            return canonical[value.strip().lower()]
+        return value
+    if kind == "boolean":
+        if not isinstance(value, bool):
+            raise ResponseParseError(f"{path}: expected a boolean")
+        return value
+    if kind == "integer":
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ResponseParseError(f"{path}: expected an integer")
+        return value
+    return value
+
+POLITICAL_ANALYSIS = ResponseModel("political_analysis", object_schema({
+    "category": {"type": "string", "enum": POLITICAL_CATEGORIES},
+    "reasoning": STRING
+}))
+
+MESSAGE_ANALYSIS = ResponseModel("message_analysis", object_schema({
+    "analyses": array_schema(object_schema({
+        "number": INTEGER,
+        "category": {"type": "string", "enum": ["neutral", "informational", "opinion", "question"]},
+        "subject": STRING,
+        "style": STRING
+    }))
+}))
+
+REPLY = ResponseModel("reply", object_schema({
+    "formatted_message": STRING
+}))
+
+VALIDATION = ResponseModel("validation", object_schema({
+    "valid": BOOLEAN,
+    "edited_response": STRING,
+    "feedback": STRING
+}))
+
+FUSED_REPLY = ResponseModel("fused_reply", object_schema({
+    "category": {"type": "string", "enum": POLITICAL_CATEGORIES},
+    "reasoning": STRING,
+    "draft": STRING,
+    "valid": BOOLEAN,
+    "feedback": STRING,
+    "final_reply": STRING
+}))
+
+SUBJECT_ANALYSIS = ResponseModel("subject_analysis", object_schema({
+    "results": array_schema(object_schema({
+        "number": INTEGER,
+        "intent": STRING,
+        "tone": STRING
+    }))
+}))
+
+# ====================== METRICS ======================
+
+class ParseMetrics:
+    """Per-model counts of parsed replies, parse failures, repaired replies and given-up requests."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(model.name, {"parsed": 0, "failures": 0, "repaired": 0, "gave_up": 0})
+            counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+parse_metrics = ParseMetrics()
+
+# ====================== STRUCTURED CALLS ======================
+
+def repair_request(messages, content, error, model):
+    """The original request plus the malformed reply and what was wrong with it."""
+    return list(messages) + [
+        {"role": "assistant", "content": content if isinstance(content, str) else json.dumps(content)},
+        {"role": "user", "content": (
+            f"That reply could not be used: {error}. Reply again with only a JSON object "
+            f"matching this schema: {json.dumps(model.schema)}"
+        )}
+    ]
+
+def _completion_params(model):
+    response_format = model.response_format()
+    return {"response_format": response_format} if response_format else {}
+
+def complete_for_agent(agent, messages, client, retries=None, **params):
+    """
+    agent.generate_reply(messages=...) equivalent for plain replies, called on an AzureOpenAI
+    client so request parameters such as response_format can be passed. The call goes through the
+    deployment's dispatcher (rate limits, throttle retries). Returns (content, total_tokens).
+    """
+    deployment = agent_deployment(agent)
+    request = [{"role": "system", "content": agent.system_message}] + list(messages)
+
+    def call():
+        completion = client.chat.completions.create(model=deployment, messages=request, **params)
+        usage = getattr(completion, "usage", None)
+        record_usage(usage)
+        return completion.choices[0].message.content, getattr(usage, "total_tokens", 0) or 0
+
+    return dispatch(deployment, call, estimate_tokens(request, deployment, params.get("max_completion_tokens")), retries)
+
+def structured_reply(agent, messages, model, client, cache=None, repairs=None, stream=None):
+    """
+    Ask `agent` for a reply matching `model` and return the parsed object.
+
+    Only replies that parse are cached, under the original request. A malformed reply is sent
+    back once per repair (STRUCTURED_REPAIRS by default) with the parse error;
+    ResponseParseError is raised when no attempt parses.
+
+    `stream`, if given, holds stream_for_agent options (field, budget, on_text): the reply is
+    streamed and generation stops once that field passes its character budget.
+
+    Each attempt goes to the deployment the model router picks for the model's task class among
+    the agent's config_list entries, failing over to the next entry on errors.
+    """
+    with span(f"llm:{agent.name}", "llm", response_model=model.name):
+        return _structured_reply(agent, messages, model, client, cache, repairs, stream)
+
+def _structured_reply(agent, messages, model, client, cache, repairs, stream):
+    cache = cache or get_response_cache()
+    params = _completion_params(model)
+    repairs = STRUCTURED_REPAIRS if repairs is None else repairs
+    key = agent_cache_key(agent, messages, {"response_model": model.name, **params})
+    cached = cache.get(key)
+    if cached is not None:
+        try:
+            return model.parse(cached)
+        except ResponseParseError:
+            cache.delete(key)
+    request, tokens, latency = list(messages), 0, 0.0
+
+    def complete(routed, **options):
+        if stream is not None:
+            return stream_for_agent(routed, request, client, **stream, **params, **options)
+        return complete_for_agent(routed, request, client, **params, **options)
+
+    for attempt in range(repairs + 1):
+        started = time.perf_counter()
+        content, used, deployment = model_router.call(agent, TASK_CLASSES.get(model.name, model.name), complete)
+        tokens, latency = tokens + used, latency + time.perf_counter() - started
+        try:
+            parsed = model.parse(content)
+        except ResponseParseError as e:
+            parse_metrics.record(model, "failures")
+            error = e
+            request = repair_request(messages, content, e, model)
+            continue
+        cache.set(key, content, deployment=deployment, tokens=tokens, latency=latency)
+        parse_metrics.record(model, "repaired" if attempt else "parsed")
+        return parsed
+    parse_metrics.record(model, "gave_up")
+    raise error
+
+async def astructured_reply(agent, messages, model, cache=None, repairs=None, stream=None):
+    """Async structured_reply on the shared AsyncAzureOpenAI client."""
+    with span(f"llm:{agent.name}", "llm", response_model=model.name):
+        return await _astructured_reply(agent, messages, model, cache, repairs, stream)
+
+async def _astructured_reply(agent, messages, model, cache, repairs, stream):
+    cache = cache or get_response_cache()
+    params = _completion_params(model)
+    repairs = STRUCTURED_REPAIRS if repairs is None else repairs
+    key = agent_cache_key(agent, messages, {"response_model": model.name, **params})
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        try:
+            return model.parse(cached)
+        except ResponseParseError:
+            await asyncio.to_thread(cache.delete, key)
+    request, tokens, latency = list(messages), 0, 0.0
+
+    async def complete(routed, **options):
+        if stream is not None:
+            return await astream_for_agent(routed, request, get_async_azure_client(), **stream, **params, **options)
+        return await acomplete_for_agent(routed, request, **params, **options)
+
+    for attempt in range(repairs + 1):
+        started = time.perf_counter()
+        content, used, deployment = await model_router.acall(agent, TASK_CLASSES.get(model.name, model.name), complete)
+        tokens, latency = tokens + used, latency + time.perf_counter() - started
+        try:
+            parsed = model.parse(content)
+        except ResponseParseError as e:
+            parse_metrics.record(model, "failures")
+            error = e
+            request = repair_request(messages, content, e, model)
+            continue
+        await asyncio.to_thread(
+            cache.set, key, content, deployment=deployment, tokens=tokens, latency=latency
+        )
+        parse_metrics.record(model, "repaired" if attempt else "parsed")
+        return parsed
+    parse_metrics.record(model, "gave_up")
+    raise error
@@ -0,0 +1,416 @@
+import os
+import time
+import json
+import random
+import sqlite3
+import asyncio
+import datetime
+import threading
+from bsky_session import get_session_manager
+from xrpc_client import get_xrpc_client
+from blob_upload import blob_to_json
+from rate_limits import TokenBucket, backoff_delay, BACKOFF_BASE_SECONDS
+from instrumentation import span, current_workflows, in_workflows
+
+# The PDS charges write points per record (create 3, update 2, delete 1) against an hourly and a
+# daily budget per account; its ratelimit-* headers replace these defaults once seen.
+WRITE_POINTS_PER_CREATE = 3
+ACCOUNT_POINT_LIMITS = {3600: 5000, 86400: 35000}
+# Our own ceilings per action type and hour, well inside the point budget; override with
+# e.g. BSKY_WRITE_LIMITS="post=300,reply=600,like=1500".
+ACTION_LIMITS = {"post": 300, "reply": 600, "like": 1500}
+ACTION_LIMITS.update({
+    action: int(limit) for action, limit in
+    (item.split("=") for item in os.getenv('BSKY_WRITE_LIMITS', '').split(",") if "=" in item)
+})
+ACTION_COLLECTIONS = {"post": "app.bsky.feed.post", "reply": "app.bsky.feed.post", "like": "app.bsky.feed.like"}
+
+# applyWrites takes up to 200 operations; smaller batches keep a failed batch cheap to retry.
+WRITE_BATCH_SIZE = int(os.getenv('BSKY_WRITE_BATCH', '25'))
+# How long the writer waits for more writes to join a batch before sending it.
+WRITE_LINGER_SECONDS = float(os.getenv('BSKY_WRITE_LINGER', '0.05'))
+WRITE_WAIT_SECONDS = float(os.getenv('BSKY_WRITE_WAIT', '60'))
+WRITE_MAX_ATTEMPTS = int(os.getenv('BSKY_WRITE_ATTEMPTS', '8'))
+
+# ====================== RECORDS ======================
+
+TID_CHARS = "234567abcdefghijklmnopqrstuvwxyz"
+_clock_id = random.randrange(1024)
+
+def new_tid():
+    """A timestamp identifier for a record key, so a write replayed after a crash cannot create a duplicate."""
+    value = (time.time_ns() // 1000) << 10 | _clock_id
+    chars = []
+    for _ in range(13):
+        chars.append(TID_CHARS[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def jsonable(value):
+    """Turn SDK models (e.g. uploaded blob refs inside an embed) into plain JSON values."""
+    if isinstance(value, dict):
+        return {key: jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return blob_to_json(value)
+    return value
+
+def post_record(text, reply=None, embed=None, langs=("en",)):
+    """An app.bsky.feed.post record; `reply` is a root/parent pair from reply_refs_for."""
+    record = {"$type": "app.bsky.feed.post", "text": text, "createdAt": now_iso(), "langs": list(langs)}
+    if reply:
+        record["reply"] = reply
+    if embed:
+        record["embed"] = jsonable(embed)
+    return record
+
+def like_record(uri, cid):
+    return {"$type": "app.bsky.feed.like", "subject": {"uri": uri, "cid": cid}, "createdAt": now_iso()}
+
+# ====================== RATE LIMITS ======================
+
+def parse_rate_limit(headers):
+    """Return (limit, remaining, reset_at, window) from ratelimit-* headers, or None without them."""
+    try:
+        limit = int(headers["ratelimit-limit"])
+        remaining = int(headers["ratelimit-remaining"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    reset_at = float(headers.get("ratelimit-reset") or 0) or None
+    window = None
+    for part in (headers.get("ratelimit-policy") or "").split(";"):
+        if part.strip().startswith("w="):
+            window = int(part.strip()[2:])
+    return limit, remaining, reset_at, window
+
+def queued_message(status, attempts, next_attempt_at, last_error):
+    """Why a submitted write is still unsent, from its queue row."""
+    retry_in = max((next_attempt_at or 0) - time.time(), 0)
+    if status == "sending":
+        return "The write is being sent; it is queued and will complete shortly"
+    if not last_error:
+        return "Waiting for rate-limit headroom; the write is queued and will be sent shortly"
+    if last_error == "rate limited":
+        return f"Rate limited by the server; the write is queued and will be retried in {retry_in:.0f}s"
+    return (f"Sending failed ({last_error[:200]}); the write is queued, "
+            f"retry {attempts}/{WRITE_MAX_ATTEMPTS} in {retry_in:.0f}s")
+
+# ====================== DURABLE QUEUE ======================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT,
+    action TEXT,
+    collection TEXT,
+    rkey TEXT,
+    record TEXT,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at REAL,
+    created_at REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS writes_pending ON writes (status, account, next_attempt_at);
+"""
+
+class _FutureWaiter:
+    """Completion signal for an async submit: set() from the writer thread resolves a future on its loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            pass  # the submitting loop has closed; nobody is waiting any more
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class WriteQueue:
+    """
+    Rate-limit-aware scheduler for record creates (posts, replies, likes).
+
+    Writes are stored in SQLite before anything is sent, so writes still pending when the
+    process stops are sent by the next one. A background writer sends ready writes in
+    com.atproto.repo.applyWrites batches, admitting each write only when both its action's
+    token bucket and the account's write-point buckets allow it. Buckets follow the server's
+    ratelimit-* headers. A 429 waits for the reset time; server and network errors retry with
+    jittered exponential backoff up to WRITE_MAX_ATTEMPTS.
+
+    `submit()` waits for the write to be sent, up to `wait` seconds. A write still unsent by then
+    (waiting for rate-limit headroom or a retry) is reported as 'queued', with the reason, and is
+    sent later. A replayed create whose record already exists under its rkey counts as written.
+    """
+
+    def __init__(self, path, xrpc_factory=get_xrpc_client, session_manager=None,
+                 batch_size=WRITE_BATCH_SIZE, linger=WRITE_LINGER_SECONDS):
+        self.path = path
+        self.xrpc_factory = xrpc_factory
+        self.session_manager = session_manager or get_session_manager()
+        self.batch_size = min(batch_size, 200)
+        self.linger = linger
+        self.counts = {"submitted": 0, "written": 0, "batches": 0, "retries": 0, "rate_limited": 0, "failed": 0}
+        self._action_buckets = {}
+        self._point_buckets = {}
+        self._waiters = {}
+        # Workflows each waiting write was submitted from, so its applyWrites span counts towards them.
+        self._workflows = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        # Writes that were in flight when the last process stopped are sent again; their fixed
+        # record keys keep a write that did land from being created twice.
+        self._db.execute("UPDATE writes SET status = 'pending' WHERE status = 'sending'")
+        self._db.commit()
+
+    # ----- public -----
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bsky-write-queue", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, action, record, message=None, wait=WRITE_WAIT_SECONDS):
+        """
+        Queue one record create and wait up to `wait` seconds for it to be written.
+        Returns {"status": "success"|"queued"|"error", "message", "uri", "cid", "write_id"}.
+        """
+        done = threading.Event()
+        write_id = self._enqueue(action, record, done)
+        done.wait(wait)
+        return self._outcome(write_id, message)
+
+    async def asubmit(self, action, record, message=None, wait=WRITE_WAIT_SECONDS):
+        """submit() for coroutines: the writer thread resolves a future, so no thread is held while waiting."""
+        loop = asyncio.get_running_loop()
+        done = _FutureWaiter(loop)
+        write_id = await asyncio.to_thread(self._enqueue, action, record, done)
+        await asyncio.wait([done.future], timeout=wait)
+        return self._outcome(write_id, message)
+
+    def _enqueue(self, action, record, waiter):
+        account = self.session_manager.get_session()["did"]
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO writes (account, action, collection, rkey, record, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (account, action, ACTION_COLLECTIONS[action], new_tid(), json.dumps(record), time.time(), time.time())
+            )
+            self._db.commit()
+            write_id = cursor.lastrowid
+            self._waiters[write_id] = waiter
+            self._workflows[write_id] = current_workflows()
+            self.counts["submitted"] += 1
+        self.start()
+        self._wake.set()
+        return write_id
+
+    def _outcome(self, write_id, message):
+        with self._lock:
+            self._waiters.pop(write_id, None)
+            self._workflows.pop(write_id, None)
+            row = self._db.execute(
+                "SELECT status, attempts, next_attempt_at, result FROM writes WHERE id = ?", (write_id,)
+            ).fetchone()
+        result = json.loads(row["result"]) if row["result"] else {}
+        if row["status"] == "done":
+            return {"status": "success", "message": message or "Written successfully",
+                    "uri": result.get("uri"), "cid": result.get("cid"), "write_id": write_id}
+        if row["status"] == "failed":
+            return {"status": "error", "message": f"Error: {result.get('error')}", "write_id": write_id}
+        return {"status": "queued", "message": queued_message(row["status"], row["attempts"],
+                                                              row["next_attempt_at"], result.get("last_error")),
+                "write_id": write_id}
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM writes WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+    def stats(self):
+        pending = self.pending()
+        with self._lock:
+            report = dict(self.counts, pending=pending)
+            report["mean_batch_size"] = round(self.counts["written"] / self.counts["batches"], 2) if self.counts["batches"] else 0
+            report["buckets"] = {
+                f"{account}:{action}": round(bucket.tokens, 1)
+                for (account, action), bucket in self._action_buckets.items()
+            }
+            return report
+
+    # ----- writer -----
+
+    def _run(self):
+        while True:
+            try:
+                delay = self._flush_once()
+            except Exception as e:
+                print(f"Write queue error: {e}")
+                delay = BACKOFF_BASE_SECONDS
+            if delay:
+                self._wake.wait(delay)
+                self._wake.clear()
+
+    def _buckets_for(self, account, action):
+        if (account, action) not in self._action_buckets:
+            self._action_buckets[(account, action)] = TokenBucket(ACTION_LIMITS.get(action, 300), 3600)
+        for window, limit in ACCOUNT_POINT_LIMITS.items():
+            self._point_buckets.setdefault((account, window), TokenBucket(limit, window))
+        points = [bucket for (owner, _), bucket in self._point_buckets.items() if owner == account]
+        return self._action_buckets[(account, action)], points
+
+    def _flush_once(self):
+        """Send one batch if any writes are ready; returns how long to sleep before the next look."""
+        time.sleep(self.linger)
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM writes WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size * 4)
+            ).fetchall()
+            if not rows:
+                upcoming = self._db.execute(
+                    "SELECT MIN(next_attempt_at) FROM writes WHERE status = 'pending'"
+                ).fetchone()[0]
+                return max(upcoming - now, 0.01) if upcoming else 60.0
+            account = rows[0]["account"]
+            batch, wait = [], None
+            for row in rows:
+                if row["account"] != account or len(batch) >= self.batch_size:
+                    continue
+                action_bucket, point_buckets = self._buckets_for(account, row["action"])
+                needed = max([action_bucket.wait_time(1, now)] +
+                             [bucket.wait_time(WRITE_POINTS_PER_CREATE, now) for bucket in point_buckets])
+                if needed > 0:
+                    wait = needed if wait is None else min(wait, needed)
+                    continue
+                action_bucket.take(1)
+                for bucket in point_buckets:
+                    bucket.take(WRITE_POINTS_PER_CREATE)
+                batch.append(row)
+            if not batch:
+                return wait
+            self._db.executemany("UPDATE writes SET status = 'sending' WHERE id = ?", [(row["id"],) for row in batch])
+            self._db.commit()
+        self._send(account, batch)
+        return 0
+
+    def _send(self, account, rows):
+        writes = [{
+            "$type": "com.atproto.repo.applyWrites#create",
+            "collection": row["collection"],
+            "rkey": row["rkey"],
+            "value": json.loads(row["record"])
+        } for row in rows]
+        # Queue wait is how long the oldest write in the batch has been waiting to be sent.
+        queued = max(time.time() - min(row["created_at"] or time.time() for row in rows), 0.0)
+        with self._lock:
+            workflow_ids = {workflow_id for row in rows for workflow_id in self._workflows.get(row["id"], ())}
+        try:
+            with in_workflows(workflow_ids):
+                with span("bluesky:applyWrites", writes=len(rows), queue_wait_sec=round(queued, 4)) as record:
+                    response = self.xrpc_factory().post("com.atproto.repo.applyWrites",
+                                                        {"repo": account, "writes": writes})
+                    record["status_code"] = response.status_code
+                    record["outcome"] = "ok" if response.status_code == 200 else "error"
+        except Exception as e:
+            self._retry(rows, backoff_delay(max(row["attempts"] for row in rows)), str(e))
+            return
+        self._sync_limits(account, response.headers)
+        if response.status_code == 200:
+            body = response.json() if response.content else {}
+            results = body.get("results") or [{} for _ in rows]
+            with self._lock:
+                self.counts["batches"] += 1
+                self.counts["written"] += len(rows)
+            for row, result in zip(rows, results):
+                uri = result.get("uri") or f"at://{account}/{row['collection']}/{row['rkey']}"
+                self._finish(row, "done", {"uri": uri, "cid": result.get("cid")})
+        elif response.status_code == 429:
+            limit = parse_rate_limit(response.headers)
+            reset_in = (limit[2] - time.time()) if limit and limit[2] else 0
+            with self._lock:
+                self.counts["rate_limited"] += 1
+            self._retry(rows, max(reset_in, backoff_delay(max(row["attempts"] for row in rows))),
+                        "rate limited", count_attempt=False)
+        elif response.status_code >= 500:
+            self._retry(rows, backoff_delay(max(row["attempts"] for row in rows)), response.text)
+        elif len(rows) > 1:
+            # One bad record fails the whole batch; send each write alone to find it.
+            for row in rows:
+                self._send(account, [row])
+        elif "already exists" in response.text.lower():
+            # A write replayed after a crash whose record (under our own rkey) did land the first time.
+            self._finish(rows[0], "done", {"uri": f"at://{account}/{rows[0]['collection']}/{rows[0]['rkey']}", "cid": None})
+        else:
+            self._finish(rows[0], "failed", {"error": response.text})
+
+    def _sync_limits(self, account, headers):
+        limit = parse_rate_limit(headers)
+        if not limit:
+            return
+        capacity, remaining, reset_at, window = limit
+        window = window or 3600
+        with self._lock:
+            bucket = self._point_buckets.setdefault((account, window), TokenBucket(capacity, window))
+            bucket.sync(capacity, remaining, reset_at)
+
+    def _retry(self, rows, delay, error, count_attempt=True):
+        with self._lock:
+            for row in rows:
+                attempts = row["attempts"] + (1 if count_attempt else 0)
+                if attempts >= WRITE_MAX_ATTEMPTS:
+                    self.counts["failed"] += 1
+                    self._db.execute("UPDATE writes SET status = 'failed', attempts = ?, result = ? WHERE id = ?",
+                                     (attempts, json.dumps({"error": error}), row["id"]))
+                    self._notify(row["id"])
+                else:
+                    self.counts["retries"] += 1
+                    self._db.execute(
+                        "UPDATE writes SET status = 'pending', attempts = ?, next_attempt_at = ?, result = ? WHERE id = ?",
+                        (attempts, time.time() + delay, json.dumps({"last_error": error}), row["id"])
+                    )
+            self._db.commit()
+
+    def _finish(self, row, status, result):
+        with self._lock:
+            if status == "failed":
+                self.counts["failed"] += 1
+            self._db.execute("UPDATE writes SET status = ?, result = ? WHERE id = ?",
+                             (status, json.dumps(result), row["id"]))
+            self._db.commit()
+            self._notify(row["id"])
+
+    def _notify(self, write_id):
+        waiter = self._waiters.get(write_id)
+        if waiter is not None:
+            waiter.set()
+
+# ====================== SHARED INSTANCE ======================
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """Return the shared write queue, started (pending writes from earlier runs are sent first)."""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(os.getenv('BSKY_WRITE_QUEUE_FILE', 'bsky_writes.db')).start()
+        return _write_queue
@@ -0,0 +1,110 @@
+import os
+import threading
+import importlib.util
+import requests
+from requests.adapters import HTTPAdapter
+from bsky_session import get_session_manager
+
+# httpx is optional; with the 'h2' package installed it gives us HTTP/2 multiplexing.
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec("h2") is not None
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# ====================== POOLED XRPC CLIENT ======================
+
+class XrpcClient:
+    """
+    Minimal XRPC client over one pooled, keep-alive HTTP session.
+
+    Requests reuse open connections (HTTP/2 when httpx and h2 are installed,
+    otherwise a pooled requests.Session), and authenticated calls use the
+    access token of the shared atproto session instead of creating a new one.
+    """
+
+    def __init__(self, base_url=None, session_manager=None, timeout=10.0, pool_size=10):
+        self.base_url = (base_url or os.getenv('BSKY_BASE_URL', 'https://bsky.social')).rstrip('/')
+        self.session_manager = session_manager or get_session_manager()
+        self.timeout = timeout
+        self.http2 = HTTP2_AVAILABLE
+        if self.http2:
+            self._http = httpx.Client(
+                http2=True,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            )
+        else:
+            self._http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self._http.mount("https://", adapter)
+            self._http.mount("http://", adapter)
+
+    def get(self, nsid, params=None, auth=True):
+        """Call an XRPC query and return the HTTP response."""
+        return self._request("GET", nsid, params=params, auth=auth)
+
+    def post(self, nsid, data=None, auth=True):
+        """Call an XRPC procedure with a JSON body and return the HTTP response."""
+        return self._request("POST", nsid, json_body=data, auth=auth)
+
+    def upload_file(self, nsid, path, mime_type, auth=True):
+        """
+        Call an XRPC procedure whose body is a file (e.g. com.atproto.repo.uploadBlob).
+        The file is streamed from disk in chunks instead of being read into memory.
+        """
+        url = f"{self.base_url}/xrpc/{nsid}"
+        response = self._send_file(url, path, mime_type, auth)
+        if auth and response.status_code == 401:
+            self.session_manager.refresh()
+            response = self._send_file(url, path, mime_type, auth)
+        return response
+
+    def close(self):
+        self._http.close()
+
+    def _request(self, method, nsid, params=None, json_body=None, auth=True):
+        url = f"{self.base_url}/xrpc/{nsid}"
+        response = self._send(method, url, params, json_body, auth)
+        if auth and response.status_code == 401:
+            # Token was revoked or expired server-side; refresh once and retry.
+            self.session_manager.refresh()
+            response = self._send(method, url, params, json_body, auth)
+        return response
+
+    def _send(self, method, url, params, json_body, auth):
+        headers = {"Accept": "application/json"}
+        if auth:
+            headers["Authorization"] = f"Bearer {self.session_manager.get_session()['access_jwt']}"
+        if self.http2:
+            return self._http.request(method, url, params=params, json=json_body, headers=headers)
+        return self._http.request(method, url, params=params, json=json_body, headers=headers, timeout=self.timeout)
+
+    def _send_file(self, url, path, mime_type, auth):
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": mime_type,
+            "Content-Length": str(os.path.getsize(path))
+        }
+        if auth:
+            headers["Authorization"] = f"Bearer {self.session_manager.get_session()['access_jwt']}"
+        with open(path, "rb") as f:
+            if self.http2:
+                return self._http.post(url, content=iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""), headers=headers,
+                                       timeout=None)
+            return self._http.post(url, data=f, headers=headers, timeout=(self.timeout, None))
+
+# ====================== SHARED INSTANCE ======================
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_xrpc_client():
+    """Return the process-wide pooled XRPC client."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = XrpcClient()
+        return _default_client